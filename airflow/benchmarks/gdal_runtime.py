@@ -0,0 +1,238 @@
+"""
+/*********************************************************************************/
+ *  The MIT License (MIT)                                                         *
+ *                                                                                *
+ *  Copyright (c) 2014 EOX IT Services GmbH                                       *
+ *                                                                                *
+ *  Permission is hereby granted, free of charge, to any person obtaining a copy  *
+ *  of this software and associated documentation files (the "Software"), to deal *
+ *  in the Software without restriction, including without limitation the rights  *
+ *  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell     *
+ *  copies of the Software, and to permit persons to whom the Software is         *
+ *  furnished to do so, subject to the following conditions:                      *
+ *                                                                                *
+ *  The above copyright notice and this permission notice shall be included in    *
+ *  all copies or substantial portions of the Software.                           *
+ *                                                                                *
+ *  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR    *
+ *  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,      *
+ *  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE   *
+ *  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER        *
+ *  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, *
+ *  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE *
+ *  SOFTWARE.                                                                     *
+ *                                                                                *
+ *********************************************************************************/
+"""
+
+"""Sweep GDAL runtime profiles over sample rasters to find the best
+gdal_runtime for a worker.
+
+The profiles combine the block cache size (GDAL_CACHEMAX), the threads of the
+codecs (GDAL_NUM_THREADS/NUM_THREADS), the threads and memory of gdalwarp
+(-multi -wo NUM_THREADS -wm), the VSI cache (VSI_CACHE/VSI_CACHE_SIZE) and
+GDAL_DISABLE_READDIR_ON_OPEN. With every profile, each raster is warped to
+the target SRS (the S1 hot path) and translated to a tiled, compressed
+GeoTIFF whose overviews are built, the work done by the GDAL operators,
+through the same helpers as the operators. Run it on the worker size to tune,
+e.g.:
+
+    python benchmarks/gdal_runtime.py --cachemax 128 512 1024 \
+        --threads 1 2 ALL_CPUS --warp-threads 1 ALL_CPUS \
+        --warp-memory 256 1024 /data/samples/*.TIF
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from subprocess import check_call
+
+# the plugins, and the DAG configs imported by them
+for directory in ("dags", "plugins"):
+    sys.path.insert(0, os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", directory))
+
+from gdal_plugin import (  # noqa: E402
+    DEFAULT_MIN_OVERVIEW_SIZE,
+    gdal_addo,
+    gdal_translate,
+    get_gdal_translate_command,
+    get_gdaladdo_command,
+    get_raster_layout,
+    get_runtime_config,
+    get_runtime_creation_options,
+    plan_overview_levels,
+    warp_file,
+)
+
+log = logging.getLogger(__name__)
+
+CREATION_OPTIONS = {
+    "TILED": "YES",
+    "BLOCKXSIZE": 512,
+    "BLOCKYSIZE": 512,
+    "COMPRESS": "DEFLATE",
+}
+
+
+def get_profiles(cachemax_values, thread_values, warp_thread_values,
+                 warp_memory_values, vsi_cache_values, readdir_values):
+    """Return the gdal_runtime of every combination of the swept values. A
+    VSI cache size of 0 disables the cache."""
+    profiles = []
+    for (cachemax, threads, warp_threads, warp_memory, vsi_cache,
+         readdir) in itertools.product(
+            cachemax_values, thread_values, warp_thread_values,
+            warp_memory_values, vsi_cache_values, readdir_values):
+        config = {
+            "GDAL_CACHEMAX": cachemax,
+            "GDAL_NUM_THREADS": threads,
+            "VSI_CACHE": "TRUE" if int(vsi_cache) else "FALSE",
+            "GDAL_DISABLE_READDIR_ON_OPEN": readdir,
+        }
+        if int(vsi_cache):
+            config["VSI_CACHE_SIZE"] = int(vsi_cache) * 1024 * 1024
+        profiles.append({
+            "config": config,
+            "creation_options": {
+                "NUM_THREADS": threads,
+            },
+            "warp_threads": warp_threads,
+            "warp_memory": int(warp_memory),
+        })
+    return profiles
+
+
+def run_warp(gdal_runtime, rasters, output_dir, in_process, target_srs):
+    """Warp ``rasters`` to ``target_srs`` with ``gdal_runtime``, return the
+    time spent in seconds."""
+    started = time.time()
+    for source in rasters:
+        destination = os.path.join(
+            output_dir, "warped_" + os.path.basename(source))
+        warp_file(source, destination, target_srs,
+                  CREATION_OPTIONS["BLOCKXSIZE"], overwrite=True,
+                  in_process=in_process, gdal_runtime=gdal_runtime)
+        os.remove(destination)
+    return time.time() - started
+
+
+def run_translate(gdal_runtime, rasters, output_dir, in_process):
+    """Translate and build the overviews of ``rasters`` with ``gdal_runtime``,
+    return the time spent in seconds."""
+    started = time.time()
+    for source in rasters:
+        destination = os.path.join(output_dir, os.path.basename(source))
+        if in_process:
+            gdal_translate(source, destination, "UInt16", CREATION_OPTIONS,
+                           gdal_runtime=gdal_runtime)
+        else:
+            check_call(get_gdal_translate_command(
+                source, destination, "UInt16",
+                get_runtime_creation_options(gdal_runtime, CREATION_OPTIONS),
+                config_options=get_runtime_config(gdal_runtime)
+            ), shell=True)
+        width, height, _, _ = get_raster_layout(
+            destination, in_process, gdal_runtime)
+        levels = plan_overview_levels(width, height, DEFAULT_MIN_OVERVIEW_SIZE)
+        if in_process:
+            gdal_addo(destination, levels, "average",
+                      compress_overview="DEFLATE", gdal_runtime=gdal_runtime)
+        else:
+            check_call(get_gdaladdo_command(
+                destination, levels, "average", compress_overview="DEFLATE",
+                config_options=get_runtime_config(gdal_runtime)
+            ), shell=True)
+        os.remove(destination)
+        if os.path.exists(destination + ".ovr"):
+            os.remove(destination + ".ovr")
+    return time.time() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rasters", nargs="+", help="sample rasters")
+    parser.add_argument("--cachemax", nargs="+", default=[64, 256, 512, 1024],
+                        help="GDAL_CACHEMAX values, in MB")
+    parser.add_argument("--threads", nargs="+",
+                        default=["1", "2", "4", "ALL_CPUS"],
+                        help="GDAL_NUM_THREADS/NUM_THREADS values")
+    parser.add_argument("--warp-threads", nargs="+",
+                        default=["1", "ALL_CPUS"],
+                        help="gdalwarp -wo NUM_THREADS values")
+    parser.add_argument("--warp-memory", nargs="+", default=[64, 512],
+                        help="gdalwarp -wm values, in MB")
+    parser.add_argument("--vsi-cache", nargs="+", default=[0, 64],
+                        help="VSI_CACHE_SIZE values in MB, 0 disables the "
+                             "VSI cache")
+    parser.add_argument("--readdir", nargs="+", default=["FALSE", "EMPTY_DIR"],
+                        help="GDAL_DISABLE_READDIR_ON_OPEN values")
+    parser.add_argument("--target-srs", default="EPSG:4326",
+                        help="SRS the rasters are warped to")
+    parser.add_argument("--skip-warp", action="store_true",
+                        help="only time the translate and overviews")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of each profile, the fastest is kept")
+    parser.add_argument("--in-process", action="store_true",
+                        help="use the GDAL python bindings instead of the "
+                             "command line tools")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    output_dir = tempfile.mkdtemp(prefix="gdal_runtime_")
+    results = []
+    try:
+        profiles = get_profiles(
+            args.cachemax, args.threads, args.warp_threads, args.warp_memory,
+            args.vsi_cache, args.readdir)
+        log.info("Sweeping {} profiles".format(len(profiles)))
+        for gdal_runtime in profiles:
+            warp_seconds = 0.0
+            if not args.skip_warp:
+                warp_seconds = min(
+                    run_warp(gdal_runtime, args.rasters, output_dir,
+                             args.in_process, args.target_srs)
+                    for _ in range(args.repeat)
+                )
+            translate_seconds = min(
+                run_translate(gdal_runtime, args.rasters, output_dir,
+                              args.in_process)
+                for _ in range(args.repeat)
+            )
+            seconds = warp_seconds + translate_seconds
+            log.info("{:>6.2f}s (warp {:.2f}s, translate {:.2f}s) {} "
+                     "warp_threads={} warp_memory={}".format(
+                         seconds, warp_seconds, translate_seconds,
+                         json.dumps(gdal_runtime["config"], sort_keys=True),
+                         gdal_runtime["warp_threads"],
+                         gdal_runtime["warp_memory"]))
+            results.append({
+                "seconds": seconds,
+                "warp_seconds": warp_seconds,
+                "translate_seconds": translate_seconds,
+                "gdal_runtime": gdal_runtime,
+            })
+    finally:
+        shutil.rmtree(output_dir)
+
+    results.sort(key=lambda result: result["seconds"])
+    cpus = multiprocessing.cpu_count()
+    log.info("Best profile on {} CPUs ({:.2f}s):\n{}".format(
+        cpus, results[0]["seconds"],
+        json.dumps(results[0]["gdal_runtime"], indent=4, sort_keys=True)))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"cpus": cpus, "results": results}, fh, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
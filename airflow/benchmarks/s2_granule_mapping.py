@@ -0,0 +1,151 @@
+"""
+/*********************************************************************************/
+ *  The MIT License (MIT)                                                         *
+ *                                                                                *
+ *  Copyright (c) 2014 EOX IT Services GmbH                                       *
+ *                                                                                *
+ *  Permission is hereby granted, free of charge, to any person obtaining a copy  *
+ *  of this software and associated documentation files (the "Software"), to deal *
+ *  in the Software without restriction, including without limitation the rights  *
+ *  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell     *
+ *  copies of the Software, and to permit persons to whom the Software is         *
+ *  furnished to do so, subject to the following conditions:                      *
+ *                                                                                *
+ *  The above copyright notice and this permission notice shall be included in    *
+ *  all copies or substantial portions of the Software.                           *
+ *                                                                                *
+ *  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR    *
+ *  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,      *
+ *  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE   *
+ *  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER        *
+ *  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, *
+ *  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE *
+ *  SOFTWARE.                                                                     *
+ *                                                                                *
+ *********************************************************************************/
+"""
+
+"""Compare the granule/band enumeration of Sentinel2MetadataOperator, which
+used to reopen and scan the SAFE zip for every resolution and granule, with
+the single pass over the archive index, on a synthetic many-granule SAFE
+zip. e.g.:
+
+    python benchmarks/s2_granule_mapping.py --granules 100
+"""
+
+import argparse
+import collections
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+from safe_archive import get_archive_index  # noqa: E402
+from sentinel2_plugin import (  # noqa: E402
+    create_granules_dict,
+    get_granule_band_files,
+    get_granule_id,
+)
+
+log = logging.getLogger(__name__)
+
+BANDS = ["B01", "B02", "B03", "B04", "B05", "B06", "B07", "B08", "B8A",
+         "B09", "B10", "B11", "B12"]
+BANDS_RES = {"10": "B02", "20": "B05", "60": "B01"}  # one entry per resolution
+BANDS_DICT = dict((band, band) for band in BANDS)
+
+Granule = collections.namedtuple("Granule", ["granule_path", "footprint"])
+
+
+def create_safe_zip(path, granules_count):
+    """Write a SAFE zip of ``granules_count`` granules with 13 bands and a
+    few auxiliary files each, and return its fake granules."""
+    safe = "S2A_MSIL1C_20170101T000000_N0204_R000_T00XXX_20170101T000000.SAFE"
+    footprint = "POLYGON ((10 40, 11 40, 11 41, 10 41, 10 40))"
+    granules = []
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr(safe + "/manifest.safe", "<manifest/>")
+        for number in range(granules_count):
+            granule_id = "L1C_T00XXX_A{:06d}_20170101T000000".format(number)
+            granule_dir = "{}/GRANULE/{}".format(safe, granule_id)
+            granules.append(Granule(granule_dir, footprint))
+            archive.writestr(granule_dir + "/MTD_TL.xml", "<tile/>")
+            for band in BANDS + ["PVI"]:
+                archive.writestr("{}/IMG_DATA/T00XXX_{}_{}.jp2".format(
+                    granule_dir, number, band), "")
+            for mask in ("CLOUDS", "DEFECT", "DETFOO", "NODATA"):
+                archive.writestr("{}/QI_DATA/MSK_{}_B00.gml".format(
+                    granule_dir, mask), "")
+    return granules
+
+
+def legacy_enumeration(product, granules):
+    """The former loops: the zip is reopened and every member scanned for
+    each resolution and granule."""
+    features_count = 0
+    for _ in BANDS_RES.values():
+        features_count = 0
+        for granule in granules:
+            zipped_product = zipfile.ZipFile(product)
+            for file_name in zipped_product.namelist():
+                if file_name.endswith('.jp2') and not file_name.endswith('PVI.jp2'):
+                    features_count += 1
+    return features_count
+
+
+def single_pass_enumeration(product, granules):
+    granule_band_files = get_granule_band_files(
+        get_archive_index(product).names,
+        [get_granule_id(granule) for granule in granules])
+    granules_dict = create_granules_dict(
+        granules, granule_band_files, "/remote", BANDS_DICT)
+    return len(granules_dict["features"])
+
+
+def measure(function, repeat, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        result = function(*args)
+        timings.append(time.time() - started)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--granules", type=int, default=50,
+                        help="granules of the synthetic product")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="runs of each enumeration, the fastest is kept")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    work_dir = tempfile.mkdtemp(prefix="s2_granule_mapping_")
+    try:
+        product = os.path.join(work_dir, "product.zip")
+        granules = create_safe_zip(product, args.granules)
+        legacy_seconds, legacy_features = measure(
+            legacy_enumeration, args.repeat, product, granules)
+        # the first run builds the sidecar index, as the first reader would
+        single_pass_enumeration(product, granules)
+        seconds, features = measure(
+            single_pass_enumeration, args.repeat, product, granules)
+    finally:
+        shutil.rmtree(work_dir)
+
+    log.info("{} granules, {} band files".format(args.granules, features))
+    log.info("legacy:      {:.4f}s ({} features)".format(
+        legacy_seconds, legacy_features))
+    log.info("single pass: {:.4f}s ({} features)".format(seconds, features))
+    log.info("speedup:     {:.1f}x".format(legacy_seconds / max(seconds, 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -55,6 +55,12 @@ original_package_download_base_url = "http://cloudsdi.geo-solutions.it/data/land
 #
 
 download_url = 'http://landsat-pds.s3.amazonaws.com/c1/L8/scene_list.gz'
+# stream scene_list.gz straight into the db instead of downloading and
+# extracting it to download_dir first
+scene_list_streaming = True
+# create scene_list partitioned by year of acquisition (only effective when
+# the table does not exist yet)
+scene_list_partition_by_year = False
 
 Landsat8Area = namedtuple("Landsat8Area", [
     "name",
@@ -76,6 +82,28 @@ order_by = "acquisitiondate"
 order_type = ascending
 
 download_max = 1
+# download the bands, MTL and thumbnail of a scene within a single task using
+# a pool of concurrent downloads instead of one task per file
+scene_download = True
+scene_download_workers = 4
+# with scene_download, read the bands remotely through GDAL /vsicurl/ and
+# translate them into translated_dir instead of downloading them first
+remote_bands = False
+translated_dir = os.path.join(process_dir, "translated")
+# with remote_bands, the bands of the original package: "source" still
+# downloads the source bands, for the package only, "translated" downloads
+# no band and packages the translated ones (tiled, with overviews) instead
+original_package_bands = "source"
+# GDAL configuration of the remote reads: no directory listing, merged range
+# requests and a block cache shared by the reads of a band
+vsicurl_config = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".TIF",
+    "GDAL_HTTP_MULTIRANGE": "YES",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": 64 * 1024 * 1024,
+}
 
 # For multi paths/rows, please add different paths/rows in pairs  e.g: paths_rows= [(37,17), (38,18)] which will search for those 2 scenes.
 # For single path/row, please declare as following example: paths_rows=[(80,37)]
@@ -89,6 +117,18 @@ AREAS = [
 
 cloud_coverage = 90.9
 
+#
+# Processing
+#
+# GDAL runtime profile of the GDAL operators
+gdal_runtime = dict(config.gdal_runtime)
+# the bands come without sidecar files, do not list their directory on open
+gdal_runtime["config"] = dict(
+    config.gdal_runtime["config"], GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR")
+# write each band as a Cloud Optimized GeoTIFF in a single task instead of
+# translate + addo
+cog = False
+
 #
 # GeoServer
 #
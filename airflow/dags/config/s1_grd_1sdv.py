@@ -53,6 +53,10 @@ original_package_download_base_url = "http://cloudsdi.geo-solutions.it/data/sent
 #
 dhus_filter_max = 5
 dhus_download_max = 1
+# number of products processed by independent chains of tasks, each chain
+# downloading the product at its position in the search results sorted by
+# id. 0 processes the downloaded products in a single chain
+product_slots = 0
 dhus_search_bbox = os.path.join(config.regions_base_dir,'europe.geojson')
 dhus_search_filename = filename_filter
 dhus_search_startdate = datetime.today() - timedelta(days=14)
@@ -84,6 +88,29 @@ geoserver_oseo_wcs_scale_j = 0.1
 geoserver_oseo_wcs_format = "image/tiff"
 geoserver_oseo_wcs_version = "2.0.1"
 
+#
+# Processing
+#
+# GDAL runtime profile of the GDAL operators and readers
+gdal_runtime = dict(config.gdal_runtime)
+# warp each band into a Cloud Optimized GeoTIFF in a single task instead of
+# gdalwarp + gdaladdo
+cog = False
+# warp VV and VH of a product together, computing their shared GCP
+# transformation once (ignored with cog)
+shared_warp = False
+# error threshold, in pixels, of the approximate transformer used by gdalwarp
+warp_error_threshold = 0.125
+# extract the measurement rasters to config.extraction_cache_dir and process
+# plain files instead of reading them through /vsizip/
+extract_bands = False
+# read the metadata and quicklook of the SAFE package from memory with a
+# single open of the zip, instead of through GDAL and temporary files
+single_open_reader = True
+# render the thumbnails from the quicklook with the thumbnail engine, the
+# first size is written as thumbnail.png. None copies the quicklook as is
+thumbnail_sizes = None
+
 #
 # Product
 #
@@ -52,6 +52,10 @@ original_package_download_base_url = "http://geoserver.cloudsdi.geo-solutions.it
 #
 dhus_filter_max = 5
 dhus_download_max = dhus_filter_max
+# number of products processed by independent chains of tasks, each chain
+# downloading the product at its position in the search results sorted by
+# id. 0 processes all the products in a single chain
+product_slots = 0
 dhus_search_bbox = os.path.join(config.regions_base_dir,'europe.geojson')
 dhus_search_filename = filename_filter
 dhus_search_startdate = datetime.today() - timedelta(days=4)
@@ -84,6 +88,12 @@ geoserver_oseo_wcs_scale_j = 0.1
 geoserver_oseo_wcs_format = "image/tiff"
 geoserver_oseo_wcs_version = "2.0.1"
 
+#
+# Processing
+#
+# GDAL runtime profile of the GDAL calls
+gdal_runtime = dict(config.gdal_runtime)
+
 #
 # Product
 #
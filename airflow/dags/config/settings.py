@@ -44,6 +44,13 @@ base_dir = os.getenv('BASE_DIR','/var/data/')
 regions_base_dir = os.path.join(base_dir, 'regions')
 repository_base_dir = os.getenv('REPOSITORY_DIR',os.path.join(base_dir, 'repository'))
 templates_base_dir = os.getenv('TEMPLATES_DIR', os.path.join(PROJECT_ROOT,'plugins','templates' ))
+# rasters of the downloaded archives are extracted here, on a fast scratch
+# disk, instead of being read through /vsizip/ (see extract_bands in the
+# collection configs). The least recently used ones are removed beyond
+# extraction_cache_size bytes, once the tasks of the DAG run reading them
+# are done
+extraction_cache_dir = os.getenv('EXTRACTION_CACHE_DIR', os.path.join(base_dir, 'extracted'))
+extraction_cache_size = 50 * 1024 * 1024 * 1024
 
 #
 # Connections
@@ -57,6 +64,9 @@ dhus_download_max = dhus_filter_max
 geoserver_rest_url = 'http://localhost:8080/geoserver/rest'
 geoserver_username = 'admin'
 geoserver_password = ''
+# ids of the already published products are fetched in bulk and cached
+geoserver_published_cache_dir = os.path.join(base_dir, 'cache')
+geoserver_published_cache_ttl = timedelta(minutes=10)
 
 #eoxserver_rest_url = 'http://localhost:8080/eoxserver/product/'
 eoxserver_rest_url = None
@@ -74,6 +84,65 @@ rsync_username = os.getenv('USER','airflow')
 rsync_ssh_key = os.path.join(os.getenv('HOME','/usr/local/airflow'),'.ssh','id_rsa')
 rsync_remote_dir = '/tmp'
 
+#
+# Transfers
+#
+# read/write buffer of downloads and uploads
+transfer_buffer_size = 1024 * 1024
+# keep-alive connections kept per host
+transfer_pool_size = 10
+# (connect, read) timeouts in seconds
+transfer_timeout = (10, 300)
+
+#
+# GDAL
+#
+# run the GDAL operators through the python bindings instead of spawning the
+# command line tools for every file
+gdal_in_process = False
+# input files processed concurrently by a warp, addo or translate task, each
+# in its own process. Lower the threads of gdal_runtime when raising it
+gdal_max_workers = 1
+# default GDAL runtime profile, each collection derives its own gdal_runtime
+# from it. Use benchmarks/gdal_runtime.py to tune it for the worker size.
+gdal_runtime = {
+    # configuration options (--config) of every GDAL call
+    "config": {
+        "GDAL_CACHEMAX": 512,
+        "GDAL_NUM_THREADS": "ALL_CPUS",
+        "VSI_CACHE": "TRUE",
+        "VSI_CACHE_SIZE": 64 * 1024 * 1024,
+    },
+    # creation options added to every file written
+    "creation_options": {
+        "NUM_THREADS": "ALL_CPUS",
+    },
+    # multithreaded warping (gdalwarp -multi -wo NUM_THREADS) and its memory
+    # in MB (-wm)
+    "warp_threads": "ALL_CPUS",
+    "warp_memory": 512,
+}
+
+#
+# Thumbnails
+#
+# create the Landsat-8 and Sentinel-2 thumbnails with the GDAL thumbnail engine
+# (plugins/thumbnails.py) instead of pgmagick
+thumbnail_engine = False
+# products whose thumbnails are rendered concurrently
+thumbnail_workers = 4
+# (x, y) of the thumbnails written next to the default one, in the same decode
+extra_thumbnail_sizes = []
+
+#
+# Metadata
+#
+# products processed concurrently by the metadata tasks, each in its own
+# process. Worth raising along with dhus_filter_max
+metadata_max_workers = 1
+# skip the products whose metadata can't be created instead of failing the task
+metadata_continue_on_error = False
+
 #
 # Dates
 #
@@ -33,12 +33,14 @@ from airflow.models import DAG
 from airflow.operators import DummyOperator
 from airflow.operators import PythonOperator
 from airflow.operators import GDALAddoOperator
+from airflow.operators import GDALCOGOperator
 from airflow.operators import GDALTranslateOperator
 from airflow.operators import GDALInfoOperator
 from airflow.operators import Landsat8DownloadOperator
 from airflow.operators import Landsat8MTLReaderOperator
 from airflow.operators import Landsat8ProductDescriptionOperator
 from airflow.operators import Landsat8ProductZipFileOperator
+from airflow.operators import Landsat8SceneDownloadOperator
 from airflow.operators import Landsat8SearchOperator
 from airflow.operators import Landsat8ThumbnailOperator
 from airflow.operators import RSYNCOperator
@@ -92,35 +94,67 @@ def generate_dag(area, download_dir, default_args):
         download_dir=download_dir,
         dag=dag
     )
-    download_thumbnail = Landsat8DownloadOperator(
-        task_id="download_thumbnail",
-        download_dir=download_dir,
-        get_inputs_from=search_task.task_id,
-        url_fragment="thumb_small.jpg",
-        download_max=LANDSAT8.download_max,
-        geoserver_rest_url=CFG.geoserver_rest_url,
-        geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
-        geoserver_username=CFG.geoserver_username,
-        geoserver_password=CFG.geoserver_password,
-        dag=dag
-    )
+    if LANDSAT8.scene_download:
+        # a single task downloads all the files of the scene and pushes a
+        # dict of paths, the consumers pick their file by key
+        download_scene = Landsat8SceneDownloadOperator(
+            task_id="download_scene",
+            download_dir=download_dir,
+            get_inputs_from=search_task.task_id,
+            bands=area.bands,
+            max_workers=LANDSAT8.scene_download_workers,
+            remote_bands=LANDSAT8.remote_bands,
+            geoserver_rest_url=CFG.geoserver_rest_url,
+            geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
+            geoserver_username=CFG.geoserver_username,
+            geoserver_password=CFG.geoserver_password,
+            published_cache_dir=CFG.geoserver_published_cache_dir,
+            published_cache_ttl=CFG.geoserver_published_cache_ttl,
+            dag=dag
+        )
+        download_thumbnail = download_scene
+        thumbnail_key = "thumbnail"
+        download_metadata = download_scene
+        metadata_key = "MTL"
+    else:
+        download_thumbnail = Landsat8DownloadOperator(
+            task_id="download_thumbnail",
+            download_dir=download_dir,
+            get_inputs_from=search_task.task_id,
+            url_fragment="thumb_small.jpg",
+            download_max=LANDSAT8.download_max,
+            geoserver_rest_url=CFG.geoserver_rest_url,
+            geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
+            geoserver_username=CFG.geoserver_username,
+            geoserver_password=CFG.geoserver_password,
+            published_cache_dir=CFG.geoserver_published_cache_dir,
+            published_cache_ttl=CFG.geoserver_published_cache_ttl,
+            dag=dag
+        )
+        thumbnail_key = None
+        download_metadata = Landsat8DownloadOperator(
+            task_id="download_metadata",
+            download_dir=download_dir,
+            get_inputs_from=search_task.task_id,
+            url_fragment="MTL.txt",
+            download_max=LANDSAT8.download_max,
+            geoserver_rest_url=CFG.geoserver_rest_url,
+            geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
+            geoserver_username=CFG.geoserver_username,
+            geoserver_password=CFG.geoserver_password,
+            published_cache_dir=CFG.geoserver_published_cache_dir,
+            published_cache_ttl=CFG.geoserver_published_cache_ttl,
+            dag=dag
+        )
+        metadata_key = None
     generate_thumbnail = Landsat8ThumbnailOperator(
         task_id='generate_thumbnail',
         get_inputs_from=download_thumbnail.task_id,
+        get_inputs_key=thumbnail_key,
         thumb_size_x="64",
         thumb_size_y="64",
-        dag=dag
-    )
-    download_metadata = Landsat8DownloadOperator(
-        task_id="download_metadata",
-        download_dir=download_dir,
-        get_inputs_from=search_task.task_id,
-        url_fragment="MTL.txt",
-        download_max=LANDSAT8.download_max,
-        geoserver_rest_url=CFG.geoserver_rest_url,
-        geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
-        geoserver_username=CFG.geoserver_username,
-        geoserver_password=CFG.geoserver_password,
+        thumbnail_engine=CFG.thumbnail_engine,
+        extra_sizes=CFG.extra_thumbnail_sizes,
         dag=dag
     )
 
@@ -135,8 +169,17 @@ def generate_dag(area, download_dir, default_args):
     upload_tasks = []
     gdalinfo_tasks = []
 
-    for band in area.bands:
-        download_band = Landsat8DownloadOperator(
+    remote_bands = LANDSAT8.scene_download and LANDSAT8.remote_bands
+    if remote_bands and LANDSAT8.original_package_bands not in ("source", "translated"):
+        raise ValueError("Unknown original_package_bands: {}".format(LANDSAT8.original_package_bands))
+    if LANDSAT8.scene_download and not remote_bands:
+        download_tasks.append(download_scene)
+        download_keys = ["B{}".format(band) for band in area.bands]
+    else:
+        download_keys = None
+
+    def create_band_download_task(band):
+        return Landsat8DownloadOperator(
             task_id="download_band{}".format(band),
             download_dir=download_dir,
             get_inputs_from=search_task.task_id,
@@ -146,30 +189,81 @@ def generate_dag(area, download_dir, default_args):
             geoserver_oseo_collection=LANDSAT8.geoserver_oseo_collection,
             geoserver_username=CFG.geoserver_username,
             geoserver_password=CFG.geoserver_password,
+            published_cache_dir=CFG.geoserver_published_cache_dir,
+            published_cache_ttl=CFG.geoserver_published_cache_ttl,
             dag=dag
         )
-        download_tasks.append(download_band)
 
-        translate = GDALTranslateOperator(
-            task_id="translate_band{}".format(band),
-            get_inputs_from=download_band.task_id,
-            dag=dag
-        )
-        translate_tasks.append(translate)
+    for band in area.bands:
+        if LANDSAT8.scene_download:
+            download_band = download_scene
+            band_key = "B{}".format(band)
+        else:
+            download_band = create_band_download_task(band)
+            download_tasks.append(download_band)
+            band_key = None
+        if remote_bands and LANDSAT8.original_package_bands == "source":
+            # the source band, only downloaded for the original package
+            # while the remote one is processed
+            download_source_band = create_band_download_task(band)
+            download_source_band.set_upstream(search_task)
+            download_tasks.append(download_source_band)
 
-        addo = GDALAddoOperator(
-            task_id="add_overviews_band{}".format(band),
-            get_inputs_from=translate.task_id,
-            resampling_method="average",
-            max_overview_level=128,
-            compress_overview="PACKBITS",
-            dag=dag
-        )
-        addo_tasks.append(addo)
+        if LANDSAT8.cog:
+            # a single task writes the tiled band with its overviews
+            addo = GDALCOGOperator(
+                task_id="cog_band{}".format(band),
+                get_inputs_from=download_band.task_id,
+                get_inputs_key=band_key,
+                output_dir=LANDSAT8.translated_dir if remote_bands else None,
+                output_type="UInt16",
+                compress="DEFLATE",
+                blocksize=512,
+                resampling_method="average",
+                max_overview_level=128,
+                config_options=LANDSAT8.vsicurl_config if remote_bands else None,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=LANDSAT8.gdal_runtime,
+                dag=dag
+            )
+            translate_tasks.append(addo)
+            addo_tasks.append(addo)
+            addo.set_upstream(download_band)
+        else:
+            translate = GDALTranslateOperator(
+                task_id="translate_band{}".format(band),
+                get_inputs_from=download_band.task_id,
+                get_inputs_key=band_key,
+                output_dir=LANDSAT8.translated_dir if remote_bands else None,
+                config_options=LANDSAT8.vsicurl_config if remote_bands else None,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=LANDSAT8.gdal_runtime,
+                max_workers=CFG.gdal_max_workers,
+                dag=dag
+            )
+            translate_tasks.append(translate)
+
+            addo = GDALAddoOperator(
+                task_id="add_overviews_band{}".format(band),
+                get_inputs_from=translate.task_id,
+                resampling_method="average",
+                max_overview_level=128,
+                compress_overview="PACKBITS",
+                plan_levels=True,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=LANDSAT8.gdal_runtime,
+                max_workers=CFG.gdal_max_workers,
+                dag=dag
+            )
+            addo_tasks.append(addo)
+            translate.set_upstream(download_band)
+            addo.set_upstream(translate)
 
         gdalinfo = GDALInfoOperator(
             task_id='landsat8_gdalinfo_band_{}'.format(band),
             get_inputs_from=addo.task_id,
+            in_process=CFG.gdal_in_process,
+            gdal_runtime=LANDSAT8.gdal_runtime,
             dag=dag
         )
         gdalinfo_tasks.append(gdalinfo)
@@ -184,14 +278,17 @@ def generate_dag(area, download_dir, default_args):
             dag=dag)
         upload_tasks.append(upload)
 
-        download_band.set_upstream(search_task)
-        translate.set_upstream(download_band)
-        addo.set_upstream(translate)
+        if not LANDSAT8.scene_download:
+            download_band.set_upstream(search_task)
         gdalinfo.set_upstream(addo)
         upload.set_upstream(addo)
         join_task.set_upstream(upload)
         join_task.set_upstream(gdalinfo)
 
+    if remote_bands and LANDSAT8.original_package_bands == "translated":
+        # the bands only exist locally once translated, package them once
+        # their overviews are written
+        download_tasks = addo_tasks
     download_task_ids = ( task.task_id for task in download_tasks )
     create_original_package_task = PythonOperator(task_id="create_original_package",
                                   python_callable=create_original_package,
@@ -199,6 +296,7 @@ def generate_dag(area, download_dir, default_args):
                                       'get_inputs_from': {
                                           "search_task_id"  : search_task.task_id,
                                           "download_task_ids" : download_task_ids,
+                                          "download_keys" : download_keys,
                                       }
                                       ,
                                       'out_dir' : LANDSAT8.process_dir
@@ -239,6 +337,7 @@ def generate_dag(area, download_dir, default_args):
         get_inputs_from={
             "search_task_id"  : search_task.task_id,
             "metadata_task_id": download_metadata.task_id,
+            "metadata_key": metadata_key,
             "upload_task_ids" : upload_task_ids,
             "gdalinfo_task_id": gdalinfo_task_id,
             "upload_original_package_task_id": upload_original_package_task.task_id,
@@ -281,8 +380,11 @@ def generate_dag(area, download_dir, default_args):
                                     },
                                     dag = dag)
 
-    download_thumbnail.set_upstream(search_task)
-    download_metadata.set_upstream(search_task)
+    if LANDSAT8.scene_download:
+        download_scene.set_upstream(search_task)
+    else:
+        download_thumbnail.set_upstream(search_task)
+        download_metadata.set_upstream(search_task)
     for tid in download_tasks:
         create_original_package_task.set_upstream(tid)
     upload_original_package_task.set_upstream(create_original_package_task)
@@ -30,8 +30,10 @@ from getpass import getuser
 
 from airflow import DAG
 from airflow.operators import DownloadSceneList
+from airflow.operators import ShortCircuitOperator
 from airflow.operators import ExtractSceneList
 from airflow.operators import UpdateSceneList
+from landsat8_plugin import scene_list_modified
 
 import config as CFG
 import config.landsat8 as LANDSAT8
@@ -60,16 +62,6 @@ landsat8_scene_list = DAG(
 
 # more info on Landsat products on AWS at:
 # https://aws.amazon.com/public-datasets/landsat/
-download_scene_list_gz = DownloadSceneList(
-    task_id='download_scene_list_gz',
-    dag=landsat8_scene_list
-)
-
-extract_scene_list = ExtractSceneList(
-    task_id='extract_scene_list',
-    dag=landsat8_scene_list
-)
-
 update_scene_list_db = UpdateSceneList(
     task_id='update_scene_list',
     pg_dbname=CFG.landsat8_postgresql_credentials['dbname'],
@@ -77,8 +69,34 @@ update_scene_list_db = UpdateSceneList(
     pg_port=CFG.landsat8_postgresql_credentials['port'],
     pg_username=CFG.landsat8_postgresql_credentials['username'],
     pg_password=CFG.landsat8_postgresql_credentials['password'],
+    streaming=LANDSAT8.scene_list_streaming,
+    partition_by_year=LANDSAT8.scene_list_partition_by_year,
+    get_inputs_from=(None if LANDSAT8.scene_list_streaming
+                     else 'download_scene_list_gz'),
     dag=landsat8_scene_list
 )
 
-download_scene_list_gz.set_downstream(extract_scene_list)
-extract_scene_list.set_downstream(update_scene_list_db)
+if not LANDSAT8.scene_list_streaming:
+    download_scene_list_gz = DownloadSceneList(
+        task_id='download_scene_list_gz',
+        dag=landsat8_scene_list
+    )
+
+    # skip extraction and db update when the scene list is not modified
+    check_scene_list_modified = ShortCircuitOperator(
+        task_id='check_scene_list_modified',
+        python_callable=scene_list_modified,
+        op_kwargs={
+            'get_inputs_from': download_scene_list_gz.task_id,
+        },
+        dag=landsat8_scene_list
+    )
+
+    extract_scene_list = ExtractSceneList(
+        task_id='extract_scene_list',
+        dag=landsat8_scene_list
+    )
+
+    download_scene_list_gz.set_downstream(check_scene_list_modified)
+    check_scene_list_modified.set_downstream(extract_scene_list)
+    extract_scene_list.set_downstream(update_scene_list_db)
@@ -12,3 +12,7 @@ CREATE TABLE scene_list (
     max_lon numeric(9,5) DEFAULT NULL::numeric,
     download_url character varying(112) DEFAULT NULL::character varying
 );
+
+CREATE INDEX scene_list_productid_idx ON scene_list (productid);
+CREATE INDEX scene_list_path_row_acquisitiondate_idx ON scene_list (path, "row", acquisitiondate);
+CREATE INDEX scene_list_acquisitiondate_brin_idx ON scene_list USING brin (acquisitiondate);
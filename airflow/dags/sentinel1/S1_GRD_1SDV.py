@@ -38,12 +38,15 @@ from airflow.operators import DHUSSearchOperator
 from airflow.operators import DHUSDownloadOperator
 from airflow.operators import ZipInspector
 from airflow.operators import S1MetadataOperator
+from airflow.operators import S1WarpOperator
 from airflow.operators import GDALWarpOperator
 from airflow.operators import GDALAddoOperator
+from airflow.operators import GDALCOGOperator
 
 from airflow.utils.trigger_rule import TriggerRule
 
 from geoserver_plugin import publish_product
+from utils import slot_task_id
 import config as CFG
 import config.s1_grd_1sdv as S1GRD1SDV
 
@@ -90,15 +93,11 @@ OVERWRITE = True
 RESAMPLING_METHOD = 'average'
 MAX_OVERVIEW_LEVEL = 512
 
-def prepare_band_paths(get_inputs_from, *args, **kwargs):
+def prepare_band_paths(get_inputs_from, band_number, *args, **kwargs):
     """Get Product / Band files path Dictionary from ZipInspector and extract the list of band files """
 
     task_instance = kwargs['ti']
 
-    # band  number from task name
-    task_id = task_instance.task_id
-    band_number = int(task_id.split('_')[-1])
-
     log.info("Getting inputs from: " + get_inputs_from)
     product_bands_dict = task_instance.xcom_pull(task_ids=get_inputs_from, key=XCOM_RETURN_KEY)
     if product_bands_dict is None:
@@ -108,8 +107,12 @@ def prepare_band_paths(get_inputs_from, *args, **kwargs):
     log.info("Product Band Dictionary: {}".format(pprint.pformat(product_bands_dict)))
 
     files_path=[]
-    for k in product_bands_dict:
-        files_path += product_bands_dict[k]
+    if isinstance(product_bands_dict, dict):
+        for k in product_bands_dict:
+            files_path += product_bands_dict[k]
+    else:
+        # bands already warped by S1WarpOperator
+        files_path = product_bands_dict
 
     # Push one of the band paths to XCom
     file_path = files_path[band_number - 1]
@@ -136,143 +139,225 @@ search_task = DHUSSearchOperator(task_id='search_product_task',
                                  keywords=S1GRD1SDV.dhus_search_keywords,
                                  dag=dag)
 
-# DHUS Download Task Operator
-download_task = DHUSDownloadOperator(task_id='download_product_task',
-                                     dhus_url=CFG.dhus_url,
-                                     dhus_user=CFG.dhus_username,
-                                     dhus_pass=CFG.dhus_password,
-                                     download_max=S1GRD1SDV.dhus_download_max,
-                                     download_dir=S1GRD1SDV.download_dir,
-                                     get_inputs_from=search_task.task_id,
-                                     download_timeout=timedelta(hours=12),
-                                     dag=dag)
-
-# Rsync Archive Task for Products
-archive_task = RSYNCOperator(task_id="upload_original_package",
-                             host = CFG.rsync_hostname,
-                             remote_usr = CFG.rsync_username,
-                             ssh_key_file = CFG.rsync_ssh_key,
-                             remote_dir = S1GRD1SDV.original_package_upload_dir,
-                             get_inputs_from=download_task.task_id,
-                             dag=dag)
-
-# Zip Inspector and Extractor Task
-zip_task = ZipInspector(task_id='zip_inspector',
-                        extension_to_search='tiff',
-                        get_inputs_from=download_task.task_id,
-                        dag=dag)
-
-warp_tasks = []
-addo_tasks = []
-upload_tasks = []
-band_paths_tasks = []
-for i in range(1, 3):
-    band_paths = PythonOperator(task_id="get_band_paths_" + str(i),
-         python_callable=prepare_band_paths,
-         op_kwargs={
-             'get_inputs_from': zip_task.task_id
-         },
-         dag=dag)
-    band_paths_tasks.append(band_paths)
-
-    warp = GDALWarpOperator(
-        task_id='gdalwarp_' + str(i),
-        target_srs=TARGET_SRS,
-        tile_size=TILE_SIZE,
-        overwrite=OVERWRITE,
-        dstdir=S1GRD1SDV.process_dir,
-        get_inputs_from=band_paths.task_id,
-        dag=dag
-    )
-    warp_tasks.append(warp)
-
-    addo = GDALAddoOperator(
-        trigger_rule=TriggerRule.ALL_SUCCESS,
-        resampling_method=RESAMPLING_METHOD,
-        max_overview_level=MAX_OVERVIEW_LEVEL,
-        task_id='gdal_addo_' + str(i),
-        get_inputs_from=warp.task_id,
-        dag=dag
-    )
-    addo_tasks.append(addo)
-
-    upload = RSYNCOperator(task_id="upload_granule_{}_task".format(str(i)),
-                                          host=CFG.rsync_hostname,
-                                          remote_usr=CFG.rsync_username,
-                                          ssh_key_file=CFG.rsync_ssh_key,
-                                          remote_dir=S1GRD1SDV.repository_dir,
-                                          get_inputs_from=addo.task_id,
-                                          dag=dag)
-    upload_tasks.append(upload)
-
-    band_paths.set_upstream(zip_task)
-    warp.set_upstream(band_paths)
-    addo.set_upstream(warp)
-    upload.set_upstream(addo)
-
-# Metadata Extraction task
-addo_task_ids = ( task.task_id for task in addo_tasks )
-upload_task_ids = ( task.task_id for task in upload_tasks )
-metadata_task = S1MetadataOperator(task_id="extract_metadata_task",
-                                   product_safe_path=None,
-                                   granules_paths=None,
-                                   granules_upload_dir=S1GRD1SDV.repository_dir,
-                                   processing_dir=S1GRD1SDV.process_dir,
-                                   original_package_download_base_url=S1GRD1SDV.original_package_download_base_url,
-                                   gs_workspace=S1GRD1SDV.geoserver_workspace,
-                                   bands_dict = S1GRD1SDV.bands_dict,
-                                   gs_wms_layer=S1GRD1SDV.geoserver_layer,
-                                   gs_wfs_featuretype=S1GRD1SDV.geoserver_featuretype,
-                                   gs_wfs_format=S1GRD1SDV.geoserver_oseo_wfs_format,
-                                   gs_wfs_version=S1GRD1SDV.geoserver_oseo_wfs_version,
-                                   gs_wms_width=S1GRD1SDV.geoserver_oseo_wms_width,
-                                   gs_wms_height=S1GRD1SDV.geoserver_oseo_wms_height,
-                                   gs_wms_format=S1GRD1SDV.geoserver_oseo_wms_format,
-                                   gs_wms_version=S1GRD1SDV.geoserver_oseo_wms_version,
-                                   gs_wcs_coverage_id=S1GRD1SDV.geoserver_coverage,
-                                   gs_wcs_scale_i=S1GRD1SDV.geoserver_oseo_wcs_scale_i,
-                                   gs_wcs_scale_j=S1GRD1SDV.geoserver_oseo_wcs_scale_j,
-                                   gs_wcs_format=S1GRD1SDV.geoserver_oseo_wcs_format,
-                                   gs_wcs_version=S1GRD1SDV.geoserver_oseo_wcs_version,
-                                   get_inputs_from = {
-                                       'download_task_id': download_task.task_id,
-                                       'addo_task_ids': addo_task_ids,
-                                       'upload_task_ids': upload_task_ids,
-                                       'archive_product_task_id' : archive_task.task_id,
-                                   },
-                                   dag=dag)
-
-# Publish product.zip to GeoServer
-publish_task = PythonOperator(task_id="publish_product_task",
-                              python_callable=publish_product,
-                              op_kwargs={
-                                'geoserver_username': CFG.geoserver_username,
-                                'geoserver_password': CFG.geoserver_password,
-                                'geoserver_rest_endpoint': '{}/oseo/collections/{}/products'.format(CFG.geoserver_rest_url, S1GRD1SDV.geoserver_oseo_collection),                                'get_inputs_from': metadata_task.task_id,
-                              },
-                              dag = dag)
-
-if CFG.eoxserver_rest_url:
-  publish_eox_task = PythonOperator(task_id="publish_product_eox_task",
-                                python_callable=publish_product,
-                                op_kwargs={
-                                  'geoserver_username': CFG.eoxserver_username,
-                                  'geoserver_password': CFG.eoxserver_password,
-                                  'geoserver_rest_endpoint': CFG.eoxserver_rest_url,
-                                  'get_inputs_from': metadata_task.task_id,
-                                },
-                                dag = dag)
-
-download_task.set_upstream(search_task)
-archive_task.set_upstream(download_task)
-zip_task.set_upstream(download_task)
-metadata_task.set_upstream(download_task)
-metadata_task.set_upstream(archive_task)
-
-for task in upload_tasks:
-    metadata_task.set_upstream(task)
-
-publish_task.set_upstream(metadata_task)
-
-if CFG.eoxserver_rest_url:
-  publish_eox_task.set_upstream(metadata_task)
+def create_product_tasks(slot=None):
+    """Create the chain of tasks downloading, processing and publishing the
+    products found by search_task. With a slot number, the chain only handles
+    the product at that position of the search results."""
+    # DHUS Download Task Operator
+    download_task = DHUSDownloadOperator(task_id=slot_task_id('download_product_task', slot),
+                                         dhus_url=CFG.dhus_url,
+                                         dhus_user=CFG.dhus_username,
+                                         dhus_pass=CFG.dhus_password,
+                                         download_max=S1GRD1SDV.dhus_download_max,
+                                         download_dir=S1GRD1SDV.download_dir,
+                                         get_inputs_from=search_task.task_id,
+                                         product_index=slot,
+                                         download_timeout=timedelta(hours=12),
+                                         dag=dag)
+
+    # Rsync Archive Task for Products
+    archive_task = RSYNCOperator(task_id=slot_task_id("upload_original_package", slot),
+                                 host = CFG.rsync_hostname,
+                                 remote_usr = CFG.rsync_username,
+                                 ssh_key_file = CFG.rsync_ssh_key,
+                                 remote_dir = S1GRD1SDV.original_package_upload_dir,
+                                 get_inputs_from=download_task.task_id,
+                                 dag=dag)
+
+    # Zip Inspector and Extractor Task
+    zip_task = ZipInspector(task_id=slot_task_id('zip_inspector', slot),
+                            extension_to_search='tiff',
+                            get_inputs_from=download_task.task_id,
+                            extraction_cache_dir=CFG.extraction_cache_dir if S1GRD1SDV.extract_bands else None,
+                            extraction_cache_size=CFG.extraction_cache_size,
+                            dag=dag)
+
+    warp_tasks = []
+    addo_tasks = []
+    upload_tasks = []
+    band_paths_tasks = []
+
+    shared_warp = S1GRD1SDV.shared_warp and not S1GRD1SDV.cog
+    if shared_warp:
+        # a single task warps both polarizations of each product
+        warp = S1WarpOperator(
+            task_id=slot_task_id('s1_warp', slot),
+            target_srs=TARGET_SRS,
+            tile_size=TILE_SIZE,
+            overwrite=OVERWRITE,
+            dstdir=S1GRD1SDV.process_dir,
+            get_inputs_from=zip_task.task_id,
+            error_threshold=S1GRD1SDV.warp_error_threshold,
+            in_process=CFG.gdal_in_process,
+            gdal_runtime=S1GRD1SDV.gdal_runtime,
+            dag=dag
+        )
+        warp_tasks.append(warp)
+        warp.set_upstream(zip_task)
+        bands_source_task = warp
+    else:
+        bands_source_task = zip_task
+
+    for i in range(1, 3):
+        band_paths = PythonOperator(task_id=slot_task_id("get_band_paths_" + str(i), slot),
+             python_callable=prepare_band_paths,
+             op_kwargs={
+                 'get_inputs_from': bands_source_task.task_id,
+                 'band_number': i
+             },
+             dag=dag)
+        band_paths_tasks.append(band_paths)
+
+        if S1GRD1SDV.cog:
+            # a single task warps the band and writes it with its overviews
+            addo = GDALCOGOperator(
+                task_id=slot_task_id('gdal_cog_' + str(i), slot),
+                target_srs=TARGET_SRS,
+                blocksize=TILE_SIZE,
+                resampling_method=RESAMPLING_METHOD,
+                max_overview_level=MAX_OVERVIEW_LEVEL,
+                output_dir=S1GRD1SDV.process_dir,
+                get_inputs_from=band_paths.task_id,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=S1GRD1SDV.gdal_runtime,
+                dag=dag
+            )
+            addo_tasks.append(addo)
+            addo.set_upstream(band_paths)
+        elif shared_warp:
+            addo = GDALAddoOperator(
+                trigger_rule=TriggerRule.ALL_SUCCESS,
+                resampling_method=RESAMPLING_METHOD,
+                max_overview_level=MAX_OVERVIEW_LEVEL,
+                plan_levels=True,
+                task_id=slot_task_id('gdal_addo_' + str(i), slot),
+                get_inputs_from=band_paths.task_id,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=S1GRD1SDV.gdal_runtime,
+                max_workers=CFG.gdal_max_workers,
+                dag=dag
+            )
+            addo_tasks.append(addo)
+            addo.set_upstream(band_paths)
+        else:
+            warp = GDALWarpOperator(
+                task_id=slot_task_id('gdalwarp_' + str(i), slot),
+                target_srs=TARGET_SRS,
+                tile_size=TILE_SIZE,
+                overwrite=OVERWRITE,
+                dstdir=S1GRD1SDV.process_dir,
+                get_inputs_from=band_paths.task_id,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=S1GRD1SDV.gdal_runtime,
+                max_workers=CFG.gdal_max_workers,
+                dag=dag
+            )
+            warp_tasks.append(warp)
+
+            addo = GDALAddoOperator(
+                trigger_rule=TriggerRule.ALL_SUCCESS,
+                resampling_method=RESAMPLING_METHOD,
+                max_overview_level=MAX_OVERVIEW_LEVEL,
+                plan_levels=True,
+                task_id=slot_task_id('gdal_addo_' + str(i), slot),
+                get_inputs_from=warp.task_id,
+                in_process=CFG.gdal_in_process,
+                gdal_runtime=S1GRD1SDV.gdal_runtime,
+                max_workers=CFG.gdal_max_workers,
+                dag=dag
+            )
+            addo_tasks.append(addo)
+            warp.set_upstream(band_paths)
+            addo.set_upstream(warp)
+
+        upload = RSYNCOperator(task_id=slot_task_id("upload_granule_{}_task".format(str(i)), slot),
+                                              host=CFG.rsync_hostname,
+                                              remote_usr=CFG.rsync_username,
+                                              ssh_key_file=CFG.rsync_ssh_key,
+                                              remote_dir=S1GRD1SDV.repository_dir,
+                                              get_inputs_from=addo.task_id,
+                                              dag=dag)
+        upload_tasks.append(upload)
+
+        band_paths.set_upstream(bands_source_task)
+        upload.set_upstream(addo)
+
+    # Metadata Extraction task
+    addo_task_ids = ( task.task_id for task in addo_tasks )
+    upload_task_ids = ( task.task_id for task in upload_tasks )
+    metadata_task = S1MetadataOperator(task_id=slot_task_id("extract_metadata_task", slot),
+                                       product_safe_path=None,
+                                       granules_paths=None,
+                                       granules_upload_dir=S1GRD1SDV.repository_dir,
+                                       processing_dir=S1GRD1SDV.process_dir,
+                                       original_package_download_base_url=S1GRD1SDV.original_package_download_base_url,
+                                       gs_workspace=S1GRD1SDV.geoserver_workspace,
+                                       bands_dict = S1GRD1SDV.bands_dict,
+                                       gs_wms_layer=S1GRD1SDV.geoserver_layer,
+                                       gs_wfs_featuretype=S1GRD1SDV.geoserver_featuretype,
+                                       gs_wfs_format=S1GRD1SDV.geoserver_oseo_wfs_format,
+                                       gs_wfs_version=S1GRD1SDV.geoserver_oseo_wfs_version,
+                                       gs_wms_width=S1GRD1SDV.geoserver_oseo_wms_width,
+                                       gs_wms_height=S1GRD1SDV.geoserver_oseo_wms_height,
+                                       gs_wms_format=S1GRD1SDV.geoserver_oseo_wms_format,
+                                       gs_wms_version=S1GRD1SDV.geoserver_oseo_wms_version,
+                                       gs_wcs_coverage_id=S1GRD1SDV.geoserver_coverage,
+                                       gs_wcs_scale_i=S1GRD1SDV.geoserver_oseo_wcs_scale_i,
+                                       gs_wcs_scale_j=S1GRD1SDV.geoserver_oseo_wcs_scale_j,
+                                       gs_wcs_format=S1GRD1SDV.geoserver_oseo_wcs_format,
+                                       gs_wcs_version=S1GRD1SDV.geoserver_oseo_wcs_version,
+                                       gdal_runtime=S1GRD1SDV.gdal_runtime,
+                                       single_open_reader=S1GRD1SDV.single_open_reader,
+                                       thumbnail_sizes=S1GRD1SDV.thumbnail_sizes,
+                                       max_workers=CFG.metadata_max_workers,
+                                       continue_on_error=CFG.metadata_continue_on_error,
+                                       get_inputs_from = {
+                                           'download_task_id': download_task.task_id,
+                                           'addo_task_ids': addo_task_ids,
+                                           'upload_task_ids': upload_task_ids,
+                                           'archive_product_task_id' : archive_task.task_id,
+                                       },
+                                       dag=dag)
+
+    # Publish product.zip to GeoServer
+    publish_task = PythonOperator(task_id=slot_task_id("publish_product_task", slot),
+                                  python_callable=publish_product,
+                                  op_kwargs={
+                                    'geoserver_username': CFG.geoserver_username,
+                                    'geoserver_password': CFG.geoserver_password,
+                                    'geoserver_rest_endpoint': '{}/oseo/collections/{}/products'.format(CFG.geoserver_rest_url, S1GRD1SDV.geoserver_oseo_collection),                                'get_inputs_from': metadata_task.task_id,
+                                  },
+                                  dag = dag)
+
+    if CFG.eoxserver_rest_url:
+      publish_eox_task = PythonOperator(task_id=slot_task_id("publish_product_eox_task", slot),
+                                    python_callable=publish_product,
+                                    op_kwargs={
+                                      'geoserver_username': CFG.eoxserver_username,
+                                      'geoserver_password': CFG.eoxserver_password,
+                                      'geoserver_rest_endpoint': CFG.eoxserver_rest_url,
+                                      'get_inputs_from': metadata_task.task_id,
+                                    },
+                                    dag = dag)
+
+    download_task.set_upstream(search_task)
+    archive_task.set_upstream(download_task)
+    zip_task.set_upstream(download_task)
+    metadata_task.set_upstream(download_task)
+    metadata_task.set_upstream(archive_task)
+
+    for task in upload_tasks:
+        metadata_task.set_upstream(task)
+
+    publish_task.set_upstream(metadata_task)
+
+    if CFG.eoxserver_rest_url:
+      publish_eox_task.set_upstream(metadata_task)
+
+# each product slot gets its own chain of tasks, so that products are
+# processed independently and in parallel across the workers
+if S1GRD1SDV.product_slots:
+    for slot in range(S1GRD1SDV.product_slots):
+        create_product_tasks(slot)
+else:
+    create_product_tasks()
@@ -34,6 +34,7 @@ import xml.etree.ElementTree as ET
 import geojson
 import shapely.wkt
 from zipfile import ZipFile
+from safe_archive import get_archive_index
 
 try:
     from osgeo import gdal
@@ -44,58 +45,116 @@ log = logging.getLogger(__name__)
 
 
 def get_manifest_zip_path(zipfile_path):
-    with ZipFile(zipfile_path) as z:
-        manifest_zip_path = None
-        for p in z.namelist():
-            if p.endswith('manifest.safe'):
-                manifest_zip_path = p
-                break
-    return "/vsizip/" + zipfile_path.rstrip('/') + '/' + manifest_zip_path
+    index = get_archive_index(zipfile_path)
+    return index.vsizip_path(index.find('manifest.safe'))
 
 
 def extract_file_from_zip(endswith_str, zipfile_path, out_dir=None):
-  with ZipFile(zipfile_path) as z:
-
-    file_zip_path = None
-    for p in z.namelist():
-        if p.endswith(endswith_str):
-            file_zip_path = p
-            break
-    if file_zip_path is None:
-      return None
-    # extract it
-    if out_dir is None:
-      targetpath = z.extract(file_zip_path)
-    else:
-      targetpath = z.extract(file_zip_path, path=out_dir)
-    return targetpath
+  index = get_archive_index(zipfile_path)
+  file_zip_path = index.find(endswith_str)
+  if file_zip_path is None:
+    return None
+  # extract it
+  return index.extract(file_zip_path, out_dir)
 
 def extract_manifest_from_zip(zipfile_path, out_dir=None):
-  with ZipFile(zipfile_path) as z:
-    # look for manifest
-    manifest_zip_path = None
-    for p in z.namelist():
-        if p.endswith('manifest.safe'):
-            manifest_zip_path = p
-            break
-    if manifest_zip_path is None:
-      return None
-    # extract it
-    if out_dir is None:
-      targetpath = z.extract(manifest_zip_path)
-    else:
-      targetpath = z.extract(manifest_zip_path, path=out_dir)
-    return targetpath
+  return extract_file_from_zip('manifest.safe', zipfile_path, out_dir)
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _find(element, name):
+    """First descendant of element named name, whatever its namespace"""
+    for child in element.iter():
+        if _local_name(child.tag) == name:
+            return child
+    return None
+
+def _find_text(element, name, default=""):
+    found = _find(element, name) if element is not None else None
+    if found is None or found.text is None:
+        return default
+    return found.text.strip()
+
+def read_safe_members(zipfile_path):
+    """Read the manifest, the first product annotation and the quicklook of a
+    SAFE zip, opening it once
+
+    Returns:
+        dict: contents keyed by 'manifest.safe', 'annotation' and 'quick-look.png'
+    """
+    members = {}
+    with ZipFile(zipfile_path) as z:
+        for name in z.namelist():
+            if name.endswith('manifest.safe'):
+                key = 'manifest.safe'
+            elif name.endswith('quick-look.png'):
+                key = 'quick-look.png'
+            elif name.endswith('.xml') and os.path.basename(os.path.dirname(name)) == 'annotation':
+                key = 'annotation'
+            else:
+                continue
+            if key not in members:
+                members[key] = z.read(name)
+    return members
+
+def get_manifest_metadata(manifest_root, annotation_root=None):
+    """Metadata items of the GDAL SAFE driver, read from the parsed manifest
+    and product annotation"""
+    metadata_objects = {}
+    for metadata_object in manifest_root.iter():
+        if _local_name(metadata_object.tag) == 'metadataObject':
+            metadata_objects[metadata_object.get('ID')] = metadata_object
+    platform = metadata_objects.get('platform')
+    orbit = metadata_objects.get('measurementOrbitReference')
+    period = metadata_objects.get('acquisitionPeriod')
+    processing = metadata_objects.get('processing')
+    facility = _find(processing, 'facility') if processing is not None else None
+    metadata = {
+        'SATELLITE_IDENTIFIER': _find_text(platform, 'familyName'),
+        'BEAM_MODE': _find_text(platform, 'mode'),
+        'BEAM_SWATH': _find_text(platform, 'swath'),
+        'ORBIT_NUMBER': _find_text(orbit, 'orbitNumber'),
+        'ORBIT_DIRECTION': _find_text(orbit, 'pass'),
+        'ACQUISITION_START_TIME': _find_text(period, 'startTime'),
+        'ACQUISITION_STOP_TIME': _find_text(period, 'stopTime'),
+        'FACILITY_IDENTIFIER': facility.get('name', '') if facility is not None else '',
+        'SENSOR_IDENTIFIER': 'SAR',
+    }
+    if annotation_root is not None:
+        header = _find(annotation_root, 'adsHeader')
+        image_information = _find(annotation_root, 'imageInformation')
+        metadata.update({
+            'MISSION_ID': _find_text(header, 'missionId'),
+            'PRODUCT_TYPE': _find_text(header, 'productType', 'UNK'),
+            'MODE': _find_text(header, 'mode'),
+            'SWATH': _find_text(header, 'swath'),
+            'LINE_SPACING': _find_text(image_information, 'azimuthPixelSpacing'),
+            'PIXEL_SPACING': _find_text(image_information, 'rangePixelSpacing'),
+        })
+    return metadata
 
 class S1GDALReader:
 
-    def __init__(self, sentinel1_product_zip_path):
+    def __init__(self, sentinel1_product_zip_path, single_open=False):
         self.product_zip_path = sentinel1_product_zip_path
         sentinel1_product_dir = os.path.dirname(sentinel1_product_zip_path)
         sentinel1_product_zipname = os.path.basename(sentinel1_product_zip_path)
         self.product_dir = sentinel1_product_dir
         self.sentinel1_product_zipname = sentinel1_product_zipname
         self.granule_identifier, _ = os.path.splitext(sentinel1_product_zipname)
+        # with single_open the zip is read once: the manifest and annotation
+        # are parsed from memory and GDAL does not open the product
+        self.single_open = single_open
+        self.members = {}
+
+        if single_open:
+            self.members = read_safe_members(sentinel1_product_zip_path)
+            self.manifest_tree = ET.ElementTree(ET.fromstring(self.members['manifest.safe']))
+            self.annotation_root = None
+            if 'annotation' in self.members:
+                self.annotation_root = ET.fromstring(self.members['annotation'])
+            return
 
         manifest_path = extract_manifest_from_zip(sentinel1_product_zip_path)
         self.manifest_tree = ET.parse(manifest_path)
@@ -111,9 +170,12 @@ class S1GDALReader:
         #self.datastore = gdal.Open(sentinel1_safe_pkg_path)
 
     def get_metadata(self):
-        manifest_zip_path = get_manifest_zip_path(self.product_zip_path)
-        datastore = gdal.Open(manifest_zip_path)
-        metadata_dict = datastore.GetMetadata()
+        if self.single_open:
+            metadata_dict = get_manifest_metadata(self.manifest_tree.getroot(), self.annotation_root)
+        else:
+            manifest_zip_path = get_manifest_zip_path(self.product_zip_path)
+            datastore = gdal.Open(manifest_zip_path)
+            metadata_dict = datastore.GetMetadata()
         metadata_dict['NAME'] = self.granule_identifier
         startTime = metadata_dict['ACQUISITION_START_TIME']
         endTime   = metadata_dict['ACQUISITION_STOP_TIME']
@@ -147,5 +209,14 @@ class S1GDALReader:
     def get_quicklook(self):
         return  extract_file_from_zip("quick-look.png", self.product_zip_path)
 
+    def get_quicklook_data(self):
+        if 'quick-look.png' in self.members:
+            return self.members['quick-look.png']
+        index = get_archive_index(self.product_zip_path)
+        quicklook_zip_path = index.find("quick-look.png")
+        if quicklook_zip_path is None:
+            return None
+        return index.read(quicklook_zip_path)
+
     def get_preview_image(self):
         return os.path.join(self.safe_package_path, "preview", "quick-look.png")
@@ -34,9 +34,12 @@ from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
 from airflow.models import XCOM_RETURN_KEY
+from airflow.exceptions import AirflowSkipException
 
 from sentinelsat.sentinel import SentinelAPI, read_geojson, geojson_to_wkt
 
+import transfer
+
 log = logging.getLogger(__name__)
 pp = pprint.PrettyPrinter(indent=2)
 
@@ -113,6 +116,16 @@ class DHUSSearchOperator(BaseOperator):
         return products
     
 class DHUSDownloadOperator(BaseOperator):
+    """ Download products from DHUS
+
+    Args:
+        product_index (int): only download the product at this position of
+            the searched products sorted by id, so that each product goes
+            through its own chain of tasks (see product_slots in the
+            collection configs). The task is skipped, and its downstream
+            tasks with it, when there is no product to download at that
+            position
+    """
 
     @apply_defaults
     def __init__(self,
@@ -124,6 +137,7 @@ class DHUSDownloadOperator(BaseOperator):
             download_max=10,
             get_inputs_from=None,
             product_ids=None,
+            product_index=None,
             *args, **kwargs):
         self.dhus_url = dhus_url
         self.dhus_user = dhus_user
@@ -132,6 +146,7 @@ class DHUSDownloadOperator(BaseOperator):
         self.download_dir = download_dir
         self.product_ids = product_ids
         self.get_inputs_from = get_inputs_from
+        self.product_index = product_index
         
         print("Init DHUS Download.. ")
         
@@ -147,6 +162,7 @@ class DHUSDownloadOperator(BaseOperator):
         log.info('Download Directory: %s', self.download_dir)
         log.info('Input from: %s', self.get_inputs_from)
         log.info('Product IDs: %s', self.product_ids)
+        log.info('Product index: %s', self.product_index)
 
         log.info("Execute DHUS Download.. ")
         
@@ -170,6 +186,14 @@ class DHUSDownloadOperator(BaseOperator):
             # exit gracefully if no products are found
             log.info('no products to process')
             return None
+
+        if self.product_index is not None:
+            # a stable order, the dict fetched from XCom has none
+            product_ids = sorted(self.products)
+            if self.product_index >= len(product_ids):
+                raise AirflowSkipException("No product at index {} ({} products found)".format(self.product_index, len(product_ids)))
+            product_id = product_ids[self.product_index]
+            self.products = {product_id: self.products[product_id]}
     
         # log warning in case the amount of products exceed the limit
         if len(self.products) > self.download_max:
@@ -196,15 +220,27 @@ class DHUSDownloadOperator(BaseOperator):
                 self.products[product_id].get("title"),
                 self.products[product_id].get("size"))
             )
-            downloaded = api.download(product_id, directory_path=self.download_dir);
-            path = downloaded['path']
-            # TODO check if file in 'path' is binary.
-            # It might is an XML file containing an error such as 
+            # the product url is resolved through the DHUS API but the zip
+            # is fetched by the shared transfer engine
+            downloaded = api.get_product_odata(product_id)
+            stats = transfer.download(
+                downloaded['url'],
+                product_filename,
+                auth=(self.dhus_user, self.dhus_pass),
+                resume=True,
+                md5=downloaded.get('md5')
+            )
+            path = stats.path
+            downloaded['path'] = path
+            downloaded['downloaded_bytes'] = stats.bytes
+            # the MD5 check also rejects XML error documents returned in
+            # place of the product, such as
             # "Maximum number of 2 concurrent flows achieved by the user "xyz""
-            # Check MD5
-            # If file already downloaded move on to next one?
             product_downloaded[path] = downloaded;
         
+        if self.product_index is not None and len(product_downloaded) == 0:
+            raise AirflowSkipException("Product {} already downloaded".format(self.products.keys()[0]))
+
         # print summary and push products to XCOM
         log.debug("Downloaded {} products:\n{}".format(len(product_downloaded),pp.pprint(product_downloaded)))
         context['task_instance'].xcom_push(key='downloaded_products', value=product_downloaded)
@@ -42,9 +42,9 @@ try:
 except:
     sys.exit('ERROR: cannot find GDAL/OGR modules, install gdal with python bindings')
 
-from zipfile import ZipFile
 import config.xcom_keys as xk
 from geoserver_plugin import create_owslinks_dict
+from safe_archive import ExtractionCache, get_archive_index, get_pin_owner
 
 log = logging.getLogger(__name__)
 
@@ -55,14 +55,18 @@ class ZipInspector(BaseOperator):
     Args:
         extension_to_search (str): image extension to search for 
         get_inputs_from (str): task_id used to fetch input files from XCom (as a list of products)
+        extraction_cache_dir (str): extract the matching files to this directory (see safe_archive.ExtractionCache) and return their local paths instead of /vsizip/ ones
+        extraction_cache_size (int): size in bytes of the extraction cache, the least recently used files are removed beyond it. The extracted files are pinned for the DAG run, until the tasks reading them release them
 
     Returns:
-        dict: keys are zipfiles and values are lists containing virtual paths 
+        dict: keys are zipfiles and values are lists containing virtual paths, or local paths with extraction_cache_dir. The statistics of the extraction cache are pushed to XCom under the "extraction_cache_stats" key
     """
     @apply_defaults
-    def __init__(self, extension_to_search,  get_inputs_from=None, *args, **kwargs):
+    def __init__(self, extension_to_search,  get_inputs_from=None, extraction_cache_dir=None, extraction_cache_size=None, *args, **kwargs):
         self.substring = extension_to_search
         self.get_inputs_from = get_inputs_from
+        self.extraction_cache_dir = extraction_cache_dir
+        self.extraction_cache_size = extraction_cache_size
         log.info('--------------------GDAL_PLUGIN Zip inspector------------')
         super(ZipInspector, self).__init__(*args, **kwargs)
 
@@ -84,23 +88,31 @@ class ZipInspector(BaseOperator):
             log.info("Nothing to process.")
             return
 
+        extraction_cache = None
+        if self.extraction_cache_dir is not None:
+            extraction_cache = ExtractionCache(self.extraction_cache_dir, self.extraction_cache_size)
+
         return_dict=dict()
         log.info("Processing {} ZIP files:\n{} ".format(len(zip_files),pprint.pformat(zip_files)))
         for zip_file in zip_files:
             log.info("Processing {}..".format(zip_file))
             counter = 0;
             vsi_paths=list()
-            zip = ZipFile(zip_file)
-            for file in zip.namelist():
-                filename = zip.getinfo(file).filename
+            for filename in get_archive_index(zip_file).names:
                 if self.substring in filename:
                     counter = counter + 1
                     raster_vsizip = "/vsizip/" + zip_file + "/" + filename
+                    if extraction_cache is not None:
+                        raster_vsizip = extraction_cache.get(zip_file, filename, owner=get_pin_owner(context))
                     vsi_paths.append(raster_vsizip)
                     log.info(str(counter) + ") '" + raster_vsizip + "'")
                     context['task_instance'].xcom_push(key=xk.IMAGE_ZIP_ABS_PATH_PREFIX_XCOM_KEY + str(counter), value=raster_vsizip)
             return_dict[zip_file]=vsi_paths
 
+        if extraction_cache is not None:
+            cache_stats = extraction_cache.stats()
+            log.info("Extraction cache: {}".format(cache_stats))
+            context['task_instance'].xcom_push(key="extraction_cache_stats", value=cache_stats)
         return return_dict
 
 class RSYNCOperator(BaseOperator):
@@ -25,18 +25,32 @@
  *********************************************************************************/
 """
 
+from contextlib import contextmanager
 from itertools import count
+import json
 import logging
 import os
 import six
 import pprint
-from subprocess import check_output
+import time
+from subprocess import check_call, check_output
 
-from airflow.operators import BashOperator
 from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
 from airflow.models import XCOM_RETURN_KEY
+from safe_archive import (
+    get_extracted_path,
+    get_pin_owner,
+    release_extracted_path,
+)
+from utils import ProductError, map_products
+
+try:
+    from osgeo import gdal
+except ImportError:
+    # only needed by the in process engine
+    gdal = None
 
 log = logging.getLogger(__name__)
 
@@ -50,25 +64,94 @@ def get_overview_levels(max_level):
     return levels
 
 
+# smallest overview of untiled rasters, tiled ones stop at their tile size
+DEFAULT_MIN_OVERVIEW_SIZE = 256
+
+
+def get_raster_layout(path, in_process=False, gdal_runtime=None):
+    """Return (width, height, block width, block height) of the first band
+    of the raster at ``path``."""
+    config_options = get_runtime_config(gdal_runtime)
+    if in_process:
+        _require_gdal()
+        with gdal_config(**config_options):
+            dataset = _check_gdal_result(gdal.Open(path), "gdalinfo", path)
+            block_x, block_y = dataset.GetRasterBand(1).GetBlockSize()
+            return dataset.RasterXSize, dataset.RasterYSize, block_x, block_y
+    info = json.loads(check_output(
+        ["gdalinfo"] + get_gdal_config_args(config_options) + ["-json", path]
+    ).decode("utf-8"))
+    width, height = info["size"]
+    block_x, block_y = info["bands"][0]["block"]
+    return width, height, block_x, block_y
+
+
+def plan_overview_levels(width, height, min_size, max_level=None):
+    """Return the overview levels of a ``width`` x ``height`` raster: powers
+    of two up to the first overview fitting in ``min_size`` pixels, and not
+    beyond ``max_level``."""
+    levels = []
+    level = 2
+    size = max(width, height)
+    while size > min_size and (max_level is None or level <= max_level):
+        levels.append(level)
+        size = -(-max(width, height) // level)  # rounded up
+        level *= 2
+    return levels
+
+
+def plan_overview_steps(levels, resampling_method, compress_overview=None,
+                        level_options=None, split_levels=False):
+    """Group consecutive overview levels sharing the same resampling and
+    compression into the gdaladdo runs building them.
+
+    Args:
+        levels (list): overview levels
+        resampling_method (str): default resampling of the levels
+        compress_overview (str): default compression of the levels
+        level_options (dict): "resampling_method" and/or "compress_overview"
+            overriding the defaults, keyed by level
+        split_levels (bool): build each level in its own run, so that the
+            time spent on every level is known
+
+    Returns:
+        list: dicts with the "levels", "resampling_method" and
+        "compress_overview" of each run
+    """
+    steps = []
+    for level in levels:
+        options = {
+            "resampling_method": resampling_method,
+            "compress_overview": compress_overview,
+        }
+        options.update((level_options or {}).get(level, {}))
+        if steps and not split_levels and all(
+                steps[-1][name] == value for name, value in options.items()):
+            steps[-1]["levels"].append(level)
+        else:
+            steps.append(dict(options, levels=[level]))
+    return steps
+
+
 def get_gdaladdo_command(source, overview_levels, resampling_method,
-                         compress_overview=None):
-    compress_token = (
-        "--config COMPRESS_OVERVIEW {}".format(compress_overview) if
-        compress_overview is not None else ""
-    )
-    return "gdaladdo {compress} -r {method} {src} {levels}".format(
+                         compress_overview=None, config_options=None):
+    config_options = dict(config_options or {})
+    if compress_overview is not None:
+        config_options["COMPRESS_OVERVIEW"] = compress_overview
+    return "gdaladdo {config_opts} -r {method} {src} {levels}".format(
         method=resampling_method,
-        compress=compress_token,
+        config_opts=_get_gdal_config_options(**config_options),
         src=source,
         levels=" ".join(str(level) for level in overview_levels),
     )
 
 
 def get_gdal_translate_command(source, destination, output_type,
-                               creation_options):
+                               creation_options, config_options=None):
     return (
-        "gdal_translate -ot {output_type} {creation_opts} "
+        "gdal_translate {config_opts} -ot {output_type} {creation_opts} "
         "{src} {dst}".format(
+            config_opts=_get_gdal_config_options(**(config_options or {})),
             output_type=output_type,
             creation_opts=_get_gdal_creation_options(**creation_options),
             src=source,
@@ -77,13 +160,345 @@ def get_gdal_translate_command(source, destination, output_type,
     )
 
 def _get_gdal_creation_options(**creation_options):
-    result = ""
-    for name, value in creation_options.items():
-        opt = '-co "{}={}"'.format(name.upper(), value)
-        " ".join((result, opt))
+    return " ".join(
+        '-co "{}={}"'.format(name.upper(), value)
+        for name, value in creation_options.items()
+    )
+
+def _get_gdal_config_options(**config_options):
+    return " ".join(
+        '--config {} "{}"'.format(name.upper(), value)
+        for name, value in config_options.items()
+    )
+
+
+def get_gdal_config_args(config_options):
+    """Return the --config arguments of a GDAL command line tool."""
+    args = []
+    for name, value in sorted(config_options.items()):
+        args += ["--config", name.upper(), str(value)]
+    return args
+
+
+#
+# Runtime profile: the configuration options, creation options and warping
+# threads applied to every GDAL call, whether it runs through the command line
+# tools or the bindings (see gdal_runtime in config/settings.py)
+#
+
+def get_runtime_config(gdal_runtime, config_options=None):
+    """Configuration options of ``gdal_runtime`` updated with the ones of the
+    call."""
+    merged = {}
+    for options in ((gdal_runtime or {}).get("config"), config_options):
+        merged.update((name.upper(), value)
+                      for name, value in (options or {}).items())
+    return merged
+
+
+def get_runtime_creation_options(gdal_runtime, creation_options=None):
+    """Creation options of ``gdal_runtime`` updated with the ones of the
+    call."""
+    merged = {}
+    for options in ((gdal_runtime or {}).get("creation_options"),
+                    creation_options):
+        merged.update((name.upper(), value)
+                      for name, value in (options or {}).items())
+    return merged
+
+
+def get_runtime_warp_args(gdal_runtime):
+    """gdalwarp arguments of the warping settings of ``gdal_runtime``."""
+    gdal_runtime = gdal_runtime or {}
+    args = []
+    if gdal_runtime.get("warp_threads"):
+        args += ["-multi", "-wo",
+                 "NUM_THREADS={}".format(gdal_runtime["warp_threads"])]
+    if gdal_runtime.get("warp_memory"):
+        args += ["-wm", str(gdal_runtime["warp_memory"])]
+    return args
+
+
+def get_runtime_warp_kwargs(gdal_runtime):
+    """gdal.Warp keyword arguments of the warping settings of
+    ``gdal_runtime``."""
+    gdal_runtime = gdal_runtime or {}
+    kwargs = {}
+    if gdal_runtime.get("warp_threads"):
+        kwargs["multithread"] = True
+        kwargs["warpOptions"] = [
+            "NUM_THREADS={}".format(gdal_runtime["warp_threads"])]
+    if gdal_runtime.get("warp_memory"):
+        kwargs["warpMemoryLimit"] = gdal_runtime["warp_memory"]
+    return kwargs
+
+
+def is_remote_path(path):
+    """True for paths read through a GDAL virtual file system such as
+    /vsicurl/, which have no local directory to write next to."""
+    return path.startswith("/vsi")
+
+
+def get_input_paths(xcom_value, key=None):
+    """Return the list of paths held by the XCom value of an upstream task,
+    selecting the entry ``key`` first if the value is a dict (e.g. the bands
+    downloaded by Landsat8SceneDownloadOperator)."""
+    if key is not None:
+        xcom_value = xcom_value[key]
+    # If message from XCom is a string with single file path, turn it into a list
+    if isinstance(xcom_value, six.string_types):
+        xcom_value = [xcom_value]
+    return xcom_value
+
+
+#
+# In process engine: the same operations as the command line tools, run
+# through the GDAL python bindings so that no process is spawned per file and
+# the block cache is shared by all the files of a task.
+#
+
+def _require_gdal():
+    if gdal is None:
+        raise RuntimeError(
+            "The GDAL python bindings are required to run GDAL in process")
+
+
+def _check_gdal_result(result, operation, path):
+    if result is None:
+        raise RuntimeError("{} failed on {}: {}".format(
+            operation, path, gdal.GetLastErrorMsg()))
     return result
 
 
+@contextmanager
+def gdal_config(**config_options):
+    """Set GDAL configuration options, like --config, within the block."""
+    previous = {}
+    for name, value in config_options.items():
+        name = name.upper()
+        previous[name] = gdal.GetConfigOption(name)
+        gdal.SetConfigOption(name, str(value))
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            gdal.SetConfigOption(name, value)
+
+
+def _creation_option_list(creation_options):
+    return ["{}={}".format(name, value)
+            for name, value in sorted(creation_options.items())]
+
+
+def gdal_warp(source, destination, target_srs, tile_size, overwrite=False,
+              gdal_runtime=None, error_threshold=None):
+    _require_gdal()
+    if overwrite and os.path.exists(destination):
+        gdal.GetDriverByName("GTiff").Delete(destination)
+    creation_options = get_runtime_creation_options(gdal_runtime, {
+        "TILED": "YES",
+        "BLOCKXSIZE": tile_size,
+        "BLOCKYSIZE": tile_size,
+    })
+    with gdal_config(**get_runtime_config(gdal_runtime)):
+        warp_kwargs = get_runtime_warp_kwargs(gdal_runtime)
+        if error_threshold is not None:
+            warp_kwargs["errorThreshold"] = error_threshold
+        dataset = gdal.Warp(
+            destination, source, dstSRS=target_srs,
+            creationOptions=_creation_option_list(creation_options),
+            **warp_kwargs
+        )
+        _check_gdal_result(dataset, "gdalwarp", source)
+        dataset = None  # flush to disk
+    return destination
+
+
+def gdal_translate(source, destination, output_type, creation_options,
+                   config_options=None, gdal_runtime=None):
+    _require_gdal()
+    creation_options = get_runtime_creation_options(
+        gdal_runtime, creation_options)
+    with gdal_config(**get_runtime_config(gdal_runtime, config_options)):
+        dataset = gdal.Translate(
+            destination, source,
+            outputType=gdal.GetDataTypeByName(output_type),
+            creationOptions=_creation_option_list(creation_options)
+        )
+        _check_gdal_result(dataset, "gdal_translate", source)
+        dataset = None  # flush to disk
+    return destination
+
+
+def gdal_addo(source, overview_levels, resampling_method,
+              compress_overview=None, gdal_runtime=None):
+    _require_gdal()
+    config_options = get_runtime_config(gdal_runtime)
+    if compress_overview is not None:
+        config_options["COMPRESS_OVERVIEW"] = compress_overview
+    with gdal_config(**config_options):
+        dataset = _check_gdal_result(
+            gdal.Open(source, gdal.GA_Update), "gdaladdo", source)
+        if dataset.BuildOverviews(resampling_method.upper(),
+                                  list(overview_levels)) != 0:
+            raise RuntimeError("gdaladdo failed on {}: {}".format(
+                source, gdal.GetLastErrorMsg()))
+        dataset = None  # flush to disk
+    return source
+
+
+def gdal_info(source, gdal_runtime=None):
+    _require_gdal()
+    with gdal_config(**get_runtime_config(gdal_runtime)):
+        return _check_gdal_result(gdal.Info(source), "gdalinfo", source)
+
+
+#
+# Processing of the input files of an operator, one after the other or in a
+# pool of processes
+#
+
+class GDALFileError(ProductError):
+    """Processing of one of the input files of an operator failed."""
+
+    def __init__(self, operation, path, details):
+        super(GDALFileError, self).__init__(operation, path, details)
+        self.path = path
+
+
+def map_input_files(operation, function, input_paths, arguments,
+                    max_workers=1):
+    """Call ``function(*args)`` for each input file and its ``args`` in
+    ``arguments``, in a pool of up to ``max_workers`` processes (see
+    utils.map_products).
+
+    Returns:
+        list: the results, in the order of ``input_paths``
+
+    Raises:
+        GDALFileError: on the first file failing, the files still being
+            processed are abandoned
+    """
+    try:
+        return map_products(operation, function, input_paths, arguments,
+                            max_workers=max_workers)
+    except ProductError as e:
+        raise GDALFileError(e.operation, e.product, e.details)
+
+
+def _run_shell_command(command):
+    log.info("Running: {}".format(command))
+    check_call(command, shell=True)
+
+
+def get_gdalwarp_command(source, destination, target_srs, tile_size,
+                         overwrite=False, gdal_runtime=None,
+                         error_threshold=None):
+    creation_options = get_runtime_creation_options(gdal_runtime, {
+        "TILED": "YES",
+        "BLOCKXSIZE": tile_size,
+        "BLOCKYSIZE": tile_size,
+    })
+    warp_args = get_runtime_warp_args(gdal_runtime)
+    if error_threshold is not None:
+        warp_args += ["-et", str(error_threshold)]
+    return "gdalwarp {config_opts} {warp_opts} {overwrite} -t_srs {srs} " \
+        "{creation_opts} {src} {dst}".format(
+            config_opts=_get_gdal_config_options(
+                **get_runtime_config(gdal_runtime)),
+            warp_opts=" ".join(warp_args),
+            overwrite="-overwrite" if overwrite else "",
+            srs=target_srs,
+            creation_opts=_get_gdal_creation_options(**creation_options),
+            src=source,
+            dst=destination
+        )
+
+
+def warp_file(source, destination, target_srs, tile_size, overwrite=False,
+              in_process=False, gdal_runtime=None, error_threshold=None):
+    if in_process:
+        gdal_warp(source, destination, target_srs, tile_size,
+                  overwrite=overwrite, gdal_runtime=gdal_runtime,
+                  error_threshold=error_threshold)
+    else:
+        _run_shell_command(get_gdalwarp_command(
+            source, destination, target_srs, tile_size,
+            overwrite=overwrite, gdal_runtime=gdal_runtime,
+            error_threshold=error_threshold))
+    return destination
+
+
+def translate_file(source, destination, output_type, creation_options,
+                   config_options=None, in_process=False, gdal_runtime=None):
+    if in_process:
+        gdal_translate(source, destination, output_type, creation_options,
+                       config_options=config_options,
+                       gdal_runtime=gdal_runtime)
+    else:
+        _run_shell_command(get_gdal_translate_command(
+            source=source, destination=destination,
+            output_type=output_type,
+            creation_options=get_runtime_creation_options(
+                gdal_runtime, creation_options),
+            config_options=get_runtime_config(gdal_runtime, config_options)
+        ))
+    return destination
+
+
+def addo_file(source, resampling_method, max_overview_level,
+              compress_overview=None, plan_levels=False,
+              min_overview_size=None, level_options=None, in_process=False,
+              gdal_runtime=None, split_levels=False):
+    """Build the overviews of ``source``, return the plan followed (see
+    GDALAddoOperator)."""
+    plan = {}
+    if plan_levels:
+        width, height, block_x, block_y = get_raster_layout(
+            source, in_process, gdal_runtime)
+        min_size = min_overview_size
+        if min_size is None:
+            tiled = block_x < width
+            min_size = block_x if tiled else DEFAULT_MIN_OVERVIEW_SIZE
+        levels = plan_overview_levels(
+            width, height, min_size, max_overview_level)
+        plan.update({
+            "size": [width, height],
+            "block_size": [block_x, block_y],
+            "min_overview_size": min_size,
+        })
+    else:
+        levels = get_overview_levels(max_overview_level)
+    plan["steps"] = plan_overview_steps(
+        levels, resampling_method,
+        compress_overview=compress_overview,
+        level_options=level_options,
+        split_levels=split_levels
+    )
+    log.info("Generating overviews for {!r}: {}".format(source, plan))
+    for step in plan["steps"]:
+        started = time.time()
+        if in_process:
+            gdal_addo(source, step["levels"], step["resampling_method"],
+                      compress_overview=step["compress_overview"],
+                      gdal_runtime=gdal_runtime)
+        else:
+            _run_shell_command(get_gdaladdo_command(
+                source, overview_levels=step["levels"],
+                resampling_method=step["resampling_method"],
+                compress_overview=step["compress_overview"],
+                config_options=get_runtime_config(gdal_runtime)
+            ))
+        step["seconds"] = round(time.time() - started, 3)
+        log.info("Built overviews {} in {}s".format(
+            step["levels"], step["seconds"]))
+    # time of each level, or of the levels built together as "2+4+8"
+    plan["level_seconds"] = dict(
+        ("+".join(str(level) for level in step["levels"]), step["seconds"])
+        for step in plan["steps"])
+    return plan
+
+
 class GDALWarpOperator(BaseOperator):
     """ Execute gdalwarp with given options on list of files fetched from XCom. Returns output files paths to XCom.
 
@@ -93,19 +508,31 @@ class GDALWarpOperator(BaseOperator):
         overwrite (str): parameter for gdalwarp
         dstdir (str): output files directory
         get_inputs_from (str): task_id used to fetch input files list from XCom
+        get_inputs_key (str): key of the input files when the XCom value is a dict
+        in_process (bool): run through the GDAL python bindings instead of the
+            command line tools
+        gdal_runtime (dict): GDAL runtime profile of the collection, see
+            config/settings.py
+        max_workers (int): number of input files processed concurrently, each
+            in its own process
 
     Returns:
-        list: list of output files path
+        list: list of output files path, in the order of the input files
     """
 
     @apply_defaults
     def __init__(self, target_srs, tile_size, overwrite, dstdir, get_inputs_from=None,
-                 *args, **kwargs):
+                 get_inputs_key=None, in_process=False, gdal_runtime=None,
+                 max_workers=1, *args, **kwargs):
         self.target_srs = target_srs
         self.tile_size = str(tile_size)
         self.overwrite = overwrite
         self.dstdir = dstdir
         self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
+        self.in_process = in_process
+        self.gdal_runtime = gdal_runtime
+        self.max_workers = int(max_workers)
 
         super(GDALWarpOperator, self).__init__(*args, **kwargs)
 
@@ -133,27 +560,27 @@ class GDALWarpOperator(BaseOperator):
         if input_paths is None:
             log.info('Nothing to process')
             return None
+        input_paths = get_input_paths(input_paths, self.get_inputs_key)
+        # files of the extraction cache may have been evicted since
+        input_paths = [get_extracted_path(path) for path in input_paths]
 
-        output_paths=[]
+        arguments = []
         for srcfile in input_paths:
             log.info('srcfile: %s', srcfile)
             srcfilename = os.path.basename(srcfile)
             dstfile = os.path.join(dstdir, srcfilename)
             log.info('dstfile: %s', dstfile)
+            arguments.append((srcfile, dstfile, self.target_srs,
+                              self.tile_size, self.overwrite, self.in_process,
+                              self.gdal_runtime))
 
-            # build gdalwarp command
-            self.overwrite = '-overwrite' if self.overwrite else ''
-            gdalwarp_command = (
-                'gdalwarp ' + self.overwrite + ' -t_srs ' + self.target_srs +
-                ' -co TILED=YES -co BLOCKXSIZE=' + self.tile_size +
-                ' -co BLOCKYSIZE=' + self.tile_size + ' ' + srcfile + ' ' +
-                dstfile
-            )
-            log.info('The complete GDAL warp command is: %s', gdalwarp_command)
-            bo = BashOperator(task_id="bash_operator_warp", bash_command=gdalwarp_command)
-            bo.execute(context)
-            output_paths.append(dstfile)
-
+        try:
+            output_paths = map_input_files("gdalwarp", warp_file, input_paths,
+                                           arguments, self.max_workers)
+        finally:
+            # a retry extracts the inputs again if they are evicted meanwhile
+            for srcfile in input_paths:
+                release_extracted_path(srcfile, get_pin_owner(context))
         return output_paths
 
 
@@ -165,45 +592,75 @@ class GDALAddoOperator(BaseOperator):
         max_overview_level (str): parameter for gdaladdo
         compress_overview (str): parameter for gdaladdo
         get_inputs_from (str): task_id used to fetch input files list from XCom
+        get_inputs_key (str): key of the input files when the XCom value is a dict
+        in_process (bool): run through the GDAL python bindings instead of the
+            command line tools
+        plan_levels (bool): pick the levels from the size of each raster,
+            down to the first overview fitting in min_overview_size, instead
+            of every power of two up to max_overview_level (which stays the
+            upper bound)
+        min_overview_size (int): size of the smallest overview, defaults to
+            the tile size of the raster
+        level_options (dict): "resampling_method" and/or "compress_overview"
+            of specific levels, keyed by level
+        gdal_runtime (dict): GDAL runtime profile of the collection, see
+            config/settings.py
+        max_workers (int): number of input files processed concurrently, each
+            in its own process
+        split_levels (bool): build each overview level in its own gdaladdo
+            run to time every level. Each run reads the full resolution
+            raster, so this is slower and meant for profiling
 
     Returns:
-        list: list containing output files path
+        list: list containing output files path. The overview plan of each
+        file is pushed to XCom under the "overview_plans" key, with the time
+        spent on each gdaladdo run and, in "level_seconds", on each level.
+        Levels built by the same run are timed together under a "2+4+8"
+        label
     """
 
     @apply_defaults
     def __init__(self, get_inputs_from, resampling_method,
                  max_overview_level, compress_overview=None,
+                 get_inputs_key=None, in_process=False, plan_levels=False,
+                 min_overview_size=None, level_options=None,
+                 gdal_runtime=None, max_workers=1, split_levels=False,
                  *args, **kwargs):
         super(GDALAddoOperator, self).__init__(*args, **kwargs)
         self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
+        self.in_process = in_process
         self.resampling_method = resampling_method
         self.max_overview_level = int(max_overview_level)
         self.compress_overview = compress_overview
+        self.plan_levels = plan_levels
+        self.min_overview_size = min_overview_size
+        self.level_options = level_options
+        self.gdal_runtime = gdal_runtime
+        self.max_workers = int(max_workers)
+        self.split_levels = split_levels
 
     def execute(self, context):
         input_paths = context["task_instance"].xcom_pull(self.get_inputs_from, key=XCOM_RETURN_KEY)
         if input_paths is None:
             log.info("Nothing to process")
             return None
+        input_paths = get_input_paths(input_paths, self.get_inputs_key)
 
-        output_paths = []
-        for input_path in input_paths:
-            levels = get_overview_levels(self.max_overview_level)
-            log.info("Generating overviews for {!r}...".format(input_path))
-            command = get_gdaladdo_command(
-                input_path, overview_levels=levels,
-                resampling_method=self.resampling_method,
-                compress_overview=self.compress_overview
-            )
-            output_path = input_path
-            output_paths.append(output_path)
-            bo = BashOperator(
-                task_id='bash_operator_addo_{}'.format(
-                    os.path.basename(input_path)),
-                bash_command=command
-            )
-            bo.execute(context)
+        arguments = [
+            (input_path, self.resampling_method, self.max_overview_level,
+             self.compress_overview, self.plan_levels, self.min_overview_size,
+             self.level_options, self.in_process, self.gdal_runtime,
+             self.split_levels)
+            for input_path in input_paths
+        ]
+        plans = map_input_files("gdaladdo", addo_file, input_paths,
+                                arguments, self.max_workers)
+        output_paths = list(input_paths)
+        overview_plans = dict(zip(input_paths, plans))
 
+        context["task_instance"].xcom_push(
+            key="overview_plans", value=overview_plans)
         return output_paths
 
 
@@ -214,16 +671,38 @@ class GDALTranslateOperator(BaseOperator):
         creation_options (str): parameter for gdaltranslate
         output_type (str): parameter for gdaltranslate
         get_inputs_from (str): task_id used to fetch input files list from XCom
+        get_inputs_key (str): key of the input files when the XCom value is a dict
+        output_dir (str): directory of the translated files, defaults to a
+            __translated directory next to the input files. Required for
+            remote inputs (e.g. /vsicurl/ urls)
+        config_options (dict): GDAL configuration options passed with
+            --config, e.g. to set up the VSI cache for remote inputs
+        in_process (bool): run through the GDAL python bindings instead of the
+            command line tools
+        gdal_runtime (dict): GDAL runtime profile of the collection, see
+            config/settings.py. config_options and creation_options take
+            precedence over it
+        max_workers (int): number of input files processed concurrently, each
+            in its own process
 
     Returns:
-        list: list containing output files path
+        list: list containing output files path, in the order of the input
+        files
     """
 
     @apply_defaults
     def __init__(self, get_inputs_from, output_type="UInt16",
-                 creation_options=None, *args, **kwargs):
+                 creation_options=None, get_inputs_key=None, output_dir=None,
+                 config_options=None, in_process=False, gdal_runtime=None,
+                 max_workers=1, *args, **kwargs):
         super(GDALTranslateOperator, self).__init__(*args, **kwargs)
         self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
+        self.output_dir = output_dir
+        self.config_options = dict(config_options or {})
+        self.in_process = in_process
+        self.gdal_runtime = gdal_runtime
+        self.max_workers = int(max_workers)
         self.output_type = str(output_type)
         self.creation_options = dict(
             creation_options) if creation_options is not None else {
@@ -237,13 +716,16 @@ class GDALTranslateOperator(BaseOperator):
         if input_paths is None:
             log.info("Nothing to process")
             return None
+        input_paths = get_input_paths(input_paths, self.get_inputs_key)
 
-        # If message from XCom is a string with single file path, turn it into a string
-        if isinstance(input_paths, six.string_types):
-            input_paths = [ input_paths ]
-
-        working_dir = os.path.join(os.path.dirname(input_paths[0]),
-                                   "__translated")
+        if self.output_dir is not None:
+            working_dir = self.output_dir
+        elif is_remote_path(input_paths[0]):
+            raise ValueError(
+                "output_dir is required to translate {}".format(input_paths[0]))
+        else:
+            working_dir = os.path.join(os.path.dirname(input_paths[0]),
+                                       "__translated")
         try:
             os.makedirs(working_dir)
         except OSError as exc:
@@ -252,26 +734,19 @@ class GDALTranslateOperator(BaseOperator):
             else:
                 raise
 
-        output_paths = []
+        arguments = []
         for input_path in input_paths:
             output_img_filename = 'translated_{}'.format(
                 os.path.basename(input_path))
             output_path = os.path.join(working_dir, output_img_filename)
-            output_paths.append(output_path)
-            command = get_gdal_translate_command(
-                source=input_path, destination=output_path,
-                output_type=self.output_type,
-                creation_options=self.creation_options
-            )
+            log.info("Translating {} to {}".format(input_path, output_path))
+            arguments.append((input_path, output_path, self.output_type,
+                              self.creation_options, self.config_options,
+                              self.in_process, self.gdal_runtime))
 
-            log.info("The complete GDAL translate command is: {}".format(command))
-            b_o = BashOperator(
-                task_id="bash_operator_translate",
-                bash_command=command
-            )
-            b_o.execute(context)
-
-        output_paths = [output_path]
+        output_paths = map_input_files("gdal_translate", translate_file,
+                                       input_paths, arguments,
+                                       self.max_workers)
         return output_paths
 
 class GDALInfoOperator(BaseOperator):
@@ -279,15 +754,24 @@ class GDALInfoOperator(BaseOperator):
 
     Args:
         get_inputs_from (str): task_id used to fetch input files list from XCom
+        get_inputs_key (str): key of the input files when the XCom value is a dict
+        in_process (bool): run through the GDAL python bindings instead of the
+            command line tools
+        gdal_runtime (dict): GDAL runtime profile of the collection, see
+            config/settings.py
 
     Returns:
         dict: dictionary mapping input files to the matching gdalinfo output
     """
 
     @apply_defaults
-    def __init__(self, get_inputs_from, *args, **kwargs):
+    def __init__(self, get_inputs_from, get_inputs_key=None, in_process=False,
+                 gdal_runtime=None, *args, **kwargs):
         super(GDALInfoOperator, self).__init__(*args, **kwargs)
         self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
+        self.in_process = in_process
+        self.gdal_runtime = gdal_runtime
 
     def execute(self, context):
         input_paths = context["task_instance"].xcom_pull(self.get_inputs_from, key=XCOM_RETURN_KEY)
@@ -295,24 +779,268 @@ class GDALInfoOperator(BaseOperator):
         if input_paths is None:
             log.info("Nothing to process")
             return None
+        input_paths = get_input_paths(input_paths, self.get_inputs_key)
 
         gdalinfo_outputs = {}
         for input_path in input_paths:
-            command = ["gdalinfo"]
             log.info("Running GDALInfo on {}...".format(input_path))
-            command.append(input_path)
-            gdalinfo_output = check_output(command)
+            if self.in_process:
+                gdalinfo_output = gdal_info(input_path,
+                                            gdal_runtime=self.gdal_runtime)
+            else:
+                gdalinfo_output = check_output(
+                    ["gdalinfo"] +
+                    get_gdal_config_args(get_runtime_config(self.gdal_runtime)) +
+                    [input_path]
+                )
             log.info("{}".format(gdalinfo_output))
             gdalinfo_outputs[input_path] = gdalinfo_output
 
         return gdalinfo_outputs
 
 
+def has_cog_driver(in_process=False):
+    """True if GDAL (the bindings or the command line tools) provides the
+    COG driver, available since GDAL 3.1."""
+    if in_process:
+        _require_gdal()
+        return gdal.GetDriverByName("COG") is not None
+    formats = check_output(["gdalinfo", "--formats"]).decode("utf-8")
+    return any(
+        line.split()[0] == "COG" for line in formats.splitlines()
+        if line.strip()
+    )
+
+
+def _run_gdal_command(command, config_options):
+    command = command[:1] + get_gdal_config_args(config_options) + command[1:]
+    log.info("Running: {}".format(" ".join(command)))
+    check_call(command)
+
+
+def gdal_cog(source, destination, compress, blocksize, resampling_method,
+             overview_levels, target_srs=None, output_type=None,
+             config_options=None, in_process=False, use_cog_driver=True,
+             gdal_runtime=None):
+    """Write ``source`` as a tiled, compressed GeoTIFF with internal
+    overviews, optionally reprojected to ``target_srs``.
+
+    With the COG driver this is a single gdal_translate. Otherwise the
+    source is described by a temporary VRT, or warped once to
+    ``target_srs`` into a temporary tiled GeoTIFF, whose overviews are
+    computed before the destination is written with COPY_SRC_OVERVIEWS.
+    """
+    config_options = get_runtime_config(gdal_runtime, config_options)
+    output_type_tokens = ["-ot", output_type] if output_type else []
+    if use_cog_driver:
+        creation_options = {
+            "COMPRESS": compress,
+            "BLOCKSIZE": blocksize,
+            "RESAMPLING": resampling_method.upper(),
+        }
+        if target_srs is not None:
+            creation_options["TARGET_SRS"] = target_srs
+        creation_options = _creation_option_list(
+            get_runtime_creation_options(gdal_runtime, creation_options))
+        if in_process:
+            _require_gdal()
+            with gdal_config(**config_options):
+                dataset = gdal.Translate(
+                    destination, source, format="COG",
+                    outputType=(gdal.GetDataTypeByName(output_type)
+                                if output_type else gdal.GDT_Unknown),
+                    creationOptions=creation_options
+                )
+                _check_gdal_result(dataset, "gdal_translate", source)
+                dataset = None  # flush to disk
+        else:
+            command = ["gdal_translate", "-of", "COG"] + output_type_tokens
+            for option in creation_options:
+                command += ["-co", option]
+            _run_gdal_command(command + [source, destination], config_options)
+        return destination
+
+    # the source is warped once into a temporary tiled GeoTIFF, or described
+    # by a VRT when it is only translated, so that building the overviews and
+    # writing the destination don't run the warp again
+    if target_srs is not None:
+        work_path = destination + ".warped.tif"
+        work_creation_options = _creation_option_list(
+            get_runtime_creation_options(gdal_runtime, {
+                "TILED": "YES",
+                "BLOCKXSIZE": blocksize,
+                "BLOCKYSIZE": blocksize,
+                "BIGTIFF": "IF_SAFER",
+            }))
+    else:
+        work_path = destination + ".vrt"
+    creation_options = _creation_option_list(
+        get_runtime_creation_options(gdal_runtime, {
+            "TILED": "YES",
+            "BLOCKXSIZE": blocksize,
+            "BLOCKYSIZE": blocksize,
+            "COMPRESS": compress,
+            "COPY_SRC_OVERVIEWS": "YES",
+        }))
+    try:
+        if in_process:
+            _require_gdal()
+            with gdal_config(**dict(config_options, COMPRESS_OVERVIEW=compress)):
+                output_type_code = (gdal.GetDataTypeByName(output_type)
+                                    if output_type else gdal.GDT_Unknown)
+                if target_srs is not None:
+                    work = gdal.Warp(work_path, source, dstSRS=target_srs,
+                                     outputType=output_type_code,
+                                     creationOptions=work_creation_options,
+                                     **get_runtime_warp_kwargs(gdal_runtime))
+                    _check_gdal_result(work, "gdalwarp", source)
+                else:
+                    work = gdal.Translate(work_path, source, format="VRT",
+                                          outputType=output_type_code)
+                    _check_gdal_result(work, "VRT creation", source)
+                if work.BuildOverviews(resampling_method.upper(),
+                                       list(overview_levels)) != 0:
+                    raise RuntimeError("gdaladdo failed on {}: {}".format(
+                        work_path, gdal.GetLastErrorMsg()))
+                dataset = gdal.Translate(destination, work,
+                                         creationOptions=creation_options)
+                _check_gdal_result(dataset, "gdal_translate", work_path)
+                dataset = work = None  # flush to disk
+        else:
+            if target_srs is not None:
+                command = (["gdalwarp", "-t_srs", target_srs] +
+                           get_runtime_warp_args(gdal_runtime))
+                for option in work_creation_options:
+                    command += ["-co", option]
+                addo_command = ["gdaladdo", "-r", resampling_method]
+            else:
+                command = ["gdal_translate", "-of", "VRT"]
+                addo_command = ["gdaladdo", "-ro", "-r", resampling_method]
+            _run_gdal_command(
+                command + output_type_tokens + [source, work_path],
+                config_options)
+            _run_gdal_command(
+                addo_command + [work_path] +
+                [str(level) for level in overview_levels],
+                dict(config_options, COMPRESS_OVERVIEW=compress))
+            command = ["gdal_translate"]
+            for option in creation_options:
+                command += ["-co", option]
+            _run_gdal_command(command + [work_path, destination], config_options)
+    finally:
+        for path in (work_path, work_path + ".ovr"):
+            if os.path.exists(path):
+                os.remove(path)
+    return destination
+
+
+class GDALCOGOperator(BaseOperator):
+    """ Write the files fetched from XCom as Cloud Optimized GeoTIFFs (tiled,
+    compressed, with internal overviews) in a single pass, in place of a
+    translate (or warp) + addo chain. Returns output files paths to XCom.
+
+    Args:
+        get_inputs_from (str): task_id used to fetch input files list from XCom
+        get_inputs_key (str): key of the input files when the XCom value is a dict
+        output_dir (str): directory of the output files, defaults to a __cog
+            directory next to the input files. Required for remote inputs
+        target_srs (str): reproject the files to this SRS
+        output_type (str): data type of the output files, same as the input
+            by default
+        compress (str): compression of the image and its overviews
+        blocksize (int): size of the tiles
+        resampling_method (str): resampling of the overviews
+        max_overview_level (int): last overview level when the COG driver
+            (GDAL >= 3.1) is not available, which picks the levels itself
+        config_options (dict): GDAL configuration options
+        in_process (bool): run through the GDAL python bindings instead of the
+            command line tools
+        gdal_runtime (dict): GDAL runtime profile of the collection, see
+            config/settings.py
+
+    Returns:
+        list: list containing output files path
+    """
+
+    @apply_defaults
+    def __init__(self, get_inputs_from, get_inputs_key=None, output_dir=None,
+                 target_srs=None, output_type=None, compress="DEFLATE",
+                 blocksize=512, resampling_method="average",
+                 max_overview_level=128, config_options=None,
+                 in_process=False, gdal_runtime=None, *args, **kwargs):
+        super(GDALCOGOperator, self).__init__(*args, **kwargs)
+        self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
+        self.output_dir = output_dir
+        self.target_srs = target_srs
+        self.output_type = output_type
+        self.compress = compress
+        self.blocksize = int(blocksize)
+        self.resampling_method = resampling_method
+        self.max_overview_level = int(max_overview_level)
+        self.config_options = dict(config_options or {})
+        self.in_process = in_process
+        self.gdal_runtime = gdal_runtime
+
+    def execute(self, context):
+        input_paths = context["task_instance"].xcom_pull(self.get_inputs_from, key=XCOM_RETURN_KEY)
+        if input_paths is None:
+            log.info("Nothing to process")
+            return None
+        input_paths = get_input_paths(input_paths, self.get_inputs_key)
+        # files of the extraction cache may have been evicted since
+        input_paths = [get_extracted_path(path) for path in input_paths]
+
+        use_cog_driver = has_cog_driver(self.in_process)
+        log.info("COG driver available: {}".format(use_cog_driver))
+        levels = get_overview_levels(self.max_overview_level)
+        output_paths = []
+        try:
+            for input_path in input_paths:
+                if self.output_dir is not None:
+                    working_dir = self.output_dir
+                elif is_remote_path(input_path):
+                    raise ValueError(
+                        "output_dir is required to process {}".format(input_path))
+                else:
+                    working_dir = os.path.join(os.path.dirname(input_path), "__cog")
+                try:
+                    os.makedirs(working_dir)
+                except OSError as exc:
+                    if exc.errno == 17:
+                        pass  # directory already exists
+                    else:
+                        raise
+                output_path = os.path.join(working_dir, os.path.basename(input_path))
+                log.info("Writing COG {} from {}...".format(output_path, input_path))
+                gdal_cog(
+                    input_path, output_path,
+                    compress=self.compress,
+                    blocksize=self.blocksize,
+                    resampling_method=self.resampling_method,
+                    overview_levels=levels,
+                    target_srs=self.target_srs,
+                    output_type=self.output_type,
+                    config_options=self.config_options,
+                    in_process=self.in_process,
+                    use_cog_driver=use_cog_driver,
+                    gdal_runtime=self.gdal_runtime
+                )
+                output_paths.append(output_path)
+        finally:
+            # a retry extracts the inputs again if they are evicted meanwhile
+            for input_path in input_paths:
+                release_extracted_path(input_path, get_pin_owner(context))
+
+        return output_paths
+
+
 class GDALPlugin(AirflowPlugin):
     name = "GDAL_plugin"
     operators = [
         GDALWarpOperator,
         GDALAddoOperator,
         GDALTranslateOperator,
-        GDALInfoOperator
+        GDALInfoOperator,
+        GDALCOGOperator
     ]
@@ -26,7 +26,6 @@
 """
 
 import logging
-import requests
 from pprint import pprint, pformat
 from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
@@ -36,6 +35,12 @@ import config.xcom_keys as xk
 from geoserver.catalog import Catalog
 import json
 import os
+import transfer
+import fcntl
+import hashlib
+import tempfile
+import time
+from datetime import timedelta
 
 import sys
 reload(sys)
@@ -284,13 +289,11 @@ def publish_product(geoserver_username, geoserver_password, geoserver_rest_endpo
         for zip_file in zip_files:
             # POST product.zip
             log.info("Publishing: {}".format(zip_file))
-            d = open(zip_file, 'rb').read()
-            a = requests.auth.HTTPBasicAuth(geoserver_username, geoserver_password)
             h = {'Content-type': 'application/zip'}
 
-            r = requests.post(geoserver_rest_endpoint,
-                auth=a,
-                data=d,
+            r, stats = transfer.upload(geoserver_rest_endpoint,
+                zip_file,
+                auth=(geoserver_username, geoserver_password),
                 headers=h)
 
             if r.ok:
@@ -304,7 +307,7 @@ def publish_product(geoserver_username, geoserver_password, geoserver_rest_endpo
         log.warn("No product.zip found.")
         return list()
 
-def get_published_products(geoserver_username, geoserver_password, geoserver_rest_url, collection_id, *args, **kwargs):
+def get_published_products(geoserver_username, geoserver_password, geoserver_rest_url, collection_id, offset=None, limit=None, *args, **kwargs):
     # This function returns a list of published products ids 
     log.info("get_published_products task")
     log.info("""
@@ -318,8 +321,12 @@ def get_published_products(geoserver_username, geoserver_password, geoserver_res
             collection_id
         )
     )
-    a = requests.auth.HTTPBasicAuth(geoserver_username, geoserver_password)
-    r = requests.get('{}/oseo/collections/{}/products'.format(geoserver_rest_url, collection_id), auth=a)
+    params = {}
+    if offset is not None:
+        params['offset'] = offset
+    if limit is not None:
+        params['limit'] = limit
+    r = transfer.request('GET', '{}/oseo/collections/{}/products'.format(geoserver_rest_url, collection_id), auth=(geoserver_username, geoserver_password), params=params)
     if r.ok:
        published_products_dict = r.json()
        # Here we fill up the already published products id's
@@ -344,8 +351,7 @@ def is_product_published(geoserver_username, geoserver_password, geoserver_rest_
             product_id
         )
     )
-    a = requests.auth.HTTPBasicAuth(geoserver_username, geoserver_password)
-    r = requests.get("{}/oseo/collections/{}/products/{}".format(geoserver_rest_url, collection_id, product_id), auth=a)
+    r = transfer.request("GET", "{}/oseo/collections/{}/products/{}".format(geoserver_rest_url, collection_id, product_id), auth=(geoserver_username, geoserver_password))
     if r.status_code == 200:
        return True
     elif r.status_code == 404:
@@ -353,6 +359,111 @@ def is_product_published(geoserver_username, geoserver_password, geoserver_rest_
     else:
        r.raise_for_status()
 
+class PublishedProductsIndex(object):
+    """Time-bounded, file-backed cache of the ids of the products published
+    in an OpenSearch collection.
+
+    The ids are fetched in bulk with ``get_published_products`` and cached
+    in a JSON file keyed by GeoServer URL and collection, shared by all the
+    tasks running on the worker. Concurrent refreshes are serialized with a
+    file lock so that only one task queries GeoServer when the cache expires.
+
+    Args:
+        geoserver_username (str): account info to connect to GeoServer
+        geoserver_password (str): account info to connect to GeoServer
+        geoserver_rest_url (str): REST url of GeoServer
+        collection_id (str): OpenSearch collection
+        cache_dir (str): directory of the cache files (defaults to the system
+            temporary directory)
+        ttl (timedelta): time after which the cached ids are fetched again
+        page_size (int): number of products requested per page
+    """
+
+    def __init__(self, geoserver_username, geoserver_password,
+                 geoserver_rest_url, collection_id, cache_dir=None,
+                 ttl=timedelta(minutes=10), page_size=1000):
+        self.geoserver_username = geoserver_username
+        self.geoserver_password = geoserver_password
+        self.geoserver_rest_url = geoserver_rest_url
+        self.collection_id = collection_id
+        self.cache_dir = cache_dir or tempfile.gettempdir()
+        self.ttl = ttl
+        self.page_size = page_size
+        self.cache_path = os.path.join(
+            self.cache_dir, "published_{}_{}.json".format(
+                collection_id,
+                hashlib.md5(geoserver_rest_url).hexdigest()[:8]))
+        self._product_ids = None
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path) as fh:
+                cached = json.load(fh)
+        except (IOError, ValueError):
+            return None
+        age = time.time() - cached["fetched_at"]
+        if age < 0 or age > self.ttl.total_seconds():
+            return None
+        log.info("Using published products of {} cached {:.0f}s ago".format(
+            self.collection_id, age))
+        return set(cached["ids"])
+
+    def _write_cache(self, product_ids):
+        tmp_path = "{}.{}.tmp".format(self.cache_path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump({"fetched_at": time.time(), "ids": sorted(product_ids)}, fh)
+        os.rename(tmp_path, self.cache_path)
+
+    def _fetch(self):
+        product_ids = set()
+        offset = 0
+        while True:
+            page = get_published_products(
+                self.geoserver_username, self.geoserver_password,
+                self.geoserver_rest_url, self.collection_id,
+                offset=offset, limit=self.page_size)
+            new_ids = set(page) - product_ids
+            product_ids.update(new_ids)
+            # stop on the last page, or if paging is not honoured
+            if len(page) < self.page_size or not new_ids:
+                break
+            offset += len(page)
+        log.info("Fetched {} published products of {}".format(
+            len(product_ids), self.collection_id))
+        return product_ids
+
+    def refresh(self):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        with open(self.cache_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # another task might have refreshed it while we were waiting
+                product_ids = self._read_cache()
+                if product_ids is None:
+                    product_ids = self._fetch()
+                    self._write_cache(product_ids)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        self._product_ids = product_ids
+        return product_ids
+
+    def invalidate(self):
+        self._product_ids = None
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
+    def product_ids(self):
+        if self._product_ids is None:
+            self._product_ids = self._read_cache()
+        if self._product_ids is None:
+            self.refresh()
+        return self._product_ids
+
+    def is_published(self, product_id):
+        return product_id in self.product_ids()
+
+
 class GDALPlugin(AirflowPlugin):
     name = "GeoServer_plugin"
     operators = [GSAddMosaicGranule]
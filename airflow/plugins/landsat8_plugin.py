@@ -35,10 +35,14 @@ import shutil
 import zipfile
 import gzip
 import pprint
+import zlib
 from datetime import timedelta
+import hashlib
+from multiprocessing.pool import ThreadPool
+import time
 import psycopg2
-import urllib
-import requests
+import psycopg2.extensions
+import psycopg2.pool
 
 from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
@@ -49,7 +53,9 @@ from pgmagick import Image
 from osgeo import osr
 
 from geoserver_plugin import create_owslinks_dict
-from geoserver_plugin import is_product_published
+from geoserver_plugin import PublishedProductsIndex
+import transfer
+from thumbnails import render_thumbnails
 
 log = logging.getLogger(__name__)
 pp = pprint.PrettyPrinter(indent=2)
@@ -80,16 +86,377 @@ BoundingBox = namedtuple("BoundingBox", [
     "lrlat"
 ])
 
+# size of the chunks read from the network when downloading/streaming
+CHUNK_SIZE = 1024 * 1024
+
+SCENE_LIST_TABLE = "scene_list"
+SCENE_LIST_STAGING_TABLE = "scene_list_staging"
+SCENE_LIST_COLUMNS = (
+    "productid",
+    "entityid",
+    "acquisitiondate",
+    "cloudcover",
+    "processinglevel",
+    "path",
+    "row",
+    "min_lat",
+    "min_lon",
+    "max_lat",
+    "max_lon",
+    "download_url",
+)
+
+SCENE_LIST_COLUMN_TYPES = (
+    ("productid", "character varying(40) DEFAULT NULL::character varying"),
+    ("entityid", "character varying(21) DEFAULT NULL::character varying"),
+    ("acquisitiondate", "timestamp without time zone"),
+    ("cloudcover", "numeric(5,2) DEFAULT NULL::numeric"),
+    ("processinglevel", "character varying(4) DEFAULT NULL::character varying"),
+    ("path", "integer"),
+    ("row", "integer"),
+    ("min_lat", "numeric(8,5) DEFAULT NULL::numeric"),
+    ("min_lon", "numeric(9,5) DEFAULT NULL::numeric"),
+    ("max_lat", "numeric(8,5) DEFAULT NULL::numeric"),
+    ("max_lon", "numeric(9,5) DEFAULT NULL::numeric"),
+    ("download_url", "character varying(112) DEFAULT NULL::character varying"),
+)
+
+# indexes backing the refresh (productid) and Landsat8SearchOperator
+# (path/row pairs within an acquisitiondate range)
+SCENE_LIST_INDEXES = (
+    ("productid_idx", "(productid)"),
+    ("path_row_acquisitiondate_idx", '(path, "row", acquisitiondate)'),
+    ("acquisitiondate_brin_idx", "USING brin (acquisitiondate)"),
+)
+
+
 def download_file(url, destination_directory):
-    response = requests.get(url, stream=True)
-    full_path = os.path.join(destination_directory, url.rpartition("/")[-1])
-    with open(full_path, "wb") as fh:
-        for chunk in response.iter_content(chunk_size=1024):
-            fh.write(chunk)
-    return full_path
+    return transfer.download(url, destination_directory).path
+
+
+class GzipStreamReader(object):
+    """Read-only file-like object decompressing a gzip stream on the fly.
+
+    Only the methods used by ``cursor.copy_expert`` (``read`` and
+    ``readline``) are implemented. At most one chunk of compressed data plus
+    its decompressed counterpart is kept in memory at any time.
+
+    Args:
+        stream (file): file-like object providing the gzipped bytes
+            (e.g. ``requests.Response.raw``)
+        chunk_size (int): number of compressed bytes read from ``stream`` at
+            once
+        expected_bytes (int): announced size of the compressed stream; a
+            TransferError is raised if the stream ends before that, so a
+            truncated download aborts the COPY instead of being loaded
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE, expected_bytes=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.expected_bytes = expected_bytes
+        # 16 + MAX_WBITS tells zlib to expect a gzip header and trailer
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = b""
+        self._eof = False
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+
+    def _fill(self, size=-1, until=None):
+        while not self._eof:
+            if size >= 0 and len(self._buffer) >= size:
+                break
+            if until is not None and until in self._buffer:
+                break
+            chunk = self.stream.read(self.chunk_size)
+            if chunk:
+                self.compressed_bytes += len(chunk)
+                data = self._decompressor.decompress(chunk)
+            else:
+                if (self.expected_bytes is not None and
+                        self.compressed_bytes != self.expected_bytes):
+                    raise transfer.TransferError(
+                        "Stream ended after {} of {} bytes".format(
+                            self.compressed_bytes, self.expected_bytes))
+                data = self._decompressor.flush()
+                self._eof = True
+            self.decompressed_bytes += len(data)
+            self._buffer += data
+
+    def read(self, size=-1):
+        self._fill(size=size)
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        self._fill(until=b"\n")
+        end = self._buffer.find(b"\n") + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+        data, self._buffer = self._buffer[:end], self._buffer[end:]
+        return data
+
+
+def get_scene_list_state_path(download_dir, download_url):
+    """Return the path of the file keeping the validators (ETag and
+    Last-Modified) of the last scene list loaded into the db."""
+    return os.path.join(
+        download_dir, "{}.state.json".format(download_url.rpartition("/")[-1]))
+
+
+def read_scene_list_state(state_path):
+    try:
+        with open(state_path) as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_scene_list_state(state_path, state):
+    state_dir = os.path.dirname(state_path)
+    if not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as fh:
+        json.dump(state, fh)
+    os.rename(tmp_path, state_path)
+
+
+def get_conditional_headers(state):
+    headers = {}
+    if state.get("etag"):
+        headers["If-None-Match"] = state["etag"]
+    if state.get("last_modified"):
+        headers["If-Modified-Since"] = state["last_modified"]
+    return headers
+
+
+def get_response_validators(response):
+    return {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def scene_list_modified(get_inputs_from, *args, **kwargs):
+    """ShortCircuitOperator callable: True if the DownloadSceneList task
+    ``get_inputs_from`` actually downloaded a new scene list."""
+    validators = kwargs["ti"].xcom_pull(
+        task_ids=get_inputs_from, key=XCOM_RETURN_KEY)
+    return validators is not None
+
+
+def _quoted_columns(prefix=""):
+    return ", ".join('{}"{}"'.format(prefix, c) for c in SCENE_LIST_COLUMNS)
+
+
+def get_scene_list_merge_statements(table=SCENE_LIST_TABLE,
+                                    staging_table=SCENE_LIST_STAGING_TABLE):
+    """Return the UPDATE, INSERT and DELETE statements merging the staging
+    table into the scene list table, keyed by productid."""
+    data_columns = [c for c in SCENE_LIST_COLUMNS if c != "productid"]
+    update = (
+        "UPDATE {table} AS t SET {assignments} "
+        "FROM {staging} AS s "
+        "WHERE t.productid = s.productid "
+        "AND ({old}) IS DISTINCT FROM ({new})".format(
+            table=table,
+            staging=staging_table,
+            assignments=", ".join(
+                '"{0}" = s."{0}"'.format(c) for c in data_columns),
+            old=", ".join('t."{}"'.format(c) for c in data_columns),
+            new=", ".join('s."{}"'.format(c) for c in data_columns),
+        )
+    )
+    insert = (
+        "INSERT INTO {table} ({columns}) "
+        "SELECT DISTINCT ON (s.productid) {s_columns} FROM {staging} AS s "
+        "WHERE NOT EXISTS "
+        "(SELECT 1 FROM {table} AS t WHERE t.productid = s.productid)".format(
+            table=table,
+            staging=staging_table,
+            columns=_quoted_columns(),
+            s_columns=_quoted_columns("s."),
+        )
+    )
+    delete = (
+        "DELETE FROM {table} AS t WHERE NOT EXISTS "
+        "(SELECT 1 FROM {staging} AS s WHERE s.productid = t.productid)".format(
+            table=table,
+            staging=staging_table,
+        )
+    )
+    return update, insert, delete
+
+
+def refresh_scene_list(connection, source, table=SCENE_LIST_TABLE,
+                       staging_table=SCENE_LIST_STAGING_TABLE):
+    """Refresh the scene list table from a CSV source without downtime.
+
+    The CSV (header included) is first copied into an unlogged staging
+    table. Then, in a single transaction, only new or changed rows are
+    written to ``table`` and rows no longer listed are removed, so searches
+    always see either the previous or the refreshed contents.
+
+    Args:
+        connection: psycopg2 connection
+        source (file): file-like object providing the scene list CSV
+        table (str): name of the scene list table
+        staging_table (str): name of the unlogged staging table
+
+    Returns:
+        dict: number of rows staged, inserted, updated, deleted and unchanged
+    """
+    with connection as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "CREATE UNLOGGED TABLE IF NOT EXISTS {} "
+                "(LIKE {} INCLUDING DEFAULTS)".format(staging_table, table))
+            cursor.execute("TRUNCATE {}".format(staging_table))
+            cursor.copy_expert(
+                "COPY {} ({}) FROM STDIN WITH (FORMAT csv, HEADER true)".format(
+                    staging_table, _quoted_columns()),
+                source
+            )
+            cursor.execute("ANALYZE {}".format(staging_table))
+            cursor.execute("SELECT count(DISTINCT productid) FROM {}".format(
+                staging_table))
+            staged = cursor.fetchone()[0]
+    if staged == 0:
+        raise ValueError(
+            "Scene list source is empty, refusing to empty {}".format(table))
+
+    update, insert, delete = get_scene_list_merge_statements(
+        table, staging_table)
+    with connection as conn:
+        with conn.cursor() as cursor:
+            if is_partitioned(cursor, table):
+                create_scene_list_partitions(cursor, table, staging_table)
+            cursor.execute(update)
+            updated = cursor.rowcount
+            cursor.execute(insert)
+            inserted = cursor.rowcount
+            cursor.execute(delete)
+            deleted = cursor.rowcount
+            cursor.execute("TRUNCATE {}".format(staging_table))
+    return {
+        "staged": staged,
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": deleted,
+        "unchanged": staged - inserted - updated,
+    }
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def create_scene_list_partitions(cursor, table, source_table):
+    """Create the yearly partitions of ``table`` needed to hold the
+    acquisition dates found in ``source_table``."""
+    cursor.execute(
+        "SELECT DISTINCT date_part('year', acquisitiondate)::integer "
+        "FROM {} WHERE acquisitiondate IS NOT NULL".format(source_table))
+    for (year,) in cursor.fetchall():
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {table}_y{year} PARTITION OF {table} "
+            "FOR VALUES FROM ('{year}-01-01') TO ('{next_year}-01-01')".format(
+                table=table, year=year, next_year=year + 1))
+
+
+def ensure_scene_list_schema(connection, table=SCENE_LIST_TABLE,
+                             partition_by_year=False):
+    """Create the scene list table and its indexes if they do not exist.
+
+    Args:
+        connection: psycopg2 connection
+        table (str): name of the scene list table
+        partition_by_year (bool): create the table partitioned by year of
+            acquisitiondate (only applies when the table does not exist yet;
+            partitions are added by ``refresh_scene_list`` as needed)
+    """
+    columns = ", ".join(
+        '"{}" {}'.format(name, definition)
+        for name, definition in SCENE_LIST_COLUMN_TYPES)
+    with connection as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            exists = cursor.fetchone()[0]
+            if not exists:
+                log.info("Creating table {}...".format(table))
+                cursor.execute("CREATE TABLE {} ({}){}".format(
+                    table, columns,
+                    " PARTITION BY RANGE (acquisitiondate)"
+                    if partition_by_year else ""))
+                if partition_by_year:
+                    cursor.execute(
+                        "CREATE TABLE {0}_default PARTITION OF {0} "
+                        "DEFAULT".format(table))
+            elif partition_by_year and not is_partitioned(cursor, table):
+                log.warn("Table {} already exists and is not partitioned, "
+                         "drop it to have it partitioned by year".format(table))
+            for suffix, definition in SCENE_LIST_INDEXES:
+                cursor.execute(
+                    "CREATE INDEX IF NOT EXISTS {0}_{1} ON {0} {2}".format(
+                        table, suffix, definition))
+
+
+def _collect_plan_nodes(plan, nodes):
+    nodes.append(plan)
+    for subplan in plan.get("Plans", []):
+        _collect_plan_nodes(subplan, nodes)
+    return nodes
+
+
+def check_scene_list_search_plan(cursor, query, params=None,
+                                 table=SCENE_LIST_TABLE):
+    """Run EXPLAIN on a scene list search and check that it uses an index.
+
+    Returns:
+        tuple: (used index names, True if ``table`` is read with a
+        sequential scan)
+    """
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    nodes = _collect_plan_nodes(plan[0]["Plan"], [])
+    log.info("Search query plan:\n{}".format(json.dumps(plan, indent=2)))
+    indexes = sorted(set(
+        node["Index Name"] for node in nodes if "Index Name" in node))
+    sequential = any(
+        node["Node Type"] == "Seq Scan" and
+        node.get("Relation Name", "").startswith(table)
+        for node in nodes)
+    if sequential:
+        log.warn("Search query reads {} with a sequential scan, check the "
+                 "indexes created by ensure_scene_list_schema".format(table))
+    else:
+        log.info("Search query uses indexes: {}".format(", ".join(indexes)))
+    return indexes, sequential
 
 
 class DownloadSceneList(BaseOperator):
+    """Download the gzipped Landsat-8 scene list into ``download_dir``.
+
+    The request is conditional on the ETag and Last-Modified values of the
+    scene list last loaded into the db (see ``UpdateSceneList``), so an
+    unchanged list is not downloaded again.
+
+    Args:
+        download_dir (str): path to the download directory
+        download_url (str): URL of the gzipped scene list
+
+    Returns:
+        dict: ETag and Last-Modified of the downloaded list, or None if the
+        list was not modified
+    """
 
     @apply_defaults
     def __init__(self, download_dir, download_url, *args, **kwargs):
@@ -106,9 +473,18 @@ class DownloadSceneList(BaseOperator):
             else:
                 raise
 
+        state = read_scene_list_state(
+            get_scene_list_state_path(self.download_dir, self.download_url))
         log.info("Downloading {!r}...".format(self.download_url))
-        download_file(self.download_url, self.download_dir)
+        stats = transfer.download(
+            self.download_url, self.download_dir,
+            headers=get_conditional_headers(state))
+        if stats.path is None:
+            log.info("Scene list not modified since {}, nothing to do.".format(
+                state.get("last_modified") or state.get("etag")))
+            return None
         log.info("Done!")
+        return get_response_validators(stats)
 
 
 class ExtractSceneList(BaseOperator):
@@ -130,14 +506,48 @@ class ExtractSceneList(BaseOperator):
             path_to_extract, target_path))
         with gzip.open(path_to_extract, 'rb') as zipped_fh, \
              open(target_path, "wb") as extracted_fh:
-            extracted_fh.write(zipped_fh.read())
+            shutil.copyfileobj(zipped_fh, extracted_fh, CHUNK_SIZE)
 
 
 class UpdateSceneList(BaseOperator):
+    """Refresh the ``scene_list`` table from the Landsat-8 scene list.
+
+    By default the CSV produced by ``ExtractSceneList`` is loaded. With
+    ``streaming`` enabled, ``download_url`` is fetched directly and the HTTP
+    body is decompressed and piped into ``COPY`` without touching the disk,
+    so ``DownloadSceneList`` and ``ExtractSceneList`` are not needed.
+    In both cases the data goes through ``refresh_scene_list``, which only
+    applies new or changed rows.
+
+    Args:
+        download_dir (str): directory containing the extracted scene list
+        download_url (str): URL of the gzipped scene list
+        pg_dbname (str): postgres database name
+        pg_hostname (str): postgres host
+        pg_port (str): postgres port
+        pg_username (str): postgres user
+        pg_password (str): postgres password
+        streaming (bool): stream ``download_url`` straight into the db
+        get_inputs_from (str): task_id of the DownloadSceneList task, used to
+            record the validators of the loaded list
+        manage_schema (bool): create the scene list table and its indexes
+            when missing (see ``ensure_scene_list_schema``)
+        partition_by_year (bool): create the table partitioned by year
+
+    Once the db is updated, the ETag and Last-Modified values of the loaded
+    list are recorded next to the download, to make the next request
+    conditional. When streaming, an unchanged list is not loaded at all.
+
+    Returns:
+        dict: number of rows staged, inserted, updated, deleted and unchanged
+        (None if the list was not modified)
+    """
 
     @apply_defaults
     def __init__(self, download_dir, download_url, pg_dbname, pg_hostname,
-                 pg_port, pg_username, pg_password,*args, **kwargs):
+                 pg_port, pg_username, pg_password, streaming=False,
+                 get_inputs_from=None, manage_schema=True,
+                 partition_by_year=False, *args, **kwargs):
         super(UpdateSceneList, self).__init__(*args, **kwargs)
         self.download_dir = download_dir
         self.download_url = download_url
@@ -146,6 +556,12 @@ class UpdateSceneList(BaseOperator):
         self.pg_port = pg_port
         self.pg_username = pg_username
         self.pg_password = pg_password
+        self.streaming = streaming
+        self.get_inputs_from = get_inputs_from
+        self.manage_schema = manage_schema
+        self.partition_by_year = partition_by_year
+        self.state_path = get_scene_list_state_path(
+            download_dir, download_url)
 
     def execute(self, context):
         db_connection = psycopg2.connect(
@@ -154,21 +570,65 @@ class UpdateSceneList(BaseOperator):
                 self.pg_password
             )
         )
-        log.info("Deleting previous data from db...")
-        with db_connection as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("DELETE FROM scene_list;")
+        try:
+            if self.manage_schema:
+                ensure_scene_list_schema(
+                    db_connection, partition_by_year=self.partition_by_year)
+            if self.streaming:
+                stats, validators = self._stream_scene_list(db_connection)
+            else:
+                stats, validators = self._load_scene_list(
+                    db_connection, context)
+        finally:
+            db_connection.close()
+        if stats is None:
+            return None
+        log.info(
+            "Scene list refreshed: {inserted} inserted, {updated} updated, "
+            "{deleted} deleted, {unchanged} unchanged".format(**stats))
+        if validators:
+            write_scene_list_state(self.state_path, validators)
+        return stats
+
+    def _load_scene_list(self, db_connection, context):
         filename = os.path.splitext(self.download_url.rpartition("/")[-1])[0]
         scene_list_path = os.path.join(
             self.download_dir,
             "{}.csv".format(filename))
         log.info("Loading data from {!r} into db...".format(
             scene_list_path))
-        with db_connection as conn, open(scene_list_path) as fh:
-            fh.readline()
-            with conn.cursor() as cursor:
-                cursor.copy_from(fh, "scene_list", sep=",")
-        return True
+        with open(scene_list_path) as fh:
+            stats = refresh_scene_list(db_connection, fh)
+        validators = None
+        if self.get_inputs_from is not None:
+            validators = context["task_instance"].xcom_pull(
+                task_ids=self.get_inputs_from, key=XCOM_RETURN_KEY)
+        return stats, validators
+
+    def _stream_scene_list(self, db_connection):
+        state = read_scene_list_state(self.state_path)
+        log.info("Streaming {!r} into db...".format(self.download_url))
+        transfer_stats = transfer.TransferStats(self.download_url)
+        response = transfer.request(
+            "GET", self.download_url, headers=get_conditional_headers(state),
+            stream=True)
+        if response.status_code == 304:
+            response.close()
+            log.info("Scene list not modified since {}, nothing to do.".format(
+                state.get("last_modified") or state.get("etag")))
+            return None, None
+        response.raise_for_status()
+        reader = GzipStreamReader(
+            response.raw, transfer.BUFFER_SIZE,
+            expected_bytes=transfer.get_expected_length(response))
+        try:
+            stats = refresh_scene_list(db_connection, reader)
+        finally:
+            response.close()
+        transfer_stats.update(reader.compressed_bytes)
+        log.info("Done! {}, {} bytes loaded".format(
+            transfer_stats.finish(), reader.decompressed_bytes))
+        return stats, get_response_validators(response)
 
 
 def create_original_package(get_inputs_from=None, downloaded_bands_list=None, out_dir=None, *args, **kwargs):
@@ -194,6 +654,18 @@ def create_original_package(get_inputs_from=None, downloaded_bands_list=None, ou
         '''
         # Band TIFFs from download task
         downloaded_bands_list = list(task_instance.xcom_pull(task_ids=get_inputs_from['download_task_ids'], key=XCOM_RETURN_KEY))
+        # Landsat8SceneDownloadOperator pushes a single dict of paths
+        download_keys = get_inputs_from.get('download_keys')
+        if download_keys is not None:
+            downloaded_bands_list = [
+                downloaded[key] for downloaded in downloaded_bands_list
+                if downloaded is not None for key in download_keys
+            ]
+        # GDALTranslateOperator pushes a list of paths
+        downloaded_bands_list = [
+            path for downloaded in downloaded_bands_list
+            for path in (downloaded if isinstance(downloaded, list) else [downloaded])
+        ]
 
         log.info("Downloaded Bands List: {}".format(downloaded_bands_list))
         if downloaded_bands_list:
@@ -202,7 +674,8 @@ def create_original_package(get_inputs_from=None, downloaded_bands_list=None, ou
                 return None
             # Get Product ID from band file name
             filename=os.path.basename(downloaded_bands_list[0])
-            m = re.match(r'(.*)_B.+\..+', filename)
+            # translated bands are packaged when they were read remotely
+            m = re.match(r'(?:translated_)?(.*)_B.+\..+', filename)
             product_id = m.groups()[0]
 
             # ONLY HANDLE 1 PRODUCT AT A TIME
@@ -441,6 +914,10 @@ class Landsat8MTLReaderOperator(BaseOperator):
         if mtl_path is None:
             log.info("Nothing to process.")
             return
+        # the MTL path is one of the entries of Landsat8SceneDownloadOperator
+        metadata_key = self.get_inputs_from.get("metadata_key")
+        if metadata_key is not None:
+            mtl_path = mtl_path[metadata_key]
         # Uploaded granules paths from XCom
         upload_granules_task_ids = self.get_inputs_from["upload_task_ids"]
         granule_paths=[]
@@ -549,18 +1026,31 @@ class Landsat8ThumbnailOperator(BaseOperator):
             thumb_size_x (str): x dimension for the thumbnail size
             thumb_size_y (str): y dimension for the thumbnail size
             get_inputs_from (str): task_id used to fetch downloaded file from XCom
+            get_inputs_key (str): key of the downloaded file when the XCom
+                value is a dict (e.g. "thumbnail")
+            thumbnail_engine (bool): create the thumbnail with the GDAL
+                thumbnail engine (see thumbnails.py) instead of pgmagick
+            extra_sizes (list): (x, y) of additional thumbnails written by
+                the thumbnail engine in the same decode, as
+                thumbnail_<x>x<y>.jpeg
 
         Returns:
-            output_path (str): path of the created thumbnail
+            output_path (str): path of the created thumbnail. With the
+            thumbnail engine, the paths of all the thumbnails are pushed to
+            XCom under the "thumbnails" key
     """
 
     @apply_defaults
     def __init__(self, get_inputs_from, thumb_size_x, thumb_size_y,
-                 *args, **kwargs):
+                 get_inputs_key=None, thumbnail_engine=False,
+                 extra_sizes=None, *args, **kwargs):
         super(Landsat8ThumbnailOperator, self).__init__(*args, **kwargs)
         self.get_inputs_from = get_inputs_from
+        self.get_inputs_key = get_inputs_key
         self.thumb_size_x = thumb_size_x
         self.thumb_size_y = thumb_size_y
+        self.thumbnail_engine = thumbnail_engine
+        self.extra_sizes = list(extra_sizes or [])
 
     def execute(self, context):
         downloaded_thumbnail = context["task_instance"].xcom_pull(
@@ -568,7 +1058,21 @@ class Landsat8ThumbnailOperator(BaseOperator):
         if downloaded_thumbnail is None:
             log.info("Nothing to process.")
             return
+        if self.get_inputs_key is not None:
+            downloaded_thumbnail = downloaded_thumbnail[self.get_inputs_key]
         log.info("downloaded_thumbnail: {}".format(downloaded_thumbnail))
+        if self.thumbnail_engine:
+            output_dir = os.path.dirname(downloaded_thumbnail)
+            outputs = [(os.path.join(output_dir, "thumbnail.jpeg"),
+                        (int(self.thumb_size_x), int(self.thumb_size_y)))]
+            for size_x, size_y in self.extra_sizes:
+                outputs.append((os.path.join(
+                    output_dir, "thumbnail_{}x{}.jpeg".format(size_x, size_y)),
+                    (int(size_x), int(size_y))))
+            paths = render_thumbnails(downloaded_thumbnail, outputs,
+                                      square=True)
+            context["task_instance"].xcom_push(key="thumbnails", value=paths)
+            return paths[0]
         img = Image(downloaded_thumbnail)
         least_dim = min(int(img.columns()), int(img.rows()))
         img.crop("{dim}x{dim}".format(dim=least_dim))
@@ -671,6 +1175,149 @@ class Landsat8GranuleJsonFileOperator(BaseOperator):
         return True
 
 
+SceneListSearch = namedtuple("SceneListSearch", [
+    "sql",
+    "types",
+    "params",
+    "limited",
+])
+
+
+def build_scene_list_search(cloud_coverage=None, paths_rows=None,
+                            startdate=None, enddate=None,
+                            order_by="acquisitiondate", order_type="ASC",
+                            limit=None):
+    """Build a parameterized scene list search.
+
+    The statement uses ``$n`` placeholders, so it can be PREPAREd as is, and
+    matches all the (path, row) pairs through two array parameters, so its
+    text only depends on which filters are set and on the ordering.
+
+    Returns:
+        SceneListSearch: statement, parameter types and values, and whether
+        the statement has a LIMIT
+    """
+    if order_by.lower() not in SCENE_LIST_COLUMNS:
+        raise ValueError("Cannot order scene_list by {!r}".format(order_by))
+    if order_type.upper() not in ("ASC", "DESC"):
+        raise ValueError("Invalid ordering type {!r}".format(order_type))
+    types = []
+    params = []
+
+    def parameter(type_, value):
+        types.append(type_)
+        params.append(value)
+        return "${}".format(len(params))
+
+    conditions = []
+    if cloud_coverage:
+        conditions.append("cloudcover < {}".format(
+            parameter("numeric", cloud_coverage)))
+    if paths_rows:
+        conditions.append(
+            '(path, "row") IN (SELECT * FROM unnest({}, {}))'.format(
+                parameter("integer[]", [int(p) for p, _ in paths_rows]),
+                parameter("integer[]", [int(r) for _, r in paths_rows])))
+    if startdate and enddate:
+        conditions.append("acquisitiondate BETWEEN {} AND {}".format(
+            parameter("timestamp", startdate), parameter("timestamp", enddate)))
+    elif startdate:
+        conditions.append("acquisitiondate > {}".format(
+            parameter("timestamp", startdate)))
+    elif enddate:
+        conditions.append("acquisitiondate < {}".format(
+            parameter("timestamp", enddate)))
+
+    sql = "SELECT productid, entityid, download_url FROM scene_list"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY {} {}".format(order_by.lower(), order_type.upper())
+    if limit:
+        sql += " LIMIT {}".format(parameter("bigint", limit))
+    return SceneListSearch(sql=sql, types=types, params=params,
+                           limited=bool(limit))
+
+
+class SearchConnection(psycopg2.extensions.connection):
+    """psycopg2 connection remembering the statements prepared on it."""
+
+    def __init__(self, *args, **kwargs):
+        super(SearchConnection, self).__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+_search_pools = {}
+
+
+def get_search_pool(db_credentials, maxconn=4):
+    """Return the (per worker process) connection pool for ``db_credentials``."""
+    key = tuple(sorted(db_credentials.items()))
+    if key not in _search_pools:
+        _search_pools[key] = psycopg2.pool.ThreadedConnectionPool(
+            1, maxconn,
+            dbname=db_credentials["dbname"],
+            user=db_credentials["username"],
+            password=db_credentials["password"],
+            host=db_credentials["hostname"],
+            port=db_credentials["port"],
+            connection_factory=SearchConnection,
+        )
+    return _search_pools[key]
+
+
+def iter_scene_list_search(db_credentials, search, itersize=1000,
+                           explain=False):
+    """Run a scene list search on a pooled connection, yielding the records.
+
+    Bounded searches run as a prepared statement, which is prepared once
+    per pooled connection. Unbounded searches (no LIMIT) are streamed through
+    a server-side cursor, ``itersize`` records at a time, since a cursor
+    cannot be declared on a prepared statement.
+    """
+    # same statement with psycopg2 placeholders
+    pyformat_sql = re.sub(r"\$\d+", "%s", search.sql)
+    pool = get_search_pool(db_credentials)
+    connection = pool.getconn()
+    try:
+        if explain:
+            with connection.cursor() as cursor:
+                check_scene_list_search_plan(
+                    cursor, pyformat_sql, search.params)
+        if search.limited:
+            name = "landsat8_search_{}".format(
+                hashlib.md5(search.sql).hexdigest()[:12])
+            with connection.cursor() as cursor:
+                if name not in connection.prepared_statements:
+                    cursor.execute("PREPARE {}{} AS {}".format(
+                        name,
+                        " ({})".format(", ".join(search.types))
+                        if search.types else "",
+                        search.sql))
+                    connection.prepared_statements.add(name)
+                cursor.execute("EXECUTE {}{}".format(
+                    name,
+                    " ({})".format(", ".join(["%s"] * len(search.params)))
+                    if search.params else ""), search.params)
+                while True:
+                    records = cursor.fetchmany(itersize)
+                    if not records:
+                        break
+                    for record in records:
+                        yield record
+        else:
+            with connection.cursor(name="landsat8_search") as cursor:
+                cursor.itersize = itersize
+                cursor.execute(pyformat_sql, search.params)
+                for record in cursor:
+                    yield record
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        pool.putconn(connection)
+
+
 class Landsat8SearchOperator(BaseOperator):
     """Landsat8SearchOperator searches for scenes/granules to be downloaded from Landsat8DownloadOperator. It has search criteria (area of interest and cloud coverage). The current implementation is searching for granules in the created DB (from Landsat8_Scene_List DAG)
 
@@ -683,13 +1330,15 @@ class Landsat8SearchOperator(BaseOperator):
             filter_max (int): number to limit search results
             order_by (str): the column to use for ordering the returned results
             order_type (str): descending or ascending ordering
+            explain (bool): check with EXPLAIN that the search query uses the
+                scene_list indexes and log the query plan
 
         Returns:
-            tuple contains:
+            list of tuples containing:
             product_id, entity_id, download_url
     """
     @apply_defaults
-    def __init__(self, area, cloud_coverage, startdate, enddate, filter_max, order_by, order_type, db_credentials, *args, **kwargs):
+    def __init__(self, area, cloud_coverage, startdate, enddate, filter_max, order_by, order_type, db_credentials, explain=False, *args, **kwargs):
         super(Landsat8SearchOperator, self).__init__(*args, **kwargs)
         self.area = area
         self.cloud_coverage = cloud_coverage
@@ -699,70 +1348,25 @@ class Landsat8SearchOperator(BaseOperator):
         self.order_by = order_by
         self.order_type = order_type
         self.db_credentials = dict(db_credentials)
+        self.explain = explain
 
     def execute(self, context):
         if self.area is None or self.db_credentials is None:
             log.info("Either area of interest or credentials received with None.")
             return
-        connection = psycopg2.connect(
-            dbname=self.db_credentials["dbname"],
-            user=self.db_credentials["username"],
-            password=self.db_credentials["password"],
-            host=self.db_credentials["hostname"],
-            port=self.db_credentials["port"],
+        search = build_scene_list_search(
+            cloud_coverage=self.cloud_coverage,
+            paths_rows=self.area.paths_rows,
+            startdate=self.startdate,
+            enddate=self.enddate,
+            order_by=self.order_by,
+            order_type=self.order_type,
+            limit=self.filter_max,
         )
-        cursor = connection.cursor()
-        data = (self.cloud_coverage, self.area.paths_rows, self.startdate, self.enddate)
-        query = "SELECT productid, entityid, download_url FROM scene_list "
-
-        self.conditions_list = []
-        if self.cloud_coverage or self.area.path or self.area.row or self.startdate or self.enddate:
-            where_stmt = " WHERE "
-            query+=where_stmt
-
-        if self.cloud_coverage:
-            cloud_condition =  " cloudCover < %s "%(self.cloud_coverage)
-            self.conditions_list.append(cloud_condition)
-        else:
-            cloud_condition = ''
-
-        path_row_condition = ''
-        if self.area.paths_rows:
-            for path_row in self.area.paths_rows:
-                path_row_condition +=  " path = %s AND row = %s OR "%(path_row[0],path_row[1])
-            self.conditions_list.append(path_row_condition.strip(" OR "))
-        else:
-            path_row_condition = ''
-
-        if self.startdate and self.enddate:
-            startenddate_condition =  " acquisitiondate BETWEEN '%s' AND '%s' "%(self.startdate,self.enddate)
-            self.conditions_list.append(startenddate_condition)
-        else:
-            startenddate_condition = ''
-
-        if self.startdate and not self.enddate:
-            startdate_condition =  " acquisitiondate > '%s' "%(self.startdate)
-            self.conditions_list.append(startdate_condition)
-        else:
-            startdate_condition = ''
-
-        if self.enddate and not self.startdate:
-            enddate_condition =  " acquisitiondate < '%s' "%(self.enddate)
-            self.conditions_list.append(enddate_condition)
-        else:
-            enddate_condition = ''
-
-        conditions = ''
-        for condition in self.conditions_list:
-            conditions+= condition + " AND "
-
-        query +=conditions.strip(" AND ")
-
-        #kindly note that table name and sql keywords cannot be parametrized (e.g: using %s) so we had to use .format to order by
-        query += " ORDER BY {} {} LIMIT {} ".format(self.order_by, self.order_type, self.filter_max)
-        cursor.execute(query)
-        search_results = cursor.fetchall()
-        if search_results is None:
+        log.info("Search query: {} {}".format(search.sql, search.params))
+        search_results = list(iter_scene_list_search(
+            self.db_credentials, search, explain=self.explain))
+        if not search_results:
             log.error("Could not find any product for the {} area".format(self.area))
             return
         else:
@@ -784,13 +1388,16 @@ class Landsat8DownloadOperator(BaseOperator):
             geoserver_username (str): account info to connect to Geoserver
             geoserver_password (str): account info to connect to Geoserver
             geoserver_rest_url (str): REST url of the geoserver
+            published_cache_dir (str): directory where the ids of the already
+                published products are cached
+            published_cache_ttl (timedelta): lifetime of the cached ids
 
         Returns:
             target_path (str) : path to the downloaded Landsat-8 product/scene 
     """
 
     @apply_defaults
-    def __init__(self, download_dir, get_inputs_from, url_fragment, download_max = None, geoserver_username = None, geoserver_password = None, geoserver_rest_url = None, geoserver_oseo_collection = None, download_timeout=timedelta(hours=1), *args, **kwargs):
+    def __init__(self, download_dir, get_inputs_from, url_fragment, download_max = None, geoserver_username = None, geoserver_password = None, geoserver_rest_url = None, geoserver_oseo_collection = None, published_cache_dir = None, published_cache_ttl = timedelta(minutes=10), download_timeout=timedelta(hours=1), *args, **kwargs):
         super(Landsat8DownloadOperator, self).__init__(
             execution_timeout=download_timeout, *args, **kwargs)
         self.download_dir = download_dir
@@ -801,6 +1408,8 @@ class Landsat8DownloadOperator(BaseOperator):
         self.geoserver_password = geoserver_password
         self.geoserver_rest_url = geoserver_rest_url
         self.geoserver_oseo_collection = geoserver_oseo_collection
+        self.published_cache_dir = published_cache_dir
+        self.published_cache_ttl = published_cache_ttl
 
     def execute(self, context):
         task_inputs = context["task_instance"].xcom_pull(self.get_inputs_from)
@@ -808,10 +1417,18 @@ class Landsat8DownloadOperator(BaseOperator):
         if task_inputs is None or len(task_inputs) == 0:
             log.info("Nothing to process.")
             return
+        published_products = PublishedProductsIndex(
+            self.geoserver_username,
+            self.geoserver_password,
+            self.geoserver_rest_url,
+            self.geoserver_oseo_collection,
+            cache_dir=self.published_cache_dir,
+            ttl=self.published_cache_ttl
+        )
         for scene in task_inputs:
             product_id, entity_id, download_url = scene
             log.info("Downloading Product: {}".format(product_id))
-            product_published = is_product_published(self.geoserver_username, self.geoserver_password, self.geoserver_rest_url, collection_id = self.geoserver_oseo_collection, product_id=product_id)
+            product_published = published_products.is_published(product_id)
             # in case the product was already published 
             if product_published:
                log.info("Product {} already published. download operator will skip it".format(product_id))
@@ -831,7 +1448,8 @@ class Landsat8DownloadOperator(BaseOperator):
                    "{}_{}".format(product_id, self.url_fragment)
                 )
                 try:
-                    urllib.urlretrieve(url, target_path)
+                    # keep partial files so that retries resume them
+                    transfer.download(url, target_path, resume=True)
                     downloaded_products.append(target_path)
                 except Exception:
                     log.exception(
@@ -842,6 +1460,124 @@ class Landsat8DownloadOperator(BaseOperator):
             else:
                 return
 
+
+class Landsat8SceneDownloadOperator(BaseOperator):
+    """Landsat8SceneDownloadOperator downloads the bands, the MTL file and the
+    thumbnail of the first unpublished scene found by Landsat8SearchOperator.
+    The files are fetched concurrently by a bounded pool of threads sharing
+    one keep-alive session, in place of one Landsat8DownloadOperator task per
+    file.
+
+        Args:
+            download_dir (str): path to the download directory
+            get_inputs_from (str): task_id to pull the xcom value from search task
+            bands (list): numbers of the bands to download
+            max_workers (int): maximum number of concurrent downloads
+            remote_bands (bool): do not download the bands but return their
+                /vsicurl/ urls, so that GDAL reads them with range requests
+            geoserver_username (str): account info to connect to Geoserver
+            geoserver_password (str): account info to connect to Geoserver
+            geoserver_rest_url (str): REST url of the geoserver
+            published_cache_dir (str): directory where the ids of the already
+                published products are cached
+            published_cache_ttl (timedelta): lifetime of the cached ids
+
+        Returns:
+            dict: paths of the downloaded files keyed by "B<n>" for the bands,
+            "MTL" and "thumbnail"
+    """
+
+    @apply_defaults
+    def __init__(self, download_dir, get_inputs_from, bands, max_workers=4, remote_bands=False, geoserver_username = None, geoserver_password = None, geoserver_rest_url = None, geoserver_oseo_collection = None, published_cache_dir = None, published_cache_ttl = timedelta(minutes=10), download_timeout=timedelta(hours=1), *args, **kwargs):
+        super(Landsat8SceneDownloadOperator, self).__init__(
+            execution_timeout=download_timeout, *args, **kwargs)
+        self.download_dir = download_dir
+        self.get_inputs_from = get_inputs_from
+        self.bands = list(bands)
+        self.max_workers = int(max_workers)
+        self.remote_bands = remote_bands
+        self.geoserver_username = geoserver_username
+        self.geoserver_password = geoserver_password
+        self.geoserver_rest_url = geoserver_rest_url
+        self.geoserver_oseo_collection = geoserver_oseo_collection
+        self.published_cache_dir = published_cache_dir
+        self.published_cache_ttl = published_cache_ttl
+
+    def execute(self, context):
+        task_inputs = context["task_instance"].xcom_pull(self.get_inputs_from)
+        if task_inputs is None or len(task_inputs) == 0:
+            log.info("Nothing to process.")
+            return
+        published_products = PublishedProductsIndex(
+            self.geoserver_username,
+            self.geoserver_password,
+            self.geoserver_rest_url,
+            self.geoserver_oseo_collection,
+            cache_dir=self.published_cache_dir,
+            ttl=self.published_cache_ttl
+        )
+        for product_id, entity_id, download_url in task_inputs:
+            if published_products.is_published(product_id):
+                log.info("Product {} already published. download operator will skip it".format(product_id))
+                continue
+            return self._download_scene(product_id, entity_id, download_url)
+        log.info("All the scenes found are already published.")
+
+    def _download_scene(self, product_id, entity_id, download_url):
+        log.info("Downloading Product: {}".format(product_id))
+        target_dir = os.path.join(self.download_dir, entity_id)
+        try:
+            os.makedirs(target_dir)
+        except OSError as exc:
+            if exc.errno == 17:  # directory already exists
+                pass
+            else:
+                raise
+        band_fragments = [
+            ("B{}".format(band), "B{}.TIF".format(band)) for band in self.bands
+        ]
+        url_fragments = [("MTL", "MTL.txt"), ("thumbnail", "thumb_small.jpg")]
+        remote_paths = {}
+        if self.remote_bands:
+            for key, url_fragment in band_fragments:
+                remote_paths[key] = "/vsicurl/" + download_url.replace(
+                    "index.html", "{}_{}".format(product_id, url_fragment))
+        else:
+            url_fragments = band_fragments + url_fragments
+        session = transfer.get_session(
+            pool_size=max(self.max_workers, transfer.POOL_SIZE))
+
+        def download(item):
+            key, url_fragment = item
+            filename = "{}_{}".format(product_id, url_fragment)
+            # keep partial files so that retries resume them
+            stats = transfer.download(
+                download_url.replace("index.html", filename),
+                os.path.join(target_dir, filename),
+                session=session,
+                resume=True
+            )
+            return key, stats
+
+        started = time.time()
+        pool = ThreadPool(min(self.max_workers, len(url_fragments)))
+        try:
+            results = pool.map(download, url_fragments)
+        except Exception:
+            log.exception(msg="Error downloading {}".format(product_id))
+            raise
+        finally:
+            pool.terminate()
+            pool.join()
+        elapsed = time.time() - started
+        total_bytes = sum(stats.bytes for key, stats in results)
+        log.info("Downloaded {} files ({} bytes) of {} in {:.1f}s".format(
+            len(results), total_bytes, product_id, elapsed))
+        downloaded = dict((key, stats.path) for key, stats in results)
+        downloaded.update(remote_paths)
+        return downloaded
+
+
 class LANDSAT8METADATAPlugin(AirflowPlugin):
     name = "landsat8_metadata_plugin"
     operators = [
@@ -851,6 +1587,7 @@ class LANDSAT8METADATAPlugin(AirflowPlugin):
         Landsat8ProductZipFileOperator,
         Landsat8SearchOperator,
         Landsat8DownloadOperator,
+        Landsat8SceneDownloadOperator,
         DownloadSceneList,
         ExtractSceneList,
         UpdateSceneList
@@ -0,0 +1,530 @@
+"""
+/*********************************************************************************/
+ *  The MIT License (MIT)                                                         *
+ *                                                                                *
+ *  Copyright (c) 2014 EOX IT Services GmbH                                       *
+ *                                                                                *
+ *  Permission is hereby granted, free of charge, to any person obtaining a copy  *
+ *  of this software and associated documentation files (the "Software"), to deal *
+ *  in the Software without restriction, including without limitation the rights  *
+ *  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell     *
+ *  copies of the Software, and to permit persons to whom the Software is         *
+ *  furnished to do so, subject to the following conditions:                      *
+ *                                                                                *
+ *  The above copyright notice and this permission notice shall be included in    *
+ *  all copies or substantial portions of the Software.                           *
+ *                                                                                *
+ *  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR    *
+ *  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,      *
+ *  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE   *
+ *  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER        *
+ *  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, *
+ *  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE *
+ *  SOFTWARE.                                                                     *
+ *                                                                                *
+ *********************************************************************************/
+"""
+
+from contextlib import contextmanager
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+log = logging.getLogger(__name__)
+
+VSIZIP_PREFIX = "/vsizip/"
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+CHUNK_SIZE = 1024 * 1024
+
+# local file header: signature, versions, flags, compression, time, date,
+# crc, sizes, then the lengths of the file name and of the extra field
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def split_vsizip_path(path):
+    """Split a /vsizip/ path into the path of the zip file and the name of
+    the member.
+
+    Returns:
+        tuple: (zip path, member name), None if ``path`` is not in a zip
+    """
+    if not path.startswith(VSIZIP_PREFIX):
+        return None
+    zip_path, separator, member = path[len(VSIZIP_PREFIX):].partition(".zip/")
+    if not separator:
+        return None
+    return zip_path + ".zip", member
+
+
+class SafeArchiveIndex(object):
+    """Index of the members of a zip archive (e.g. a SAFE product): name,
+    offset of the data, sizes, compression and CRC of each member.
+
+    Listing and reading the members of a zip with ``zipfile`` parses its
+    central directory every time the archive is opened. The index is built
+    once and saved in a sidecar JSON file, ``<zip>.index.json`` by default,
+    which is used as long as the size and modification time of the zip do
+    not change. Members are then looked up in a dict and read straight from
+    their offset.
+
+    Args:
+        zip_path (str): path of the archive
+        index_path (str): path of the sidecar file
+    """
+
+    def __init__(self, zip_path, index_path=None):
+        self.zip_path = zip_path
+        self.index_path = index_path or zip_path + INDEX_SUFFIX
+        self.members = None
+        self.names = None
+        self.load()
+
+    def _signature(self):
+        stat = os.stat(self.zip_path)
+        return [stat.st_size, stat.st_mtime]
+
+    def load(self):
+        signature = self._signature()
+        try:
+            with open(self.index_path) as fh:
+                index = json.load(fh)
+            if (index.get("version") != INDEX_VERSION or
+                    index.get("signature") != signature):
+                index = None
+        except (IOError, ValueError):
+            index = None
+        if index is None:
+            index = self._build(signature)
+            self._save(index)
+        self.names = index["names"]
+        self.members = index["members"]
+
+    def _build(self, signature):
+        log.info("Indexing {}".format(self.zip_path))
+        members = {}
+        names = []
+        with ZipFile(self.zip_path) as archive, \
+                open(self.zip_path, "rb") as fh:
+            for info in archive.infolist():
+                fh.seek(info.header_offset)
+                header = _LOCAL_HEADER.unpack(fh.read(_LOCAL_HEADER.size))
+                if header[0] != _LOCAL_HEADER_SIGNATURE:
+                    raise IOError("Bad local header for {} in {}".format(
+                        info.filename, self.zip_path))
+                name_length, extra_length = header[-2:]
+                names.append(info.filename)
+                members[info.filename] = {
+                    "offset": (info.header_offset + _LOCAL_HEADER.size +
+                               name_length + extra_length),
+                    "compress_size": info.compress_size,
+                    "file_size": info.file_size,
+                    "compress_type": info.compress_type,
+                    "crc": info.CRC,
+                }
+        return {
+            "version": INDEX_VERSION,
+            "signature": signature,
+            "names": names,
+            "members": members,
+        }
+
+    def _save(self, index):
+        tmp_path = "{}.{}.tmp".format(self.index_path, os.getpid())
+        try:
+            with open(tmp_path, "w") as fh:
+                json.dump(index, fh)
+            os.rename(tmp_path, self.index_path)
+        except (IOError, OSError) as exc:
+            log.warning("Cannot save the index of {} to {}: {}".format(
+                self.zip_path, self.index_path, exc))
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def find(self, suffix):
+        """Name of the first member ending with ``suffix``, None if there is
+        none."""
+        for name in self.names:
+            if name.endswith(suffix):
+                return name
+        return None
+
+    def find_all(self, suffix):
+        return [name for name in self.names if name.endswith(suffix)]
+
+    def vsizip_path(self, name):
+        return VSIZIP_PREFIX + self.zip_path.rstrip("/") + "/" + name
+
+    def iter_member(self, name, chunk_size=CHUNK_SIZE):
+        """Iterate over the uncompressed content of member ``name``, read
+        from its offset in the archive."""
+        member = self.members[name]
+        if member["compress_type"] not in (ZIP_STORED, ZIP_DEFLATED):
+            # not worth handling here, let zipfile do it
+            with ZipFile(self.zip_path) as archive:
+                with archive.open(name) as source:
+                    for chunk in iter(lambda: source.read(chunk_size), b""):
+                        yield chunk
+            return
+        decompressor = None
+        if member["compress_type"] == ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        crc = 0
+        remaining = member["compress_size"]
+        with open(self.zip_path, "rb") as fh:
+            fh.seek(member["offset"])
+            while remaining > 0:
+                chunk = fh.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise IOError("Truncated member {} in {}".format(
+                        name, self.zip_path))
+                remaining -= len(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                    if remaining == 0:
+                        chunk += decompressor.flush()
+                crc = zlib.crc32(chunk, crc)
+                yield chunk
+        if crc & 0xffffffff != member["crc"]:
+            raise IOError("Bad CRC for member {} in {}".format(
+                name, self.zip_path))
+
+    def read(self, name):
+        """Return the content of member ``name``."""
+        return b"".join(self.iter_member(name))
+
+    def extract_to(self, name, path):
+        """Write the content of member ``name`` to ``path``."""
+        with open(path, "wb") as fh:
+            for chunk in self.iter_member(name):
+                fh.write(chunk)
+        return path
+
+    def extract(self, name, out_dir=None):
+        """Extract member ``name`` under ``out_dir`` (the current directory
+        by default), keeping its path in the archive, as
+        ``ZipFile.extract`` does."""
+        path = os.path.join(out_dir or os.getcwd(), *name.split("/"))
+        parent_dir = os.path.dirname(path)
+        if not os.path.isdir(parent_dir):
+            os.makedirs(parent_dir)
+        return self.extract_to(name, path)
+
+
+def get_archive_index(zip_path):
+    """Return the SafeArchiveIndex of ``zip_path``, kept in memory for the
+    lifetime of the process while the archive does not change."""
+    stat = os.stat(zip_path)
+    key = os.path.abspath(zip_path)
+    with _indexes_lock:
+        cached = _indexes.get(key)
+        if cached is not None and cached[0] == (stat.st_size, stat.st_mtime):
+            return cached[1]
+        index = SafeArchiveIndex(zip_path)
+        _indexes[key] = ((stat.st_size, stat.st_mtime), index)
+    return index
+
+
+class ExtractionCache(object):
+    """Local copies of zip members, shared by all the tasks running on the
+    worker.
+
+    Reading a raster through /vsizip/ decompresses the deflated member again
+    on every seek, which makes random access (e.g. gdalwarp) very slow. The
+    members are instead extracted once to ``cache_dir``, ideally a fast
+    scratch disk, under a key made of the zip path, the member name and the
+    modification time of the zip, so that a replaced archive is extracted
+    again. Once the cache grows beyond ``max_bytes`` the least recently used
+    members are removed.
+
+    The task extracting a member is usually not the one reading it: an
+    ``owner`` (e.g. the DAG run) can pin the member, which is then not
+    evicted until the owner releases it, or until the pin is older than
+    ``pin_ttl`` seconds so that a failed run does not hold it forever. The
+    archive and member of each entry are also recorded apart from it, so
+    that a consumer finding an entry evicted anyway (e.g. the retry of a
+    failed task, which released its pins) extracts it again (see
+    get_extracted_path). The record of an evicted entry is kept ``pin_ttl``
+    seconds.
+
+    Each entry is extracted under its own file lock; the cache wide lock is
+    only taken to evict entries.
+
+    Args:
+        cache_dir (str): directory of the extracted members
+        max_bytes (int): size of the cache, None for no limit
+        pin_ttl (int): seconds after which a pin is ignored
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, pin_ttl=2 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pin_ttl = pin_ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes_extracted = 0
+        self.lock_path = os.path.join(cache_dir, ".lock")
+
+    def _key(self, zip_path, member):
+        key = "{}\n{}\n{}".format(
+            os.path.abspath(zip_path), member, os.path.getmtime(zip_path))
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+    def _metadata_path(self, kind, key):
+        return os.path.join(self.cache_dir, "." + kind, key)
+
+    def get(self, zip_path, member, owner=None):
+        """Return the path of the extracted ``member`` of ``zip_path``,
+        extracting it if it is not cached, and pin it for ``owner`` if any.
+        The file keeps the name of the member."""
+        key = self._key(zip_path, member)
+        entry_dir = os.path.join(self.cache_dir, key)
+        path = os.path.join(entry_dir, os.path.basename(member))
+        for kind in ("locks", "pins", "sources"):
+            _makedirs(os.path.join(self.cache_dir, "." + kind))
+        with self._entry_lock(key):
+            if os.path.exists(path):
+                self.hits += 1
+                os.utime(entry_dir, None)  # most recently used
+            else:
+                self.misses += 1
+                self._extract(zip_path, member, entry_dir, path)
+                with open(self._metadata_path("sources", key), "w") as f:
+                    json.dump({"zip_path": os.path.abspath(zip_path),
+                               "member": member}, f)
+            if owner is not None:
+                self._pin(key, owner)
+        self._evict(keep=entry_dir)
+        return path
+
+    def get_path(self, path, owner=None):
+        """Return a local path for ``path``: the extracted member for a
+        /vsizip/ path or for an entry of this cache, which is extracted again
+        if it was evicted, ``path`` itself otherwise."""
+        split = split_vsizip_path(path)
+        if split is None:
+            split = self._source(path)
+            if split is None or os.path.exists(path) and owner is None:
+                return path
+            if not os.path.exists(path):
+                log.warning("{} was evicted from the extraction cache, "
+                            "extracting it again".format(path))
+        return self.get(*split, owner=owner)
+
+    def release(self, path, owner):
+        """Remove the pin of ``owner`` on the entry of ``path``."""
+        key = os.path.basename(os.path.dirname(path))
+        pin_path = os.path.join(self._metadata_path("pins", key), owner)
+        if os.path.exists(pin_path):
+            os.remove(pin_path)
+
+    @contextmanager
+    def _entry_lock(self, key, blocking=True):
+        lock_path = self._metadata_path("locks", key)
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            lock = open(lock_path, "a")
+            try:
+                fcntl.flock(lock, flags)
+            except IOError:
+                lock.close()
+                raise
+            # the lock file of an evicted entry is removed: lock the one
+            # created since by another task instead
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    break
+            except OSError as exc:
+                if exc.errno != errno.ENOENT:
+                    raise
+            lock.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    def _source(self, path):
+        entry_dir = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(entry_dir) != os.path.abspath(self.cache_dir):
+            return None
+        source_path = self._metadata_path(
+            "sources", os.path.basename(entry_dir))
+        if not os.path.exists(source_path):
+            return None
+        with open(source_path) as f:
+            source = json.load(f)
+        return source["zip_path"], source["member"]
+
+    def _pin(self, key, owner):
+        pins_dir = self._metadata_path("pins", key)
+        _makedirs(pins_dir)
+        with open(os.path.join(pins_dir, owner), "w"):
+            pass  # the modification time dates the pin
+
+    def _is_pinned(self, key):
+        pins_dir = self._metadata_path("pins", key)
+        if not os.path.isdir(pins_dir):
+            return False
+        pinned = False
+        for owner in os.listdir(pins_dir):
+            pin_path = os.path.join(pins_dir, owner)
+            if time.time() - os.path.getmtime(pin_path) > self.pin_ttl:
+                log.warning("Ignoring the pin of {} on {}, older than {}s"
+                            .format(owner, key, self.pin_ttl))
+                os.remove(pin_path)
+            else:
+                pinned = True
+        return pinned
+
+    def _extract(self, zip_path, member, entry_dir, path):
+        if os.path.exists(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+        tmp_path = path + ".tmp"
+        index = get_archive_index(zip_path)
+        size = index.members[member]["file_size"]
+        index.extract_to(member, tmp_path)
+        os.rename(tmp_path, path)
+        self.bytes_extracted += size
+        log.info("Extracted {} ({} bytes) of {} to {}".format(
+            member, size, zip_path, path))
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, filename))
+                       for filename in os.listdir(entry_dir))
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        return entries
+
+    def _evict(self, keep=None):
+        if self.max_bytes is None:
+            return
+        with open(self.lock_path, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._evict_locked(keep)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _evict_locked(self, keep):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in entries:
+            if total <= self.max_bytes:
+                break
+            key = os.path.basename(entry_dir)
+            if entry_dir == keep:
+                continue
+            try:
+                with self._entry_lock(key, blocking=False):
+                    if self._is_pinned(key):
+                        continue
+                    log.info("Evicting {} ({} bytes) from the extraction "
+                             "cache".format(entry_dir, size))
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    self._remove_metadata(key)
+                    total -= size
+            except IOError as exc:
+                if exc.errno not in (errno.EACCES, errno.EAGAIN):
+                    raise
+                continue  # being extracted
+        self._remove_stale_sources()
+
+    def _remove_metadata(self, key):
+        # the source record dates the eviction, it is kept pin_ttl seconds
+        # for the consumers extracting the entry again
+        source_path = self._metadata_path("sources", key)
+        if os.path.exists(source_path):
+            os.utime(source_path, None)
+        pins_dir = self._metadata_path("pins", key)
+        if os.path.isdir(pins_dir):
+            shutil.rmtree(pins_dir, ignore_errors=True)
+        os.remove(self._metadata_path("locks", key))
+
+    def _remove_stale_sources(self):
+        sources_dir = os.path.join(self.cache_dir, ".sources")
+        if not os.path.isdir(sources_dir):
+            return
+        for key in os.listdir(sources_dir):
+            source_path = os.path.join(sources_dir, key)
+            if os.path.isdir(os.path.join(self.cache_dir, key)):
+                continue
+            if time.time() - os.path.getmtime(source_path) > self.pin_ttl:
+                os.remove(source_path)
+
+    def stats(self):
+        """Hits, misses and bytes extracted by this instance, and the size of
+        the cache."""
+        lookups = self.hits + self.misses
+        entries = self._entries() if os.path.isdir(self.cache_dir) else []
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else None,
+            "bytes_extracted": self.bytes_extracted,
+            "cached_members": len(entries),
+            "cached_bytes": sum(size for _, size, _ in entries),
+        }
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+
+
+def _get_cache(path):
+    """The ExtractionCache holding ``path``, None if it is not an entry of
+    one."""
+    cache = ExtractionCache(os.path.dirname(os.path.dirname(
+        os.path.abspath(path))))
+    if cache._source(path) is None:
+        return None
+    return cache
+
+
+def get_extracted_path(path, owner=None):
+    """Return ``path``, extracting it again if it is an entry of an
+    ExtractionCache that was evicted (the new path may differ if the archive
+    was replaced). To be called by the tasks reading the paths returned by
+    ExtractionCache.get, before opening them."""
+    cache = _get_cache(path)
+    if cache is None:
+        return path
+    return cache.get_path(path, owner)
+
+
+def release_extracted_path(path, owner):
+    """Remove the pin of ``owner`` on ``path`` if it is an entry of an
+    ExtractionCache, once done reading it."""
+    cache = _get_cache(path)
+    if cache is not None:
+        cache.release(path, owner)
+
+
+def get_pin_owner(context):
+    """Pin owner of the extracted files read by the tasks of the DAG run of
+    the Airflow task ``context``."""
+    owner = "{}.{}".format(context["dag"].dag_id, context["run_id"])
+    return owner.replace(os.sep, "_")
@@ -29,13 +29,25 @@ import os
 import logging
 
 from airflow.operators import BaseOperator
-from airflow.operators import PythonOperator
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
 from airflow.models import XCOM_RETURN_KEY
 import config.xcom_keys as xk
 #from config import xcom_keys as xk
 from geoserver_plugin import create_owslinks_dict
+from gdal_plugin import (
+    gdal_config,
+    get_runtime_config,
+    get_runtime_creation_options,
+    get_runtime_warp_kwargs,
+    warp_file,
+)
+from safe_archive import (
+    get_extracted_path,
+    get_pin_owner,
+    release_extracted_path,
+)
+from thumbnails import render_thumbnails, render_thumbnails_from_bytes
 
 try:
     from osgeo import gdal
@@ -50,10 +62,13 @@ import os
 import logging
 import pprint
 import json
+import time
+import copy
+import xml.etree.ElementTree as ET
 from shutil import copyfile
 from zipfile import ZipFile
 from S1Reader import S1GDALReader
-from utils import TemplatesResolver
+from utils import TemplatesResolver, map_products
 
 log = logging.getLogger(__name__)
 
@@ -273,6 +288,101 @@ def collect_granules_metadata(granules_paths, granules_upload_dir, bands_dict):
         }
     return (granules_dict, bbox)
 
+def get_product_granules(product_id, granules_paths):
+    """Return the granules of ``granules_paths`` warped from the measurements
+    of product ``product_id``, which carry its start time in their name."""
+    start_time = product_id.split("_")[4].lower()
+    return [path for path in granules_paths if start_time in os.path.basename(path)]
+
+
+def create_product_files(safe_package_path, product_id, granules_paths, granules_upload_dir, bands_dict, processing_dir, original_package_download_base_url, ows_params, gdal_runtime=None, single_open_reader=False, thumbnail_sizes=None):
+    """Create the metadata files and the product.zip of a S1 product, see
+    S1MetadataOperator for the arguments.
+
+    Returns:
+        str: path of the product.zip
+    """
+    safe_package_filename = os.path.basename(safe_package_path)
+    originalPackageLocation = original_package_download_base_url + safe_package_filename
+    processing_dir = os.path.join(processing_dir, product_id)
+    if not os.path.exists(processing_dir):
+        os.makedirs(processing_dir)
+
+    log.info('safe_package_path: {}'.format(safe_package_path))
+    log.info('granules_paths: {}'.format(granules_paths))
+
+    with gdal_config(**get_runtime_config(gdal_runtime)):
+        granules_dict, bbox = collect_granules_metadata(granules_paths, granules_upload_dir, bands_dict)
+        s1reader = S1GDALReader(safe_package_path, single_open=single_open_reader)
+        product_metadata = s1reader.get_metadata()
+        product_metadata['footprint'] = s1reader.get_footprint()
+    log.info(pprint.pformat(product_metadata, indent=4))
+
+    timeStart = product_metadata['ACQUISITION_START_TIME']
+    timeEnd = product_metadata['ACQUISITION_STOP_TIME']
+
+    owslinks_dict = create_owslinks_dict(
+        product_identifier=product_id,
+        timestart= timeStart,
+        timeend = timeEnd,
+        granule_bbox=bbox,
+        **ows_params
+    )
+
+    # create thumbnail
+    # TODO: create proper thumbnail from quicklook. Also remove temp file
+    log.info("Creating thumbnail")
+    thumbnail_path = os.path.join(processing_dir, "thumbnail.png")
+    if single_open_reader:
+        quicklook = s1reader.get_quicklook_data()
+    else:
+        quicklook = s1reader.get_quicklook()
+        log.info(pprint.pformat(quicklook))
+    if quicklook is None:
+        raise RuntimeError("No preview/quick-look.png in {} to create the thumbnail from".format(safe_package_path))
+    if thumbnail_sizes:
+        outputs = [(thumbnail_path, tuple(thumbnail_sizes[0]))]
+        for size_x, size_y in thumbnail_sizes[1:]:
+            outputs.append((os.path.join(processing_dir, "thumbnail_{}x{}.png".format(size_x, size_y)), (size_x, size_y)))
+        if single_open_reader:
+            render_thumbnails_from_bytes(quicklook, outputs)
+        else:
+            render_thumbnails(quicklook, outputs)
+    elif single_open_reader:
+        with open(thumbnail_path, "wb") as thumbnail_file:
+            thumbnail_file.write(quicklook)
+    else:
+        copyfile(quicklook, thumbnail_path)
+
+    search_params_dict = create_search_dict(product_metadata, originalPackageLocation)
+    log.info(pprint.pformat(search_params_dict))
+
+    metadata_dict = create_metadata_dict(product_metadata)
+    log.info(pprint.pformat(metadata_dict))
+
+    description_dict = create_description_dict(product_metadata, originalPackageLocation)
+    log.info(pprint.pformat(description_dict))
+
+    # create description.html and dump it to file
+    log.info("Creating description.html")
+    html_description = create_product_description(description_dict)
+    search_params_dict['htmlDescription'] = html_description
+
+    # create metadata XML
+    log.info("Creating metadata.xml")
+    metadata_xml = create_product_metadata(metadata_dict)
+
+    return create_procuct_zip(
+        processing_dir=processing_dir,
+        search_params_dict=search_params_dict,
+        description_html=html_description,
+        metadata_xml=metadata_xml,
+        granules_dict=granules_dict,
+        owslinks_dict=owslinks_dict,
+        thumbnail_path=thumbnail_path
+    )
+
+
 class S1MetadataOperator(BaseOperator):
     """ S1MetadataOperator is an abstract level for generating the S1 metadata files and adding it to product.zip later on. It calls another python_callable create_procuct_zip which calls S1 utils to generate meta-data files one by one
 
@@ -281,9 +391,15 @@ class S1MetadataOperator(BaseOperator):
         granules_upload_dir (str): path to the upload directory
         processing_dir (str): path to the processing directory
         get_inputs_from (str): task_ids used to fetch input files from XCom 
+        gdal_runtime (dict): GDAL runtime profile applied while reading the
+            granules and the SAFE package, see config/settings.py
+        single_open_reader (bool): read the manifest, annotation and quicklook of the SAFE package from memory, opening the zip once, instead of going through GDAL and temporary files
+        thumbnail_sizes (list): (x, y) sizes of the thumbnails rendered from the quicklook with the thumbnail engine (see thumbnails.py). The first one is written as thumbnail.png, the others as thumbnail_<x>x<y>.png. When None the quicklook is copied as thumbnail.png
+        max_workers (int): number of products processed concurrently, each in its own process
+        continue_on_error (bool): log the products failing and go on with the others instead of failing the task
 
     Returns:
-        list: list of output product.zip paths
+        list: list of output product.zip paths, in the order of the downloaded products
     """
 
     @apply_defaults
@@ -308,6 +424,11 @@ class S1MetadataOperator(BaseOperator):
                  gs_wcs_format,
                  gs_wcs_version,
                  get_inputs_from=None,
+                 gdal_runtime=None,
+                 single_open_reader=False,
+                 thumbnail_sizes=None,
+                 max_workers=1,
+                 continue_on_error=False,
                  *args, **kwargs):
         self.granules_paths = granules_paths
         self.granules_upload_dir = granules_upload_dir
@@ -330,6 +451,11 @@ class S1MetadataOperator(BaseOperator):
         self.original_package_download_base_url = original_package_download_base_url
 
         self.get_inputs_from = get_inputs_from
+        self.gdal_runtime = gdal_runtime
+        self.single_open_reader = single_open_reader
+        self.thumbnail_sizes = thumbnail_sizes
+        self.max_workers = max_workers
+        self.continue_on_error = continue_on_error
 
         super(S1MetadataOperator, self).__init__(*args, **kwargs)
 
@@ -353,7 +479,6 @@ class S1MetadataOperator(BaseOperator):
                 local_granules_paths +=  local_granules_path
         uploaded_granules_paths = context['task_instance'].xcom_pull(task_ids=upload_task_ids, key=XCOM_RETURN_KEY)
         original_package_path = context['task_instance'].xcom_pull(task_ids=archive_product_task_id, key=XCOM_RETURN_KEY)
-        granules_dict, bbox = collect_granules_metadata(local_granules_paths, self.granules_upload_dir, self.bands_dict)
 
         if not downloaded:
             log.info("No products from Download task, Nothing to do.")
@@ -368,30 +493,8 @@ class S1MetadataOperator(BaseOperator):
             log.info("No original package path from original package upload task, Nothing to do.")
             return list()
 
-        safe_package_path = downloaded.keys()[0]
-        safe_package_filename = os.path.basename(safe_package_path)
-        product_id = downloaded[safe_package_path].get('title')
-        originalPackageLocation = self.original_package_download_base_url + safe_package_filename
-        processing_dir = os.path.join(self.processing_dir, product_id)
-        if not os.path.exists(processing_dir):
-            os.makedirs(processing_dir)
-
-        log.info('safe_package_path: {}'.format(safe_package_path))
-        log.info('local_granules_paths: {}'.format(local_granules_paths))
-
-        s1reader = S1GDALReader(safe_package_path)
-        product_metadata = s1reader.get_metadata()
-        product_metadata['footprint'] = s1reader.get_footprint()
-        log.info(pprint.pformat(product_metadata, indent=4))
-
-        timeStart = product_metadata['ACQUISITION_START_TIME']
-        timeEnd = product_metadata['ACQUISITION_STOP_TIME']
-
-        owslinks_dict = create_owslinks_dict(
-            product_identifier=product_id,
-            timestart= timeStart,
-            timeend = timeEnd,
-            granule_bbox=bbox,
+        products = list(downloaded.keys())
+        ows_params = dict(
             gs_workspace=self.gs_workspace,
             gs_wms_layer=self.gs_wms_layer,
             gs_wms_width=self.gs_wms_width,
@@ -407,55 +510,251 @@ class S1MetadataOperator(BaseOperator):
             gs_wcs_format=self.gs_wcs_format,
             gs_wcs_version=self.gs_wcs_version
         )
+        arguments = []
+        for safe_package_path in products:
+            product_id = downloaded[safe_package_path].get('title')
+            granules_paths = local_granules_paths
+            if len(products) > 1:
+                granules_paths = get_product_granules(product_id, local_granules_paths)
+            arguments.append((safe_package_path, product_id, granules_paths, self.granules_upload_dir, self.bands_dict, self.processing_dir, self.original_package_download_base_url, ows_params, self.gdal_runtime, self.single_open_reader, self.thumbnail_sizes))
+        results = map_products("Sentinel-1 metadata", create_product_files, products, arguments, max_workers=self.max_workers, continue_on_error=self.continue_on_error)
 
-        # create thumbnail
-        # TODO: create proper thumbnail from quicklook. Also remove temp file
-        log.info("Creating thumbnail")
-        thumbnail_path = os.path.join(processing_dir, "thumbnail.png")
-        quicklook_path = s1reader.get_quicklook()
-        log.info(pprint.pformat(quicklook_path))
-        copyfile(quicklook_path, thumbnail_path)
+        zip_paths = list()
+        for out in results:
+            if out:
+                zip_paths.append(out)
+        return zip_paths
 
-        search_params_dict = create_search_dict(product_metadata, originalPackageLocation)
-        log.info(pprint.pformat(search_params_dict))
 
-        metadata_dict = create_metadata_dict(product_metadata)
-        log.info(pprint.pformat(metadata_dict))
+def build_polarizations_vrt(datasets, vrt_path):
+    """Describe the polarizations of a GRD product, which share the same
+    GCPs, as the bands of a single VRT so that they can be warped together.
 
-        description_dict = create_description_dict(product_metadata, originalPackageLocation)
-        log.info(pprint.pformat(description_dict))
-
-        # create description.html and dump it to file
-        log.info("Creating description.html")
-        html_description = create_product_description(description_dict)
-        search_params_dict['htmlDescription'] = html_description
-
-        # create metadata XML
-        log.info("Creating metadata.xml")
-        metadata_xml = create_product_metadata(metadata_dict)
-
-        po = PythonOperator(
-            task_id="s1_metadata_dictionary_creation",
-            python_callable=create_procuct_zip,
-            op_kwargs={
-                'processing_dir': processing_dir,
-                'search_params_dict' : search_params_dict,
-                'description_html': html_description,
-                'metadata_xml': metadata_xml,
-                'granules_dict': granules_dict,
-                'owslinks_dict' : owslinks_dict,
-                'thumbnail_path' : thumbnail_path
-            }
-        )
+    Args:
+        datasets (list): opened polarizations datasets
+        vrt_path (str): VRT file to write
+    """
+    dataset = gdal.Translate(vrt_path, datasets[0], format="VRT")
+    if dataset is None:
+        raise RuntimeError("gdal_translate failed on {}: {}".format(
+            datasets[0].GetDescription(), gdal.GetLastErrorMsg()))
+    dataset = None  # flush to disk
+    tree = ET.parse(vrt_path)
+    root = tree.getroot()
+    first_band = root.find("VRTRasterBand")
+    for number, source in enumerate(datasets[1:], 2):
+        band = copy.deepcopy(first_band)
+        band.set("band", str(number))
+        source_filename = band.find(".//SourceFilename")
+        source_filename.set("relativeToVRT", "0")
+        source_filename.text = source.GetDescription()
+        root.append(band)
+    tree.write(vrt_path)
+    return vrt_path
+
+
+def split_warped_bands(warped, output_paths, tile_size, gdal_runtime=None):
+    """Write each band of the warped VRT ``warped`` to its own tiled GeoTIFF.
+
+    The warped VRT is read one strip of tiles at a time for all the bands at
+    once: each of its blocks is warped a single time for all the bands, and
+    the output files are written as they are streamed.
+    """
+    tile_size = int(tile_size)
+    creation_options = get_runtime_creation_options(gdal_runtime, {
+        "TILED": "YES",
+        "BLOCKXSIZE": tile_size,
+        "BLOCKYSIZE": tile_size,
+    })
+    creation_options = ["{}={}".format(name, value)
+                        for name, value in sorted(creation_options.items())]
+    driver = gdal.GetDriverByName("GTiff")
+    width, height = warped.RasterXSize, warped.RasterYSize
+    data_type = warped.GetRasterBand(1).DataType
+    outputs = []
+    for band, output_path in enumerate(output_paths, 1):
+        output = driver.Create(output_path, width, height, 1, data_type,
+                               creation_options)
+        if output is None:
+            raise RuntimeError("Cannot create {}: {}".format(
+                output_path, gdal.GetLastErrorMsg()))
+        output.SetGeoTransform(warped.GetGeoTransform())
+        output.SetProjection(warped.GetProjection())
+        nodata = warped.GetRasterBand(band).GetNoDataValue()
+        if nodata is not None:
+            output.GetRasterBand(1).SetNoDataValue(nodata)
+        outputs.append(output)
+
+    band_list = list(range(1, len(output_paths) + 1))
+    pixel_size = gdal.GetDataTypeSize(data_type) // 8
+    for y in range(0, height, tile_size):
+        rows = min(tile_size, height - y)
+        data = warped.ReadRaster(0, y, width, rows, band_list=band_list)
+        if data is None:
+            raise RuntimeError("gdalwarp failed on {}: {}".format(
+                warped.GetDescription(), gdal.GetLastErrorMsg()))
+        # ReadRaster returns the bands one after the other
+        band_bytes = width * rows * pixel_size
+        for number, output in enumerate(outputs):
+            output.GetRasterBand(1).WriteRaster(
+                0, y, width, rows,
+                data[number * band_bytes:(number + 1) * band_bytes])
+    for output in outputs:
+        output.FlushCache()
+    outputs = None  # close the files
+    return output_paths
+
+
+def warp_polarizations(band_paths, dstdir, product_id, target_srs, tile_size,
+                       overwrite=False, error_threshold=None,
+                       in_process=False, gdal_runtime=None):
+    """Warp the polarizations of a GRD product in a single warp.
+
+    VV and VH come with the same GCPs: warping them as the bands of one VRT
+    builds the GCP transformer and computes the source coordinates of the
+    output pixels once for both. The warp is streamed straight to one file per
+    polarization, named as the input ones as GDALWarpOperator does, so each
+    pixel is warped, read and written once. This always runs through the GDAL
+    python bindings; ``in_process`` only applies to the polarizations that
+    have to be warped separately, when their sizes differ.
+
+    Returns:
+        tuple: warped files paths, in the order of ``band_paths``, and the
+        warp timing of the product (seconds, bands, seconds_per_band, shared)
+    """
+    start = time.time()
+    output_paths = [os.path.join(dstdir, os.path.basename(band_path))
+                    for band_path in band_paths]
+    config_options = get_runtime_config(gdal_runtime)
+    with gdal_config(**config_options):
+        datasets = [gdal.Open(band_path) for band_path in band_paths]
+    for band_path, dataset in zip(band_paths, datasets):
+        if dataset is None:
+            raise RuntimeError("Cannot open {}: {}".format(
+                band_path, gdal.GetLastErrorMsg()))
+    layouts = set((dataset.RasterXSize, dataset.RasterYSize)
+                  for dataset in datasets)
+    shared = len(band_paths) > 1 and len(layouts) == 1
+
+    if not shared:
+        datasets = None
+        log.info("Warping the polarizations of {} separately".format(
+            product_id))
+        for band_path, output_path in zip(band_paths, output_paths):
+            warp_file(band_path, output_path, target_srs, tile_size,
+                      overwrite=overwrite, in_process=in_process,
+                      gdal_runtime=gdal_runtime,
+                      error_threshold=error_threshold)
+    else:
+        vrt_path = os.path.join(dstdir, product_id + "_polarizations.vrt")
+        try:
+            build_polarizations_vrt(datasets, vrt_path)
+            datasets = None
+            for output_path in output_paths:
+                if os.path.exists(output_path):
+                    if not overwrite:
+                        raise RuntimeError(
+                            "{} already exists".format(output_path))
+                    os.remove(output_path)
+            log.info("Warping {} to {}".format(band_paths, output_paths))
+            with gdal_config(**config_options):
+                warp_kwargs = get_runtime_warp_kwargs(gdal_runtime)
+                if error_threshold is not None:
+                    warp_kwargs["errorThreshold"] = error_threshold
+                warped = gdal.Warp("", vrt_path, format="VRT",
+                                   dstSRS=target_srs, **warp_kwargs)
+                if warped is None:
+                    raise RuntimeError("gdalwarp failed on {}: {}".format(
+                        vrt_path, gdal.GetLastErrorMsg()))
+                split_warped_bands(warped, output_paths, tile_size,
+                                   gdal_runtime)
+                warped = None
+        finally:
+            if os.path.exists(vrt_path):
+                os.remove(vrt_path)
+
+    seconds = time.time() - start
+    timing = {
+        "seconds": seconds,
+        "bands": len(band_paths),
+        "seconds_per_band": seconds / len(band_paths),
+        "shared": shared,
+    }
+    log.info("Warped {} polarizations of {} in {:.1f}s ({:.1f}s per band)"
+             .format(len(band_paths), product_id, seconds,
+                     timing["seconds_per_band"]))
+    return output_paths, timing
 
 
-        out = po.execute(context)
-        zip_paths = list()
-        if out:
-            zip_paths.append(out)
-        return zip_paths
+class S1WarpOperator(BaseOperator):
+    """ Warp the polarizations of each Sentinel-1 GRD product fetched from XCom together, sharing the GCP transformation between them, instead of one GDALWarpOperator per band. Returns output files paths to XCom, and the warp timing of each product under the 'warp_timings' key.
+
+    Args:
+        target_srs (str): parameter for gdalwarp
+        tile_size (str): parameter for gdalwarp
+        overwrite (bool): replace existing output files
+        dstdir (str): output files directory
+        get_inputs_from (str): task_id of the ZipInspector listing the bands of each product
+        error_threshold (float): error threshold, in pixels, of the approximate transformer (gdalwarp -et). Higher values are faster
+        in_process (bool): run the warps of the polarizations which cannot share one through the GDAL python bindings instead of the command line tools. The shared warp always runs in process
+        gdal_runtime (dict): GDAL runtime profile of the collection, see config/settings.py. Its warp_threads set the threads of gdalwarp
+
+    Returns:
+        list: list of output files path, in the order of the bands fetched from XCom
+    """
+
+    @apply_defaults
+    def __init__(self, target_srs, tile_size, overwrite, dstdir,
+                 get_inputs_from, error_threshold=0.125, in_process=False,
+                 gdal_runtime=None, *args, **kwargs):
+        self.target_srs = target_srs
+        self.tile_size = str(tile_size)
+        self.overwrite = overwrite
+        self.dstdir = dstdir
+        self.get_inputs_from = get_inputs_from
+        self.error_threshold = error_threshold
+        self.in_process = in_process
+        self.gdal_runtime = gdal_runtime
+        super(S1WarpOperator, self).__init__(*args, **kwargs)
+
+    def execute(self, context):
+        product_bands_dict = context['task_instance'].xcom_pull(task_ids=self.get_inputs_from, key=XCOM_RETURN_KEY)
+        if not product_bands_dict:
+            log.info("Nothing to process")
+            return None
+        if not os.path.exists(self.dstdir):
+            os.makedirs(self.dstdir)
+
+        output_paths = []
+        timings = {}
+        try:
+            for zip_path in product_bands_dict:
+                band_paths = product_bands_dict[zip_path]
+                if not band_paths:
+                    continue
+                # files of the extraction cache may have been evicted since
+                band_paths = [get_extracted_path(path) for path in band_paths]
+                product_id = os.path.splitext(os.path.basename(zip_path))[0]
+                product_paths, timings[product_id] = warp_polarizations(
+                    band_paths, self.dstdir, product_id,
+                    target_srs=self.target_srs,
+                    tile_size=self.tile_size,
+                    overwrite=self.overwrite,
+                    error_threshold=self.error_threshold,
+                    in_process=self.in_process,
+                    gdal_runtime=self.gdal_runtime
+                )
+                output_paths += product_paths
+        finally:
+            # a retry extracts the bands again if they are evicted meanwhile
+            for band_paths in product_bands_dict.values():
+                for band_path in band_paths or []:
+                    release_extracted_path(band_path, get_pin_owner(context))
+        log.info("Warped files: {}".format(pprint.pformat(output_paths)))
+        context['task_instance'].xcom_push(key='warp_timings', value=timings)
+        return output_paths
 
 
 class Sentinel1Plugin(AirflowPlugin):
     name = "RSYNC_plugin"
-    operators = [S1MetadataOperator]
+    operators = [S1MetadataOperator, S1WarpOperator]
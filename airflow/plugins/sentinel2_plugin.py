@@ -25,7 +25,7 @@
  *********************************************************************************/
 """
 
-from airflow.operators import BaseOperator, BashOperator
+from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
 from airflow.models import XCOM_RETURN_KEY
@@ -39,10 +39,356 @@ import shutil
 import pprint
 import xml.etree.ElementTree as ET
 from geoserver_plugin import create_owslinks_dict
-from utils import TemplatesResolver
+from osgeo import osr
+from safe_archive import get_archive_index
+from thumbnails import render_thumbnails_batch
+from utils import TemplatesResolver, map_products
 
 
 
+def get_granule_id(granule):
+    return granule.granule_path.rstrip("/").rsplit("/")[-1]
+
+
+def get_granule_coordinates(granule):
+    return [[[m.replace(" ", ",")] for m in str(granule.footprint).replace(", ", ",").partition('((')[-1].rpartition('))')[0].split(",")]]
+
+
+def get_granule_band_files(member_names, granule_ids):
+    """Map each granule id to the band files (.jp2 files of its IMG_DATA
+    directory, but the PVI) of the product, in a single pass over the
+    members of the SAFE archive.
+
+    Args:
+        member_names (list): names of the members of the archive
+        granule_ids (list): names of the granule directories
+
+    Returns:
+        dict: granule id to the list of its band files, in archive order
+    """
+    granule_band_files = dict((granule_id, []) for granule_id in granule_ids)
+    for name in member_names:
+        if not name.endswith('.jp2') or name.endswith('PVI.jp2'):
+            continue
+        parts = name.split('/')
+        if 'GRANULE' not in parts or 'IMG_DATA' not in parts:
+            continue
+        granule_id = parts[parts.index('GRANULE') + 1]
+        if granule_id in granule_band_files:
+            granule_band_files[granule_id].append(name)
+    return granule_band_files
+
+
+def get_granule_metadata_files(member_names, granule_ids):
+    """Map each granule id to its tile metadata, the .xml file at the root of
+    the granule directory (MTD_TL.xml, or S2A_OPER_MTD_L1C_TL_..._N02.04.xml
+    in the products of the old format).
+
+    Returns:
+        dict: granule id to the name of its tile metadata member
+    """
+    granule_metadata_files = {}
+    for name in member_names:
+        parts = name.split('/')
+        if len(parts) < 3 or parts[-3] != 'GRANULE' or not parts[-1].endswith('.xml'):
+            continue
+        if parts[-2] in granule_ids:
+            granule_metadata_files[parts[-2]] = name
+    return granule_metadata_files
+
+
+def create_granules_dict(granules, granule_band_files, remote_dir, bands_dict):
+    """Return the granules.json feature collection: one feature per band
+    file of each granule, with the footprint of the granule."""
+    features_list = []
+    granule_counter = 1
+    for granule in granules:
+        granule_coords = []
+        for item in get_granule_coordinates(granule)[0]:
+            [granule_x_coordinate, granule_y_coordinate] = item[0].split(",")
+            granule_coords.append([float(granule_x_coordinate), float(granule_y_coordinate)])
+        granule_id = get_granule_id(granule)
+        for file_name in granule_band_files[granule_id]:
+            band_filename = file_name.rsplit("/")[-1]
+            features_list.append({
+                "type": "Feature",
+                "geometry": {"type": "Polygon", "coordinates": [granule_coords]},
+                "properties": {
+                    "location": os.path.join(remote_dir, granule_id, "IMG_DATA", band_filename),
+                    "band": bands_dict[band_filename.rsplit(".")[0][-3:]]
+                },
+                "id": "GRANULE.{}".format(granule_counter)
+            })
+            granule_counter += 1
+    return {"type": "FeatureCollection", "features": features_list}
+
+
+def get_pvi_members(member_names):
+    """Return the preview images (PVI) of the granules of a SAFE archive, from
+    the names of its members."""
+    return [name for name in member_names if "/QI_DATA/" in name and "PVI" in name.rsplit("/", 1)[-1] and name.endswith(".jp2")]
+
+
+def prepare_product_dir(product):
+    """(Re)create the empty directory receiving the metadata files of
+    ``product``."""
+    product_dir = product.strip(".zip")
+    if os.path.isdir(product_dir):
+        shutil.rmtree(product_dir)
+    os.mkdir(product_dir)
+    return product_dir
+
+
+def get_thumbnail_outputs(product, thumbnail_sizes, output_dir=None):
+    """Prepare the product directory and return the thumbnails of a product.
+
+    Args:
+        product (str): path of the zipped SAFE product
+        thumbnail_sizes (list): (x, y) of the thumbnails. The first one is the
+            default thumbnail, the others are written as
+            thumbnail_<x>x<y>.jpeg
+        output_dir (str): output directory of the thumbnails, the product
+            directory by default
+
+    Returns:
+        list: (path, (x, y)) of the thumbnails, the default one first
+    """
+    product_dir = prepare_product_dir(product)
+    if output_dir is not None:
+        thumbnail_name = os.path.join(output_dir, "thumbnail.jpeg")
+    else:
+        output_dir = product_dir
+        thumbnail_name = product_dir + "/thumbnail.jpg"
+    size_x, size_y = thumbnail_sizes[0]
+    outputs = [(thumbnail_name, (int(size_x), int(size_y)))]
+    for size_x, size_y in thumbnail_sizes[1:]:
+        outputs.append((os.path.join(output_dir, "thumbnail_{}x{}.jpeg".format(size_x, size_y)), (int(size_x), int(size_y))))
+    return outputs
+
+
+def create_product_thumbnails(product, thumbnail_size, output_dir=None):
+    """Create the thumbnail of a product with pgmagick from the PVI of its
+    first readable granule, read in place from the zip.
+
+    Returns:
+        list: path of the created thumbnail
+    """
+    index = get_archive_index(product)
+    pvi_members = get_pvi_members(index.names)
+    if len(pvi_members) == 0:
+        raise RuntimeError("No PVI found in {}".format(product))
+    thumbnail_name = get_thumbnail_outputs(product, [thumbnail_size], output_dir)[0][0]
+
+    error = None
+    for pvi_member in pvi_members:
+        try:
+            img = Image(Blob(index.read(pvi_member)))
+            img.scale("{}x{}".format(*thumbnail_size))
+            img.quality(80)
+            log.info("Writing thumbnail to {}".format(thumbnail_name))
+            img.write(str(thumbnail_name))
+            return [thumbnail_name]
+        except Exception as e:
+            log.warning("Unable to create thumbnail from {}: {}".format(pvi_member, e))
+            error = e
+    raise error
+
+
+def get_tile_geocoding(mtd_tl_xml):
+    """Read the EPSG code and the geopositions of a granule from its tile
+    metadata (MTD_TL.xml).
+
+    Returns:
+        tuple: the EPSG code (int) and a dict of the (XDIM, YDIM, ULX, ULY) of
+        each resolution
+    """
+    root = ET.parse(mtd_tl_xml).getroot()
+    geometric_info = root.find(root.tag.split('}', 1)[0]+"}Geometric_Info")
+    tile_geocoding = geometric_info.find("Tile_Geocoding")
+    epsg_code = int(tile_geocoding.findtext("HORIZONTAL_CS_CODE").split(":")[-1])
+    geopositions = dict()
+    for geo_position in tile_geocoding.findall("Geoposition"):
+        geopositions[geo_position.attrib["resolution"]] = tuple(
+            geo_position.findtext(key) for key in ("XDIM", "YDIM", "ULX", "ULY"))
+    return epsg_code, geopositions
+
+
+def write_granule_sidecars(jp2_files, mtd_tl_xml, bands_res):
+    """Write the .prj and .wld files GeoServer needs next to each band of a
+    granule. The projection and the geopositions are read once from the
+    tile metadata.
+
+    Args:
+        jp2_files (list): paths of the extracted band files of the granule
+        mtd_tl_xml (str): path of the extracted tile metadata of the granule
+        bands_res (dict): resolutions of S2 and the bands they carry
+
+    Returns:
+        tuple: lists of the .wld and .prj files written
+    """
+    epsg_code, geopositions = get_tile_geocoding(mtd_tl_xml)
+    sref = osr.SpatialReference()
+    sref.ImportFromEPSG(epsg_code)
+    wkt = sref.ExportToPrettyWkt()
+    wld_files = []
+    prj_files = []
+    for jp2_file in jp2_files:
+        wld_name = os.path.splitext(jp2_file)[0]
+        with open(wld_name+".prj", "w") as prj_file:
+            prj_file.write(wkt + "\n")
+        prj_files.append(wld_name+".prj")
+        for key,value in bands_res.items():
+            if wld_name[-3:] in value:
+                element = key
+        xdim, ydim, ulx, uly = geopositions[element]
+        with open(wld_name+".wld", "w") as wld_file:
+            wld_file.write(xdim + "\n" + "0" + "\n" + "0" + "\n")
+            wld_file.write(ydim + "\n")
+            wld_file.write(ulx + "\n")
+            wld_file.write(uly + "\n")
+        wld_files.append(wld_name+".wld")
+    return wld_files, prj_files
+
+
+def create_product_files(product, archived_product, bands_res, bands_dict, remote_dir, original_package_download_base_url, ows_params):
+    """Create the metadata files of a product (description.html, product.json,
+    granules.json and owsLinks.json) and extract its bands along with their
+    .wld and .prj files.
+
+    Args:
+        product (str): path of the downloaded zipped SAFE product
+        archived_product (str): path of the archived original package
+        bands_res (dict): carrying the keys as the different resolutions of S2 and values carrying the associated bands
+        bands_dict (dict): carrying the band's names of S2
+        remote_dir (str): the remote repository path
+        original_package_download_base_url (str): carrying the base url of the downloaded original package
+        ows_params (dict): the gs_* arguments of create_owslinks_dict()
+
+    Returns:
+        str: the directory of the extracted granules of the product
+    """
+    log.info("Processing: {}".format(product))
+    with s2reader.open(product) as s2_product:
+        coords = []
+        links=[]
+        metadata=s2_product._product_metadata
+        granule=s2_product.granules[0]
+        granule_metadata=granule._metadata
+        product_footprint = [[[m.replace(" ", ",")] for m in str(s2_product.footprint).replace(", ", ",").partition('((')[-1].rpartition('))')[0].split(",")]]
+        for item in product_footprint[0]:
+            [x_coordinate, y_coordinate] = item[0].split(",")
+            coords.append([float(x_coordinate), float(y_coordinate)])
+        final_metadata_dict = {"type": "Feature", "geometry":
+        {"type": "Polygon", "coordinates":
+        [coords]},
+        "properties": {
+            "eop:identifier": s2_product.manifest_safe_path.rsplit('.SAFE', 1)[0],
+            "timeStart": s2_product.product_start_time,
+            "timeEnd": s2_product.product_stop_time,
+            "originalPackageLocation": os.path.join(original_package_download_base_url , os.path.basename(archived_product)),
+            "thumbnailURL": None,
+            "quicklookURL": None,
+            "eop:parentIdentifier": "SENTINEL2",
+            "eop:productionStatus": None,
+            "eop:acquisitionType": None,
+            "eop:orbitNumber": s2_product.sensing_orbit_number, 
+            "eop:orbitDirection": s2_product.sensing_orbit_direction,
+            "eop:track": None,
+            "eop:frame": None, 
+            "eop:swathIdentifier": metadata.find('.//Product_Info/Datatake').attrib['datatakeIdentifier'],
+            "opt:cloudCover": int(float(metadata.findtext(".//Cloud_Coverage_Assessment"))),
+            "opt:snowCover": None,
+            "eop:productQualityStatus": None,
+            "eop:productQualityDegradationStatus": None,
+            "eop:processorName": None,
+            "eop:processingCenter": None,
+            "eop:creationDate": None,
+            "eop:modificationDate": None,
+            "eop:processingDate": None,
+            "eop:sensorMode": None,
+            "eop:archivingCenter": granule_metadata.findtext('.//ARCHIVING_CENTRE'),
+            "eop:processingMode": None,
+            "eop:availabilityTime": s2_product.generation_time,
+            "eop:acquisitionStation": None,
+            "eop:acquisitionSubtype": None,
+            "eop:startTimeFromAscendingNode": None,
+            "eop:completionTimeFromAscendingNode": None,
+            "eop:illuminationAzimuthAngle": metadata.findtext('.//Mean_Sun_Angle/AZIMUTH_ANGLE'),
+            "eop:illuminationZenithAngle":  metadata.findtext('.//Mean_Sun_Angle/ZENITH_ANGLE'),
+            "eop:illuminationElevationAngle": None, 
+            "eop:resolution": None}
+        }
+        granules = s2_product.granules
+        granule_band_files = get_granule_band_files(
+            get_archive_index(product).names,
+            [get_granule_id(granule) for granule in granules])
+        final_granules_dict = create_granules_dict(
+            granules, granule_band_files, remote_dir, bands_dict)
+        granule = granules[-1]
+        granule_coordinates = get_granule_coordinates(granule)
+
+    timeStart, timeEnd = final_metadata_dict["properties"]["timeStart"], final_metadata_dict["properties"]["timeEnd"]
+    # create description.html and dump it to file
+    log.info("Creating description.html")
+    tr = TemplatesResolver()
+    htmlAbstract = tr.generate_product_abstract({
+        "timeStart": timeStart,
+        "timeEnd": timeEnd,
+        "originalPackageLocation" : final_metadata_dict["properties"]["originalPackageLocation"]
+    })
+    log.debug(pprint.pformat(htmlAbstract))
+    final_metadata_dict['htmlDescription'] = htmlAbstract
+
+    with open(product.strip(".zip")+'/description.html', 'w') as product_outfile:
+        product_outfile.write(htmlAbstract)
+    # Note here that the SRID is a property of the granule not the product
+    final_metadata_dict["properties"]["crs"] = granule.srid
+    with open(product.strip(".zip")+'/product.json', 'w') as product_outfile:
+        json.dump(final_metadata_dict, product_outfile,indent=4)                
+    with open(product.strip(".zip")+'/granules.json', 'w') as granules_outfile:
+        json.dump(final_granules_dict, granules_outfile, indent=4)
+
+    product_identifier = s2_product.manifest_safe_path.rsplit('.SAFE', 1)[0]
+    bbox = get_bbox_from_granules_coordinates(granule_coordinates)
+
+    ows_links_dict = create_owslinks_dict(
+        product_identifier=product_identifier,
+        timestart = timeStart,
+        timeend = timeEnd,
+        granule_bbox=bbox,
+        **ows_params
+    )
+
+    log.info("ows links: {}".format(pprint.pformat(ows_links_dict)))
+
+    with open(product.strip(".zip")+'/owsLinks.json', 'w') as owslinks_outfile:
+          json.dump(ows_links_dict, owslinks_outfile, indent=4)
+
+    # each granule is geocoded by its own tile metadata
+    product_dir = product.strip(".zip")
+    archive_index = get_archive_index(product)
+    granule_metadata_files = get_granule_metadata_files(
+        archive_index.names, list(granule_band_files))
+    jp2_files_paths = []
+    for granule in granules:
+        granule_id = get_granule_id(granule)
+        if not granule_band_files[granule_id]:
+            continue
+        if granule_id not in granule_metadata_files:
+            raise RuntimeError("No tile metadata for granule {} of {}".format(granule_id, product))
+        granule_jp2_files = []
+        for file_name in granule_band_files[granule_id]:
+            archive_index.extract(file_name, product_dir)
+            granule_jp2_files.append(os.path.join(product_dir, file_name))
+        archive_index.extract(granule_metadata_files[granule_id], product_dir)
+        mtd_tl_xml = os.path.join(product_dir, granule_metadata_files[granule_id])
+        write_granule_sidecars(granule_jp2_files, mtd_tl_xml, bands_res)
+        jp2_files_paths += granule_jp2_files
+    parent_dir = os.path.dirname(jp2_files_paths[0])
+    log.info(os.path.dirname(parent_dir))
+    return os.path.dirname(parent_dir)
+
+
 def get_bbox_from_granules_coordinates(granule_coordinates):
     long_max, long_min = (
     float(granule_coordinates[0][3][0].split(",")[0]), float(granule_coordinates[0][1][0].split(",")[0]))
@@ -74,8 +420,12 @@ class Sentinel2ThumbnailOperator(BaseOperator):
             input_product (str): product name in case the operator will process single product
             output_dir (str): output directory for the generated thumbnail
             get_inputs_from (str): task_id used to fetch downloaded files list from XCom
+            thumbnail_engine (bool): create the thumbnails with the GDAL thumbnail engine (see thumbnails.py), reading the PVI straight from the zip, instead of pgmagick
+            extra_sizes (list): (x, y) of additional thumbnails written by the thumbnail engine in the same decode, as thumbnail_<x>x<y>.jpeg
+            max_workers (int): number of products processed concurrently, each in its own process
+            gdal_runtime (dict): GDAL runtime profile of the thumbnail engine, see config/settings.py
         Returns:
-            list: list of created thumbnail's paths
+            list: list of created thumbnail's paths. The processing time of each product is pushed to XCom under the "thumbnail_timings" key
         """
 
         @apply_defaults
@@ -85,12 +435,20 @@ class Sentinel2ThumbnailOperator(BaseOperator):
             input_product=None,
             output_dir=None,
             get_inputs_from=None,
+            thumbnail_engine=False,
+            extra_sizes=None,
+            max_workers=1,
+            gdal_runtime=None,
             *args, **kwargs):
                 self.thumb_size_x = thumb_size_x
                 self.thumb_size_y = thumb_size_y
                 self.input_product = input_product
                 self.output_dir = output_dir
                 self.get_inputs_from = get_inputs_from
+                self.thumbnail_engine = thumbnail_engine
+                self.extra_sizes = list(extra_sizes or [])
+                self.max_workers = max_workers
+                self.gdal_runtime = gdal_runtime
                 super(Sentinel2ThumbnailOperator, self).__init__(*args, **kwargs)
 
         def execute(self, context):
@@ -118,39 +476,32 @@ class Sentinel2ThumbnailOperator(BaseOperator):
                 log.info("Nothing to process.")
                 return
 
+            thumbnail_size = (self.thumb_size_x, self.thumb_size_y)
+            elapsed = []
+            if self.thumbnail_engine:
+                # the PVI of each granule in turn, as read by GDAL from the zip
+                jobs = []
+                for product in products:
+                    index = get_archive_index(product)
+                    sources = [index.vsizip_path(member) for member in get_pvi_members(index.names)]
+                    jobs.append((sources, get_thumbnail_outputs(product, [thumbnail_size] + self.extra_sizes, self.output_dir)))
+                results = render_thumbnails_batch(jobs, max_workers=self.max_workers, timings=elapsed, square=True, gdal_runtime=self.gdal_runtime)
+            else:
+                arguments = [(product, thumbnail_size, self.output_dir) for product in products]
+                results = map_products("thumbnail", create_product_thumbnails, products, arguments, max_workers=self.max_workers, continue_on_error=True, timings=elapsed)
+
             thumbnail_paths=list()
-            for product in products:
-                log.info("Processing {}".format(product))
-                with s2reader.open(product) as safe_product:
-                    for granule in safe_product.granules:
-                        try:
-                            zipf = zipfile.ZipFile(product, 'r')
-                            imgdata = zipf.read(granule.pvi_path,'r')
-                            img = Blob(imgdata)
-                            img = Image(img)
-                            img.scale(self.thumb_size_x+'x'+self.thumb_size_y)
-                            img.quality(80)
-                            thumbnail_name = product.strip(".zip")+"/thumbnail.jpg"
-                            if os.path.isdir(product.strip(".zip")):
-                                product_rmdir_cmd = "rm -r {} ".format(product.strip(".zip"))
-                                product_rmdir_BO = BashOperator(task_id="product_rmdir_{}".format(product.split("/")[-1].strip(".zip")), bash_command = product_rmdir_cmd)
-                                product_rmdir_BO.execute(context)
-                            product_mkdir_cmd = "mkdir {} ".format(product.strip(".zip"))
-                            product_mkdir_BO = BashOperator(task_id="product_mkdir_{}".format(product.split("/")[-1].strip(".zip")), bash_command = product_mkdir_cmd)
-                            product_mkdir_BO.execute(context)
-                            if self.output_dir is not None:
-                                thumbnail_name=os.path.join(self.output_dir,"thumbnail.jpeg")
-                                log.info("Writing thumbnail to {}".format(thumbnail_name))
-                                img.write(thumbnail_name)
-                            else:
-                                img.write(str(thumbnail_name))
-                            thumbnail_paths.append(thumbnail_name)
-                            # XCOM expects a single file so we push it here:
-                            context['task_instance'].xcom_push(key='thumbnail_jpeg_abs_path', value=str(thumbnail_name))
-                            context['task_instance'].xcom_push(key='ids', value=ids)
-                            break
-                        except BaseException as e:
-                            log.error("Unable to extract thumbnail from {}: {}".format(product, e))
+            timings = dict(zip(products, elapsed))
+            for product, paths in zip(products, results):
+                if paths is None:
+                    continue
+                log.info("Created thumbnail of {} in {:.2f}s".format(product, timings[product]))
+                thumbnail_paths.append(paths[0])
+                # XCOM expects a single file so we push it here:
+                context['task_instance'].xcom_push(key='thumbnail_jpeg_abs_path', value=str(paths[0]))
+                context['task_instance'].xcom_push(key='ids', value=ids)
+            log.info("Created {} thumbnails out of {} products in {:.2f}s of processing".format(len(thumbnail_paths), len(products), sum(timings.values())))
+            context['task_instance'].xcom_push(key='thumbnail_timings', value=timings)
             return thumbnail_paths
 
 
@@ -177,8 +528,10 @@ class Sentinel2MetadataOperator(BaseOperator):
         original_package_download_base_url (str): carrying the base url of the downloaded original package
         coverage_id (str): id contains the feature and layer to be used in OWSLinks.json
         get_inputs_from (list): carrying ids of download and archive tasks
+        max_workers (int): number of products processed concurrently, each in its own process
+        continue_on_error (bool): log the products failing and go on with the others instead of failing the task. The failed products are left out of the XCom outputs
     Returns:
-        list: list of directorie's paths for all the processed products
+        list: list of directorie's paths for all the processed products, in the order of the downloaded products
     """
     @apply_defaults
     def __init__(self, 
@@ -201,6 +554,8 @@ class Sentinel2MetadataOperator(BaseOperator):
         gs_wcs_coverage_id,
         original_package_download_base_url,
         get_inputs_from=None,
+        max_workers=1,
+        continue_on_error=False,
         *args, **kwargs):
             self.bands_res = bands_res
             self.remote_dir = remote_dir
@@ -221,6 +576,8 @@ class Sentinel2MetadataOperator(BaseOperator):
             self.gs_wcs_coverage_id = gs_wcs_coverage_id
             self.get_inputs_from = get_inputs_from
             self.original_package_download_base_url = original_package_download_base_url
+            self.max_workers = max_workers
+            self.continue_on_error = continue_on_error
             super(Sentinel2MetadataOperator, self).__init__(*args, **kwargs)
 
     def execute(self, context):
@@ -234,169 +591,32 @@ class Sentinel2MetadataOperator(BaseOperator):
             log.info("Nothing to process.")
             return
 
-        for product in self.downloaded_products.keys():
-            log.info("Processing: {}".format(product))
-            with s2reader.open(product) as s2_product:
-                coords = []
-                links=[]
-                metadata=s2_product._product_metadata
-                granule=s2_product.granules[0]
-                granule_metadata=granule._metadata
-                product_footprint = [[[m.replace(" ", ",")] for m in str(s2_product.footprint).replace(", ", ",").partition('((')[-1].rpartition('))')[0].split(",")]]
-                for item in product_footprint[0]:
-                    [x_coordinate, y_coordinate] = item[0].split(",")
-                    coords.append([float(x_coordinate), float(y_coordinate)])
-                final_metadata_dict = {"type": "Feature", "geometry":
-                {"type": "Polygon", "coordinates":
-                [coords]},
-                "properties": {
-                    "eop:identifier": s2_product.manifest_safe_path.rsplit('.SAFE', 1)[0],
-                    "timeStart": s2_product.product_start_time,
-                    "timeEnd": s2_product.product_stop_time,
-                    "originalPackageLocation": os.path.join(self.original_package_download_base_url , os.path.basename(self.archived_products.pop(0))),
-                    "thumbnailURL": None,
-                    "quicklookURL": None,
-                    "eop:parentIdentifier": "SENTINEL2",
-                    "eop:productionStatus": None,
-                    "eop:acquisitionType": None,
-                    "eop:orbitNumber": s2_product.sensing_orbit_number, 
-                    "eop:orbitDirection": s2_product.sensing_orbit_direction,
-                    "eop:track": None,
-                    "eop:frame": None, 
-                    "eop:swathIdentifier": metadata.find('.//Product_Info/Datatake').attrib['datatakeIdentifier'],
-                    "opt:cloudCover": int(float(metadata.findtext(".//Cloud_Coverage_Assessment"))),
-                    "opt:snowCover": None,
-                    "eop:productQualityStatus": None,
-                    "eop:productQualityDegradationStatus": None,
-                    "eop:processorName": None,
-                    "eop:processingCenter": None,
-                    "eop:creationDate": None,
-                    "eop:modificationDate": None,
-                    "eop:processingDate": None,
-                    "eop:sensorMode": None,
-                    "eop:archivingCenter": granule_metadata.findtext('.//ARCHIVING_CENTRE'),
-                    "eop:processingMode": None,
-                    "eop:availabilityTime": s2_product.generation_time,
-                    "eop:acquisitionStation": None,
-                    "eop:acquisitionSubtype": None,
-                    "eop:startTimeFromAscendingNode": None,
-                    "eop:completionTimeFromAscendingNode": None,
-                    "eop:illuminationAzimuthAngle": metadata.findtext('.//Mean_Sun_Angle/AZIMUTH_ANGLE'),
-                    "eop:illuminationZenithAngle":  metadata.findtext('.//Mean_Sun_Angle/ZENITH_ANGLE'),
-                    "eop:illuminationElevationAngle": None, 
-                    "eop:resolution": None}
-                }
-                for i in self.bands_res.values():
-                    features_list = []
-                    granule_counter = 1
-                    for granule in s2_product.granules:
-                        granule_coords = []
-                        granule_coordinates = [[[m.replace(" ", ",")] for m in str(granule.footprint).replace(", ", ",").partition('((')[-1].rpartition('))')[0].split(",")]]
-
-                        for item in granule_coordinates[0]:
-                            [granule_x_coordinate, granule_y_coordinate] = item[0].split(",")
-                            granule_coords.append([float(granule_x_coordinate), float(granule_y_coordinate)])
-                        zipped_product = zipfile.ZipFile(product)
-                        for file_name in zipped_product.namelist():
-                            if file_name.endswith('.jp2') and not file_name.endswith('PVI.jp2'):
-                                 features_list.append({"type": "Feature", "geometry": { "type": "Polygon", "coordinates": [granule_coords]},\
-                        "properties": {\
-                        "location":os.path.join(self.remote_dir, granule.granule_path.rsplit("/")[-1], "IMG_DATA", file_name.rsplit("/")[-1]), "band": self.bands_dict[file_name.rsplit("/")[-1].rsplit(".")[0][-3:]]},\
-                        "id": "GRANULE.{}".format(granule_counter)})
-                                 granule_counter+=1
-            final_granules_dict = {"type": "FeatureCollection", "features": features_list}
-
-            timeStart, timeEnd = final_metadata_dict["properties"]["timeStart"], final_metadata_dict["properties"]["timeEnd"]
-            # create description.html and dump it to file
-            log.info("Creating description.html")
-            tr = TemplatesResolver()
-            htmlAbstract = tr.generate_product_abstract({
-                "timeStart": timeStart,
-                "timeEnd": timeEnd,
-                "originalPackageLocation" : final_metadata_dict["properties"]["originalPackageLocation"]
-            })
-            log.debug(pprint.pformat(htmlAbstract))
-            final_metadata_dict['htmlDescription'] = htmlAbstract
-
-            with open(product.strip(".zip")+'/description.html', 'w') as product_outfile:
-                product_outfile.write(htmlAbstract)
-            # Note here that the SRID is a property of the granule not the product
-            final_metadata_dict["properties"]["crs"] = granule.srid
-            with open(product.strip(".zip")+'/product.json', 'w') as product_outfile:
-                json.dump(final_metadata_dict, product_outfile,indent=4)                
-            with open(product.strip(".zip")+'/granules.json', 'w') as granules_outfile:
-                json.dump(final_granules_dict, granules_outfile, indent=4)
-
-            product_identifier = s2_product.manifest_safe_path.rsplit('.SAFE', 1)[0]
-            bbox = get_bbox_from_granules_coordinates(granule_coordinates)
-
-            ows_links_dict = create_owslinks_dict(
-                product_identifier=product_identifier,
-                timestart = timeStart,
-                timeend = timeEnd,
-                granule_bbox=bbox,
-                gs_workspace=self.gs_workspace,
-                gs_wms_layer=self.gs_wms_layer,
-                gs_wms_width=self.gs_wms_width,
-                gs_wms_height=self.gs_wms_height,
-                gs_wms_format=self.gs_wms_format,
-                gs_wms_version=self.gs_wms_version,
-                gs_wfs_featuretype=self.gs_wfs_featuretype,
-                gs_wfs_format=self.gs_wfs_format,
-                gs_wfs_version=self.gs_wfs_version,
-                gs_wcs_coverage_id=self.gs_wcs_coverage_id,
-                gs_wcs_scale_i=self.gs_wcs_scale_i,
-                gs_wcs_scale_j=self.gs_wcs_scale_j,
-                gs_wcs_format=self.gs_wcs_format,
-                gs_wcs_version=self.gs_wcs_version,
-            )
-
-            log.info("ows links: {}".format(pprint.pformat(ows_links_dict)))
-
-            with open(product.strip(".zip")+'/owsLinks.json', 'w') as owslinks_outfile:
-                  json.dump(ows_links_dict, owslinks_outfile, indent=4)
+        products = list(self.downloaded_products.keys())
+        ows_params = dict(
+            gs_workspace=self.gs_workspace,
+            gs_wms_layer=self.gs_wms_layer,
+            gs_wms_width=self.gs_wms_width,
+            gs_wms_height=self.gs_wms_height,
+            gs_wms_format=self.gs_wms_format,
+            gs_wms_version=self.gs_wms_version,
+            gs_wfs_featuretype=self.gs_wfs_featuretype,
+            gs_wfs_format=self.gs_wfs_format,
+            gs_wfs_version=self.gs_wfs_version,
+            gs_wcs_coverage_id=self.gs_wcs_coverage_id,
+            gs_wcs_scale_i=self.gs_wcs_scale_i,
+            gs_wcs_scale_j=self.gs_wcs_scale_j,
+            gs_wcs_format=self.gs_wcs_format,
+            gs_wcs_version=self.gs_wcs_version,
+        )
+        arguments = [(product, archived_product, self.bands_res, self.bands_dict, self.remote_dir, self.original_package_download_base_url, ows_params) for product, archived_product in zip(products, self.archived_products)]
+        results = map_products("Sentinel-2 metadata", create_product_files, products, arguments, max_workers=self.max_workers, continue_on_error=self.continue_on_error)
 
         self.custom_archived = []
-        for archive_line in self.downloaded_products.keys():
-            jp2_files_paths = []
-            archive_path = archive_line
-            archived_product = zipfile.ZipFile(archive_line,'r')
-            for file_name in archived_product.namelist():
-                if file_name.endswith('.jp2') and not file_name.endswith('PVI.jp2'):
-                    archived_product.extract(file_name, archive_path.strip(".zip"))
-                    jp2_files_paths.append(os.path.join(archive_path.strip(".zip"),file_name))
-                    parent_dir = os.path.dirname(jp2_files_paths[0])
-                if file_name.endswith('MTD_TL.xml'):
-                    archived_product.extract(file_name, archive_path.strip(".zip"))
-                    mtd_tl_xml = os.path.join(archive_path.strip(".zip"),file_name)
-            tree = ET.parse(mtd_tl_xml)
-            root = tree.getroot()
-            geometric_info = root.find(root.tag.split('}', 1)[0]+"}Geometric_Info")
-            tile_geocoding = geometric_info.find("Tile_Geocoding")
-            wld_files = []
-            prj_files = []
-            for jp2_file in jp2_files_paths:
-                wld_name = os.path.splitext(jp2_file)[0]
-                gdalinfo_cmd = "gdalinfo {} > {}".format(jp2_file, wld_name+".prj")
-                gdalinfo_BO = BashOperator(task_id="bash_operator_gdalinfo_{}".format(wld_name[-3:]), bash_command = gdalinfo_cmd)
-                gdalinfo_BO.execute(context)
-                sed_cmd = "sed -i -e '1,4d;29,$d' {}".format(wld_name+".prj")
-                sed_BO = BashOperator(task_id="bash_operator_sed_{}".format(wld_name[-3:]), bash_command = sed_cmd)
-                sed_BO.execute(context)
-                prj_files.append(wld_name+".prj")
-                wld_file = open(wld_name+".wld","w")
-                wld_files.append(wld_name+".wld")
-                for key,value in  self.bands_res.items():
-                    if wld_name[-3:] in value:
-                        element = key
-                geo_position = tile_geocoding.find('.//Geoposition[@resolution="{}"]'.format(element))
-                wld_file.write(geo_position.find("XDIM").text + "\n" + "0" + "\n" + "0" +"\n")
-                wld_file.write(geo_position.find("YDIM").text + "\n")
-                wld_file.write(geo_position.find("ULX").text + "\n")
-                wld_file.write(geo_position.find("ULY").text + "\n")
-            parent_dir = os.path.dirname(jp2_files_paths[0])
-            self.custom_archived.append(os.path.dirname(parent_dir))
-            log.info(os.path.dirname(parent_dir))
+        for product, granules_dir in zip(products, results):
+            if granules_dir is None:
+                del self.downloaded_products[product]
+                continue
+            self.custom_archived.append(granules_dir)
         log.info(self.custom_archived)
         context['task_instance'].xcom_push(key='downloaded_products', value=self.downloaded_products)
         context['task_instance'].xcom_push(key='downloaded_products_with_wldprj', value=' '.join(self.custom_archived))
@@ -412,6 +632,7 @@ class Sentinel2ProductZipOperator(BaseOperator):
         generated_files (list): paths of files that are currently supported (product.json, granules.json, thumbnail.jpeg, owsLinks.json)
         placeholders (list): paths of files that are currently not supported (metadata.xml)
         get_inputs_from (str): task id used to fetch input products from xcom
+        get_inputs_key (str): xcom key of the input products, e.g. "downloaded_products" of Sentinel2MetadataOperator, which leaves out the products it failed on
     Returns:
         list: list of zip files paths for all the processed products
     """
@@ -422,17 +643,19 @@ class Sentinel2ProductZipOperator(BaseOperator):
         generated_files,
         placeholders,
         get_inputs_from=None,
+        get_inputs_key=XCOM_RETURN_KEY,
         *args, **kwargs):
             self.target_dir = target_dir
             self.generated_files = generated_files
             self.placeholders = placeholders
             self.get_inputs_from = get_inputs_from
+            self.get_inputs_key = get_inputs_key
             super(Sentinel2ProductZipOperator, self).__init__(*args, **kwargs)            
 
     def execute(self, context):
         if self.get_inputs_from != None:
             log.info("Getting inputs from: " +self.get_inputs_from)
-            self.downloaded_products = context['task_instance'].xcom_pull(task_ids=self.get_inputs_from, key=XCOM_RETURN_KEY)
+            self.downloaded_products = context['task_instance'].xcom_pull(task_ids=self.get_inputs_from, key=self.get_inputs_key)
         else:
             log.info("Getting inputs from: dhus_metadata_task" )
             self.downloaded_products = context['task_instance'].xcom_pull('dhus_metadata_task', key='downloaded_products')
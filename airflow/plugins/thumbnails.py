@@ -0,0 +1,209 @@
+"""
+/*********************************************************************************/
+ *  The MIT License (MIT)                                                         *
+ *                                                                                *
+ *  Copyright (c) 2014 EOX IT Services GmbH                                       *
+ *                                                                                *
+ *  Permission is hereby granted, free of charge, to any person obtaining a copy  *
+ *  of this software and associated documentation files (the "Software"), to deal *
+ *  in the Software without restriction, including without limitation the rights  *
+ *  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell     *
+ *  copies of the Software, and to permit persons to whom the Software is         *
+ *  furnished to do so, subject to the following conditions:                      *
+ *                                                                                *
+ *  The above copyright notice and this permission notice shall be included in    *
+ *  all copies or substantial portions of the Software.                           *
+ *                                                                                *
+ *  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR    *
+ *  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,      *
+ *  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE   *
+ *  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER        *
+ *  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, *
+ *  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE *
+ *  SOFTWARE.                                                                     *
+ *                                                                                *
+ *********************************************************************************/
+"""
+
+"""Thumbnails of the Landsat-8, Sentinel-1 and Sentinel-2 products through
+GDAL.
+
+The source is decoded once, at the size of the largest thumbnail requested:
+GDAL reads it from the overviews of a GeoTIFF or from the reduced resolution
+levels of a JPEG2000 (e.g. the Sentinel-2 PVI) matching that size instead
+of the full resolution image. Every thumbnail is then resampled from that
+in-memory image.
+"""
+
+import logging
+import os
+import uuid
+
+from gdal_plugin import gdal_config, get_runtime_config
+from utils import map_products
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+log = logging.getLogger(__name__)
+
+DRIVERS = {
+    ".jpg": ("JPEG", ["QUALITY=80"]),
+    ".jpeg": ("JPEG", ["QUALITY=80"]),
+    ".png": ("PNG", []),
+}
+
+
+def fit_size(width, height, max_width, max_height):
+    """Largest size with the aspect ratio of ``width`` x ``height`` fitting
+    in ``max_width`` x ``max_height``."""
+    scale = min(float(max_width) / width, float(max_height) / height)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def _open(source):
+    dataset = gdal.Open(source)
+    if dataset is None:
+        raise RuntimeError("Cannot open {}: {}".format(
+            source, gdal.GetLastErrorMsg()))
+    return dataset
+
+
+def _write(image, path):
+    extension = os.path.splitext(path)[1].lower()
+    driver, creation_options = DRIVERS.get(extension, DRIVERS[".jpg"])
+    dataset = gdal.Translate(path, image, format=driver,
+                             creationOptions=creation_options)
+    if dataset is None:
+        raise RuntimeError("Cannot write {}: {}".format(
+            path, gdal.GetLastErrorMsg()))
+    dataset = None  # flush to disk
+    # the JPEG and PNG drivers leave a .aux.xml behind
+    if os.path.exists(path + ".aux.xml"):
+        os.remove(path + ".aux.xml")
+    return path
+
+
+def render_thumbnails(source, outputs, square=False, resampling="average",
+                      gdal_runtime=None):
+    """Write thumbnails of ``source`` in one decode.
+
+    Args:
+        source (str): raster readable by GDAL (file, /vsizip/ or /vsimem/
+            path)
+        outputs (list): (path, (max width, max height)) of each thumbnail,
+            the format follows the extension of the path (JPEG or PNG)
+        square (bool): crop the source to a square first, as the Landsat-8
+            thumbnails are
+        resampling (str): resampling method
+        gdal_runtime (dict): GDAL runtime profile, see config/settings.py
+
+    Returns:
+        list: paths of the thumbnails
+    """
+    if gdal is None:
+        raise RuntimeError("The GDAL python bindings are not available")
+    with gdal_config(**get_runtime_config(gdal_runtime)):
+        dataset = _open(source)
+        width, height = dataset.RasterXSize, dataset.RasterYSize
+        src_win = None
+        if square:
+            width = height = min(width, height)
+            src_win = [0, 0, width, height]
+        max_width = max(size[0] for _, size in outputs)
+        max_height = max(size[1] for _, size in outputs)
+        decode_width, decode_height = fit_size(
+            width, height, max_width, max_height)
+        translate_options = {}
+        if dataset.GetRasterBand(1).DataType != gdal.GDT_Byte:
+            translate_options = {"outputType": gdal.GDT_Byte,
+                                 "scaleParams": [[]]}
+        band_count = dataset.RasterCount
+        band_list = [1, 2, 3] if band_count >= 3 else [1]
+        # the only read of the source, at the resolution level the closest
+        # to the largest thumbnail
+        image = gdal.Translate(
+            "", dataset, format="MEM", srcWin=src_win, bandList=band_list,
+            width=decode_width, height=decode_height, resampleAlg=resampling,
+            **translate_options)
+        if image is None:
+            raise RuntimeError("Cannot decode {}: {}".format(
+                source, gdal.GetLastErrorMsg()))
+        dataset = None
+        paths = []
+        for path, (thumb_width, thumb_height) in outputs:
+            size = fit_size(decode_width, decode_height,
+                            thumb_width, thumb_height)
+            if size == (decode_width, decode_height):
+                thumbnail = image
+            else:
+                thumbnail = gdal.Translate(
+                    "", image, format="MEM", width=size[0], height=size[1],
+                    resampleAlg=resampling)
+            paths.append(_write(thumbnail, path))
+            log.info("Thumbnail {} ({}x{}) of {}".format(
+                path, size[0], size[1], source))
+        return paths
+
+
+def render_thumbnails_from_bytes(data, outputs, **kwargs):
+    """render_thumbnails() for an image held in memory (e.g. a quicklook read
+    from a zip)."""
+    if gdal is None:
+        raise RuntimeError("The GDAL python bindings are not available")
+    vsimem_path = "/vsimem/thumbnail_{}".format(uuid.uuid4().hex)
+    gdal.FileFromMemBuffer(vsimem_path, data)
+    try:
+        return render_thumbnails(vsimem_path, outputs, **kwargs)
+    finally:
+        gdal.Unlink(vsimem_path)
+
+
+def render_first_thumbnails(sources, outputs, **kwargs):
+    """render_thumbnails() from the first of ``sources`` that can be read,
+    e.g. the PVI of the first readable granule of a Sentinel-2 product."""
+    if not sources:
+        raise RuntimeError("No source to create {} from".format(outputs[0][0]))
+    error = None
+    for source in sources:
+        try:
+            return render_thumbnails(source, outputs, **kwargs)
+        except Exception as e:
+            log.warning("Unable to create thumbnails from {}: {}".format(
+                source, e))
+            error = e
+    raise error
+
+
+def _render_job(source, outputs, kwargs):
+    if isinstance(source, list):
+        return render_first_thumbnails(source, outputs, **kwargs)
+    return render_thumbnails(source, outputs, **kwargs)
+
+
+def render_thumbnails_batch(jobs, max_workers=1, timings=None, **kwargs):
+    """Render the thumbnails of several products, in a pool of up to
+    ``max_workers`` processes.
+
+    A product failing does not stop the others: its error is logged and its
+    result is None (see utils.map_products).
+
+    Args:
+        jobs (list): (source, outputs) of each product, see
+            render_thumbnails(). The source can also be a list of sources
+            tried in turn, see render_first_thumbnails()
+        max_workers (int): number of products processed concurrently
+        timings (list): receives the processing time of each product, in
+            the order of ``jobs``
+
+    Returns:
+        list: paths of the thumbnails of each product, in the order of
+        ``jobs``
+    """
+    return map_products("thumbnails", _render_job,
+                        [source for source, _ in jobs],
+                        [(source, outputs, kwargs) for source, outputs in jobs],
+                        max_workers=max_workers, continue_on_error=True,
+                        timings=timings)
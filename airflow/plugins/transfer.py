@@ -0,0 +1,353 @@
+"""
+/*********************************************************************************/
+ *  The MIT License (MIT)                                                         *
+ *                                                                                *
+ *  Copyright (c) 2014 EOX IT Services GmbH                                       *
+ *                                                                                *
+ *  Permission is hereby granted, free of charge, to any person obtaining a copy  *
+ *  of this software and associated documentation files (the "Software"), to deal *
+ *  in the Software without restriction, including without limitation the rights  *
+ *  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell     *
+ *  copies of the Software, and to permit persons to whom the Software is         *
+ *  furnished to do so, subject to the following conditions:                      *
+ *                                                                                *
+ *  The above copyright notice and this permission notice shall be included in    *
+ *  all copies or substantial portions of the Software.                           *
+ *                                                                                *
+ *  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR    *
+ *  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,      *
+ *  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE   *
+ *  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER        *
+ *  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, *
+ *  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE *
+ *  SOFTWARE.                                                                     *
+ *                                                                                *
+ *********************************************************************************/
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config as CFG
+
+log = logging.getLogger(__name__)
+
+BUFFER_SIZE = CFG.transfer_buffer_size
+POOL_SIZE = CFG.transfer_pool_size
+TIMEOUT = CFG.transfer_timeout
+
+PART_SUFFIX = ".part"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class TransferError(IOError):
+    pass
+
+
+class TransferStats(object):
+    """Bytes moved and time spent by a single transfer."""
+
+    def __init__(self, url, path=None):
+        self.url = url
+        self.path = path
+        self.status_code = None
+        self.headers = {}
+        self.bytes = 0
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    def update(self, size):
+        self.bytes += size
+
+    def finish(self):
+        self.elapsed = time.time() - self.started
+        return self
+
+    @property
+    def throughput(self):
+        """Average throughput in bytes per second."""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes / self.elapsed
+
+    def as_dict(self):
+        return {
+            "url": self.url,
+            "path": self.path,
+            "status_code": self.status_code,
+            "bytes": self.bytes,
+            "elapsed": self.elapsed,
+            "throughput": self.throughput,
+        }
+
+    def __str__(self):
+        return "{} bytes in {:.1f}s ({:.2f} MB/s) from/to {}".format(
+            self.bytes, self.elapsed, self.throughput / (1024 * 1024),
+            self.url)
+
+
+def get_session(auth=None, pool_size=POOL_SIZE):
+    """Return a keep-alive ``requests.Session`` shared by every transfer of
+    the process using the same credentials.
+
+    Args:
+        auth (tuple): (username, password) for HTTP basic authentication
+        pool_size (int): connections kept open per host
+
+    Returns:
+        requests.Session
+    """
+    key = (auth, pool_size)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if auth is not None:
+                session.auth = requests.auth.HTTPBasicAuth(*auth)
+            _sessions[key] = session
+    return session
+
+
+def request(method, url, session=None, auth=None, timeout=TIMEOUT, **kwargs):
+    """Issue an HTTP request through a pooled session."""
+    session = session or get_session(auth)
+    return session.request(method, url, timeout=timeout, **kwargs)
+
+
+def get_expected_length(response):
+    """Return the size of the body announced by ``response``, None if it is
+    unknown or refers to the encoded body."""
+    length = response.headers.get("Content-Length")
+    if length is None or response.headers.get("Content-Encoding"):
+        return None
+    return int(length)
+
+
+def get_content_range(response):
+    """Parse the Content-Range header of ``response`` into a
+    (first byte, total size) tuple, None for the parts that are unknown."""
+    value = response.headers.get("Content-Range", "")
+    match = re.match(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)", value)
+    if match is None:
+        return None, None
+    first, total = match.groups()
+    return (int(first) if first is not None else None,
+            int(total) if total != "*" else None)
+
+
+def _read_part_validators(part_path):
+    try:
+        with open(part_path + ".json") as fh:
+            return json.load(fh)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_part_validators(part_path, response):
+    with open(part_path + ".json", "w") as fh:
+        json.dump({
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }, fh)
+
+
+def _remove_part(part_path):
+    for path in (part_path, part_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def file_md5(path, buffer_size=BUFFER_SIZE):
+    md5 = hashlib.md5()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(buffer_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def download(url, destination, session=None, auth=None, headers=None,
+             buffer_size=BUFFER_SIZE, timeout=TIMEOUT, resume=False,
+             expected_size=None, md5=None):
+    """Stream ``url`` to ``destination``.
+
+    The body is written to ``<destination>.part`` and only renamed into place
+    once it is complete, so an interrupted transfer never leaves a truncated
+    file behind. With ``resume`` the partial file of a previous attempt is
+    kept and only its missing bytes are requested with a Range header; the
+    server sends the whole file again if it does not support ranges or if
+    the resource changed in the meantime (If-Range).
+
+    Args:
+        url (str): resource to download
+        destination (str): target file, or directory in which the file is
+            saved under the last component of the url
+        session (requests.Session): session to use, a pooled one by default
+        auth (tuple): (username, password) for HTTP basic authentication
+        headers (dict): additional request headers
+        buffer_size (int): size of the chunks read from the network
+        timeout (tuple): (connect, read) timeouts in seconds
+        resume (bool): continue from the partial file of a previous attempt
+        expected_size (int): size the downloaded file must have
+        md5 (str): hex digest the downloaded file must have
+
+    Returns:
+        TransferStats: ``path`` is None if the server answered 304 Not Modified
+    """
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, url.rpartition("/")[-1])
+    part_path = destination + PART_SUFFIX
+    headers = dict(headers or {})
+    offset = 0
+    if resume:
+        # ranges are meaningless on a content-encoded body
+        headers["Accept-Encoding"] = "identity"
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+    if offset:
+        headers["Range"] = "bytes={}-".format(offset)
+        validators = _read_part_validators(part_path)
+        if_range = validators.get("etag") or validators.get("last_modified")
+        if if_range:
+            headers["If-Range"] = if_range
+    stats = TransferStats(url)
+    response = request("GET", url, session=session, auth=auth,
+                       headers=headers, timeout=timeout, stream=True)
+    try:
+        stats.status_code = response.status_code
+        stats.headers = response.headers
+        if response.status_code == 304:
+            return stats.finish()
+        if response.status_code == 416:
+            # nothing left to fetch if the partial file is already complete
+            first, total = get_content_range(response)
+            if total is None or total != offset:
+                _remove_part(part_path)
+                raise TransferError(
+                    "Cannot resume {} from byte {}, partial file removed".format(
+                        url, offset))
+            log.info("{} already fully downloaded".format(part_path))
+            expected = total
+            mode = None
+        else:
+            response.raise_for_status()
+            expected = get_expected_length(response)
+            if response.status_code == 206:
+                first, total = get_content_range(response)
+                if first != offset:
+                    raise TransferError(
+                        "Asked {} from byte {}, got a range starting at {}".format(
+                            url, offset, first))
+                log.info("Resuming {} from byte {}".format(url, offset))
+                mode = "ab"
+                if expected is not None:
+                    expected += offset
+            else:
+                if offset:
+                    log.info("Range not honoured, downloading {} again".format(
+                        url))
+                offset = 0
+                mode = "wb"
+                if resume:
+                    _write_part_validators(part_path, response)
+        if mode is not None:
+            with open(part_path, mode) as fh:
+                for chunk in response.iter_content(chunk_size=buffer_size):
+                    fh.write(chunk)
+                    stats.update(len(chunk))
+    finally:
+        response.close()
+    size = os.path.getsize(part_path)
+    for announced in (expected, expected_size):
+        if announced is not None and size != announced:
+            if size > announced:
+                _remove_part(part_path)
+            raise TransferError(
+                "Incomplete download of {}: got {} of {} bytes".format(
+                    url, size, announced))
+    if md5 is not None and file_md5(part_path, buffer_size) != md5.lower():
+        # a complete but corrupt file cannot be resumed
+        _remove_part(part_path)
+        raise TransferError("Checksum mismatch for {}".format(url))
+    os.rename(part_path, destination)
+    _remove_part(part_path)
+    stats.path = destination
+    stats.finish()
+    log.info("Downloaded {}".format(stats))
+    return stats
+
+
+class UploadStream(object):
+    """File-like reader over the content of a file, counting the bytes read
+    by the HTTP client. Its length lets requests send a Content-Length
+    header instead of falling back to chunked encoding, and httplib streams
+    it with read() calls of its own block size."""
+
+    def __init__(self, path, stats, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.stats = stats
+        self.buffer_size = buffer_size
+        self.size = os.path.getsize(path)
+        self.fh = open(path, "rb")
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        chunk = self.fh.read(size)
+        self.stats.update(len(chunk))
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.buffer_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.fh.close()
+
+
+def upload(url, path, session=None, auth=None, headers=None, method="POST",
+           buffer_size=BUFFER_SIZE, timeout=TIMEOUT):
+    """Stream the file at ``path`` as the body of a request to ``url``.
+
+    Args:
+        url (str): target of the request
+        path (str): file to upload
+        session (requests.Session): session to use, a pooled one by default
+        auth (tuple): (username, password) for HTTP basic authentication
+        headers (dict): additional request headers
+        method (str): HTTP method
+        buffer_size (int): size of the chunks read from the file
+        timeout (tuple): (connect, read) timeouts in seconds
+
+    Returns:
+        tuple: the ``requests.Response`` and the TransferStats of the upload
+    """
+    stats = TransferStats(url, path)
+    stream = UploadStream(path, stats, buffer_size)
+    try:
+        response = request(method, url, session=session, auth=auth,
+                           headers=headers, timeout=timeout, data=stream)
+    finally:
+        stream.close()
+    stats.status_code = response.status_code
+    stats.headers = response.headers
+    stats.finish()
+    log.info("Uploaded {}".format(stats))
+    return response, stats
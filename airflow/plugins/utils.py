@@ -29,6 +29,9 @@ import os
 import logging
 import fnmatch
 import pprint
+import time
+import traceback
+from multiprocessing import Pool
 from airflow.operators import BaseOperator
 from airflow.plugins_manager import AirflowPlugin
 from airflow.utils.decorators import apply_defaults
@@ -60,6 +63,91 @@ class TemplatesResolver:
         return self.j2_env.get_template('sentinel2_metadata.xml').render(metadata_dict)
 
 
+def slot_task_id(task_id, slot):
+    """Task id of a task of the chain of tasks of product slot ``slot`` (see
+    product_slots in the collection configs), None being the chain
+    processing all the products."""
+    if slot is None:
+        return task_id
+    return "{}_slot_{}".format(task_id, slot)
+
+
+class ProductError(RuntimeError):
+    """Processing of one of the products of an operator failed."""
+
+    def __init__(self, operation, product, details):
+        super(ProductError, self).__init__(
+            "{} failed on {}:\n{}".format(operation, product, details))
+        self.operation = operation
+        self.product = product
+        self.details = details
+
+
+def _run_product_task(task):
+    index, function, args = task
+    start = time.time()
+    try:
+        return index, function(*args), time.time() - start, None
+    except Exception:
+        return index, None, time.time() - start, traceback.format_exc()
+
+
+def map_products(operation, function, products, arguments, max_workers=1,
+                 continue_on_error=False, timings=None):
+    """Call ``function(*args)`` for each product and its ``args`` in
+    ``arguments``, in a pool of up to ``max_workers`` processes.
+
+    Args:
+        operation (str): name of the processing, for the logs
+        function (callable): module level function processing one product
+        products (list): the products, used to report errors
+        arguments (list): arguments of each call, in the order of products
+        max_workers (int): number of products processed concurrently
+        continue_on_error (bool): log the failing products and go on with the
+            others instead of failing on the first one
+        timings (list): receives the processing time of each product, in
+            the order of ``products``
+
+    Returns:
+        list: the results, in the order of ``products``. Failed products have
+        a None result
+
+    Raises:
+        ProductError: on the first product failing, unless continue_on_error
+            is set. The products still being processed are abandoned
+    """
+    tasks = [(index, function, args) for index, args in enumerate(arguments)]
+    results = [None] * len(tasks)
+    if timings is not None:
+        timings[:] = [None] * len(tasks)
+    pool = None
+    if max_workers > 1 and len(tasks) > 1:
+        pool = Pool(min(max_workers, len(tasks)))
+        done = pool.imap_unordered(_run_product_task, tasks)
+    else:
+        done = (_run_product_task(task) for task in tasks)
+    try:
+        for index, result, elapsed, error in done:
+            if timings is not None:
+                timings[index] = elapsed
+            if error is not None:
+                if not continue_on_error:
+                    log.error("{} failed on {}".format(
+                        operation, products[index]))
+                    raise ProductError(operation, products[index], error)
+                log.error("{} failed on {}, skipping it:\n{}".format(
+                    operation, products[index], error))
+                continue
+            results[index] = result
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return results
+
+
 class MoveFilesOperator(BaseOperator):
     @apply_defaults
     def __init__(self, src_dir, dst_dir, filter, *args, **kwargs):